@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""广播编码基准：每个接收者各自 json.dumps 与只编码一次（EncodedFrame）的对比"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, os.path.join(project_root, "server", "src"))
+
+from fanout import FanoutEngine, EncodedFrame
+
+CONNECTION_COUNTS = [1_000, 10_000, 50_000]
+
+
+class FakeWebSocket:
+    """只做编码、不做网络IO的假连接，编码方式与 starlette 一致"""
+
+    def __init__(self):
+        self.bytes_sent = 0
+
+    async def send_json(self, data):
+        text = json.dumps(data, separators=(",", ":"))
+        self.bytes_sent += len(text)
+
+    async def send_text(self, text):
+        self.bytes_sent += len(text)
+
+
+def make_message():
+    return {
+        "type": "group_message",
+        "data": {
+            "id": 123456,
+            "content": "大家好，这是一条用于测试广播编码开销的群聊消息。" * 4,
+            "message_type": "public",
+            "sender_id": 42,
+            "sender_username": "benchmark_user",
+            "receiver_id": None,
+            "group_id": None,
+            "timestamp": "2024-01-01T12:00:00.000000"
+        }
+    }
+
+
+async def run_broadcast(connection_count: int, encode_once: bool) -> float:
+    engine = FanoutEngine(max_queue_size=16)
+    sockets = [FakeWebSocket() for _ in range(connection_count)]
+    for user_id, websocket in enumerate(sockets):
+        engine.register(user_id, websocket)
+
+    message = make_message()
+    start = time.perf_counter()
+    frame = EncodedFrame(message) if encode_once else message
+    engine.broadcast(frame)
+    # 等待所有写协程把队列发完
+    while any(sender.queue.qsize() for sender in engine.senders.values()):
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+
+    for user_id in list(engine.senders):
+        engine.unregister(user_id)
+    await asyncio.sleep(0)
+    return elapsed
+
+
+async def main():
+    print(f"{'连接数':>10} {'逐个编码(ms)':>14} {'编码一次(ms)':>14} {'加速比':>8}")
+    for connection_count in CONNECTION_COUNTS:
+        per_recipient = await run_broadcast(connection_count, encode_once=False)
+        encode_once = await run_broadcast(connection_count, encode_once=True)
+        print(f"{connection_count:>10} {per_recipient * 1000:>14.1f} {encode_once * 1000:>14.1f} "
+              f"{per_recipient / encode_once:>7.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""事件循环延迟基准：在 async 处理函数中直接提交数据库与经 DatabaseExecutor 提交的对比"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, os.path.join(project_root, "server", "src"))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models.user import Base, User, Message
+from db_executor import DatabaseExecutor
+from loop_monitor import LoopLagMonitor
+
+CONCURRENT_HANDLERS = 20
+MESSAGES_PER_HANDLER = 50
+
+
+def make_session_factory(db_path: str):
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = SessionLocal()
+    db.add(User(username="bench", email="bench@test.com", hashed_password="x"))
+    db.commit()
+    db.close()
+    return SessionLocal
+
+
+def save_message(db, content: str):
+    db_message = Message(content=content, message_type="private", sender_id=1,
+                         receiver_id=1, timestamp=datetime.utcnow())
+    db.add(db_message)
+    db.commit()
+    db.refresh(db_message)
+    return db_message.id
+
+
+async def handler(SessionLocal, executor, handler_id: int):
+    for i in range(MESSAGES_PER_HANDLER):
+        content = f"handler {handler_id} message {i}"
+        if executor:
+            await executor.run_in_session(save_message, content)
+        else:
+            db = SessionLocal()
+            try:
+                save_message(db, content)
+            finally:
+                db.close()
+            await asyncio.sleep(0)
+
+
+async def run(use_executor: bool) -> dict:
+    db_path = tempfile.mktemp(suffix=".db")
+    SessionLocal = make_session_factory(db_path)
+    executor = DatabaseExecutor(SessionLocal, max_workers=5) if use_executor else None
+    monitor = LoopLagMonitor(interval=0.005)
+    monitor.start()
+    await asyncio.sleep(0.05)
+    monitor.reset()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(handler(SessionLocal, executor, i) for i in range(CONCURRENT_HANDLERS)))
+    elapsed = time.perf_counter() - start
+
+    await monitor.stop()
+    if executor:
+        executor.shutdown()
+    os.remove(db_path)
+    total = CONCURRENT_HANDLERS * MESSAGES_PER_HANDLER
+    return {"msgs_per_sec": total / elapsed, **monitor.stats()}
+
+
+async def main():
+    print(f"并发处理函数: {CONCURRENT_HANDLERS}, 每个写入消息: {MESSAGES_PER_HANDLER}")
+    for name, use_executor in (("事件循环内同步提交", False), ("DatabaseExecutor", True)):
+        result = await run(use_executor)
+        print(f"{name:<20} 吞吐 {result['msgs_per_sec']:>8.0f} msg/s  "
+              f"循环延迟 avg {result['avg_ms']:>7.2f}ms  p99 {result['p99_ms']:>7.2f}ms  "
+              f"max {result['max_ms']:>7.2f}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
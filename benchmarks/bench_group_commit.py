@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""消息写入吞吐基准：每条消息单独提交与 MessageWriter 批量提交（group commit）的对比"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, os.path.join(project_root, "server", "src"))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models.user import Base, User, Message
+from db_executor import DatabaseExecutor
+from message_writer import MessageWriter
+
+CONCURRENT_SENDERS = 200
+MESSAGES_PER_SENDER = 20
+
+
+def make_session_factory(db_path: str):
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = SessionLocal()
+    db.add(User(username="bench", email="bench@test.com", hashed_password="x"))
+    db.commit()
+    db.close()
+    return SessionLocal
+
+
+def new_message(sender: int, i: int) -> Message:
+    return Message(content=f"sender {sender} message {i}", message_type="private",
+                   sender_id=1, receiver_id=1, timestamp=datetime.utcnow())
+
+
+def save_message(db, db_message: Message) -> Message:
+    db.add(db_message)
+    db.commit()
+    db.refresh(db_message)
+    return db_message
+
+
+async def run(mode: str, window_ms: float = 2.0) -> dict:
+    db_path = tempfile.mktemp(suffix=".db")
+    SessionLocal = make_session_factory(db_path)
+    executor = DatabaseExecutor(SessionLocal, max_workers=5)
+    writer = MessageWriter(executor, window_ms=window_ms) if mode == "batch" else None
+    latencies = []
+
+    async def sender(sender_id: int):
+        for i in range(MESSAGES_PER_SENDER):
+            start = time.perf_counter()
+            if writer:
+                saved = await writer.submit(new_message(sender_id, i))
+            else:
+                saved = await executor.run_in_session(save_message, new_message(sender_id, i))
+            assert saved.id is not None
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(sender(i) for i in range(CONCURRENT_SENDERS)))
+    elapsed = time.perf_counter() - start
+
+    stats = writer.stats() if writer else {}
+    if writer:
+        await writer.stop()
+    executor.shutdown()
+    os.remove(db_path)
+
+    latencies.sort()
+    total = CONCURRENT_SENDERS * MESSAGES_PER_SENDER
+    return {
+        "msgs_per_sec": total / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+        "avg_batch_size": stats.get("avg_batch_size", 1)
+    }
+
+
+async def main():
+    print(f"并发发送者: {CONCURRENT_SENDERS}, 每个发送消息: {MESSAGES_PER_SENDER}")
+    cases = [("逐条提交", "single", 0), ("批量提交 window=0ms", "batch", 0), ("批量提交 window=2ms", "batch", 2.0)]
+    for name, mode, window_ms in cases:
+        result = await run(mode, window_ms)
+        print(f"{name:<22} 吞吐 {result['msgs_per_sec']:>8.0f} msg/s  "
+              f"确认延迟 p50 {result['p50_ms']:>7.2f}ms  p99 {result['p99_ms']:>8.2f}ms  "
+              f"平均批大小 {result['avg_batch_size']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""会话历史分页基准：在生成的大表（默认 1000 万行）上对比 OFFSET 翻页与 (timestamp, id) 键集分页
+
+用法: python benchmarks/bench_history_pagination.py [--rows 10000000] [--db /path/to/bench.db]
+生成的数据库会保留，再次运行同一路径时直接复用。
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, os.path.join(project_root, "server", "src"))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from models.user import Base, Message
+from services.message_service import MessageService
+
+USERS = 1000
+GROUPS = 50
+PAGE_SIZE = 50
+PAGES = 20
+REPEAT = 5
+INSERT_CHUNK = 100000
+
+
+def generate(db_path: str, rows: int):
+    """直接用 sqlite3 批量写入，建表和索引与 ORM 模型一致"""
+    engine = create_engine(f"sqlite:///{db_path}")
+    Base.metadata.create_all(bind=engine)
+    engine.dispose()
+
+    conn = sqlite3.connect(db_path)
+    if conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0] >= rows:
+        conn.close()
+        return
+    print(f"⏳ 生成 {rows:,} 条消息...")
+    start = time.perf_counter()
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("DELETE FROM messages")
+    conn.executemany("INSERT OR IGNORE INTO users (id, username, email, hashed_password) VALUES (?, ?, ?, 'x')",
+                     [(i, f"user{i}", f"user{i}@test.com") for i in range(1, USERS + 1)])
+    conn.executemany("INSERT OR IGNORE INTO groups (id, name, created_by) VALUES (?, ?, 1)",
+                     [(i, f"group{i}") for i in range(1, GROUPS + 1)])
+
+    rng = random.Random(42)
+    base = datetime(2024, 1, 1)
+    # 私聊集中在少量热门会话上，保证被测会话有足够深的历史
+    hot_pairs = [(1, 2), (2, 1), (3, 4), (4, 3)]
+
+    def rows_iter(offset: int, count: int):
+        for i in range(offset, offset + count):
+            timestamp = (base + timedelta(seconds=i // 3)).isoformat(sep=" ")
+            kind = rng.random()
+            if kind < 0.1:
+                sender, receiver = hot_pairs[rng.randrange(4)]
+                yield (f"message {i}", "text", sender, receiver, None, timestamp)
+            elif kind < 0.7:
+                sender, receiver = rng.randint(1, USERS), rng.randint(1, USERS)
+                yield (f"message {i}", "text", sender, receiver, None, timestamp)
+            elif kind < 0.95:
+                yield (f"message {i}", "text", rng.randint(1, USERS), None, rng.randint(1, GROUPS), timestamp)
+            else:
+                yield (f"message {i}", "text", rng.randint(1, USERS), None, None, timestamp)
+
+    for offset in range(0, rows, INSERT_CHUNK):
+        conn.executemany(
+            "INSERT INTO messages (content, message_type, sender_id, receiver_id, group_id, timestamp, "
+            "is_read, delivered) VALUES (?, ?, ?, ?, ?, ?, 0, 1)",
+            rows_iter(offset, min(INSERT_CHUNK, rows - offset))
+        )
+        conn.commit()
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+    print(f"✅ 生成完成，用时 {time.perf_counter() - start:.1f}s")
+
+
+def offset_pages(db, user_id: int, peer_id: int):
+    """原来的做法：OR 过滤 + ORDER BY timestamp + OFFSET 翻页"""
+    for page in range(PAGES):
+        db.query(Message).filter(
+            ((Message.sender_id == user_id) & (Message.receiver_id == peer_id)) |
+            ((Message.sender_id == peer_id) & (Message.receiver_id == user_id))
+        ).order_by(Message.timestamp.desc(), Message.id.desc()).offset(page * PAGE_SIZE).limit(PAGE_SIZE).all()
+
+
+def keyset_pages(db, user_id: int = None, peer_id: int = None, group_id: int = None):
+    service = MessageService(db)
+    before = None
+    for _ in range(PAGES):
+        messages, has_more = service.get_conversation_page(user_id, peer_id, group_id, before=before,
+                                                           limit=PAGE_SIZE)
+        if not has_more:
+            break
+        first = messages[0]
+        before = (datetime.fromisoformat(first["timestamp"]), first["id"])
+
+
+def measure(label: str, func, *args) -> float:
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    per_page = min(timings) / PAGES * 1000
+    print(f"{label:<28} 每页 {per_page:8.3f} ms")
+    return per_page
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--db", default=os.path.join(tempfile.gettempdir(), "ims_history_bench.db"))
+    args = parser.parse_args()
+
+    generate(args.db, args.rows)
+    engine = create_engine(f"sqlite:///{args.db}")
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = SessionLocal()
+
+    total = db.execute(text("SELECT COUNT(*) FROM messages")).scalar()
+    print(f"\n📊 messages 表 {total:,} 行，连续翻 {PAGES} 页，每页 {PAGE_SIZE} 条（取 {REPEAT} 次最优）")
+
+    plan = db.execute(text(
+        "EXPLAIN QUERY PLAN SELECT timestamp, id FROM messages "
+        "WHERE sender_id = 1 AND receiver_id = 2 AND (timestamp, id) < ('2030-01-01', 0) "
+        "ORDER BY timestamp DESC, id DESC LIMIT 51"
+    )).fetchall()
+    print("   键集查询计划:", "; ".join(row[-1] for row in plan))
+
+    old = measure("OFFSET 翻页（私聊）", offset_pages, db, 1, 2)
+    new = measure("键集分页（私聊）", keyset_pages, db, 1, 2)
+    measure("键集分页（群聊）", keyset_pages, db, None, None, 1)
+    measure("键集分页（公共消息）", keyset_pages, db, None, None, None)
+    print(f"\n🚀 私聊翻页加速 {old / new:.1f}x")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""日志开销基准：私聊消息和公共广播经 ConnectionManager 处理的吞吐，对比不同日志级别
+
+- 关闭：LOG_LEVEL=WARNING，逐条消息的日志在级别判断处返回
+- INFO：默认配置
+- DEBUG 采样：每 100 条 DEBUG 事件记录 1 条
+- DEBUG 全量（队列）：全部记录，由后台线程写出
+- DEBUG 全量（同步）：全部记录，在事件循环中直接写出，相当于原来的 print
+
+日志写到 /dev/null，测的是格式化和写出调用本身的开销。
+"""
+import asyncio
+import logging
+import os
+import sys
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, os.path.join(project_root, "server", "src"))
+
+import app_logging
+from app_logging import ROOT_LOGGER, LOG_FORMAT, setup_logging, shutdown_logging, logging_stats
+from connection_manager import ConnectionManager
+from shared.protocols import WSMessage, WSMessageTypes
+
+PRIVATE_MESSAGES = 20_000
+BROADCAST_MESSAGES = 200
+CONNECTIONS = 1_000
+
+
+class FakeWebSocket:
+    async def send_text(self, text):
+        pass
+
+    async def send_json(self, data):
+        pass
+
+
+class FakeWriter:
+    """代替 MessageWriter，只分配消息ID，不访问数据库"""
+
+    def __init__(self):
+        self.next_id = 0
+
+    async def submit(self, message):
+        self.next_id += 1
+        message.id = self.next_id
+        return message
+
+
+class BenchUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.username = f"user{user_id}"
+
+
+def configure(mode: str, devnull):
+    stdout = sys.stdout
+    sys.stdout = devnull
+    try:
+        if mode == "off":
+            setup_logging("WARNING")
+        elif mode == "info":
+            setup_logging("INFO")
+        elif mode == "debug_sampled":
+            setup_logging("DEBUG", sample_every=100)
+        elif mode == "debug_all":
+            setup_logging("DEBUG", queue_size=1_000_000, sample_every=1)
+        else:
+            shutdown_logging()
+            root = logging.getLogger(ROOT_LOGGER)
+            root.setLevel(logging.DEBUG)
+            root.propagate = False
+            handler = logging.StreamHandler(devnull)
+            handler.setFormatter(logging.Formatter(LOG_FORMAT))
+            root.addHandler(handler)
+            app_logging._sample_every = 1
+            return handler
+    finally:
+        sys.stdout = stdout
+    return None
+
+
+async def run(mode: str, devnull) -> dict:
+    sync_handler = configure(mode, devnull)
+    manager = ConnectionManager(message_writer=FakeWriter())
+    users = [BenchUser(i) for i in range(1, CONNECTIONS + 1)]
+    for user in users:
+        await manager.connect(FakeWebSocket(), user)
+    await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    for i in range(PRIVATE_MESSAGES):
+        sender = users[i % CONNECTIONS]
+        receiver = users[(i + 1) % CONNECTIONS]
+        message = WSMessage(type=WSMessageTypes.MESSAGE_SEND,
+                            data={"content": f"message {i}", "receiver_id": receiver.id})
+        await manager.handle_message_send(message, sender, None)
+        if i % 500 == 0:
+            await asyncio.sleep(0)
+    private_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(BROADCAST_MESSAGES):
+        message = WSMessage(type=WSMessageTypes.MESSAGE_SEND,
+                            data={"content": f"broadcast {i}", "message_type": "public"})
+        await manager.handle_message_send(message, users[0], None)
+        await asyncio.sleep(0)
+    broadcast_elapsed = time.perf_counter() - start
+
+    for user in users:
+        manager.disconnect(user)
+    await asyncio.sleep(0)
+
+    stats = logging_stats()
+    if sync_handler:
+        logging.getLogger(ROOT_LOGGER).removeHandler(sync_handler)
+    else:
+        shutdown_logging()
+    return {
+        "private": PRIVATE_MESSAGES / private_elapsed,
+        "broadcast": BROADCAST_MESSAGES / broadcast_elapsed,
+        "dropped": stats["dropped"]
+    }
+
+
+async def main():
+    modes = [
+        ("off", "关闭"),
+        ("info", "INFO"),
+        ("debug_sampled", "DEBUG 采样 1/100"),
+        ("debug_all", "DEBUG 全量（队列）"),
+        ("debug_sync", "DEBUG 全量（同步）"),
+    ]
+    print(f"私聊 {PRIVATE_MESSAGES} 条，{CONNECTIONS} 个连接上广播 {BROADCAST_MESSAGES} 条")
+    print(f"{'日志模式':<18} {'私聊(条/秒)':>12} {'广播(条/秒)':>12} {'丢弃日志':>10}")
+    with open(os.devnull, "w") as devnull:
+        # 预热一轮，避免第一种模式吃亏
+        await run("off", devnull)
+        baseline = None
+        for mode, label in modes:
+            result = await run(mode, devnull)
+            baseline = baseline or result
+            print(f"{label:<18} {result['private']:>12.0f} {result['broadcast']:>12.0f} {result['dropped']:>10}"
+                  f"   (私聊为关闭时的 {result['private'] / baseline['private']:.0%})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""上传风暴下的心跳延迟基准：文件读写放到 FileIOExecutor 与在事件循环中直接读写磁盘的对比
+
+启动真实服务端（子进程、临时 SQLite），一个 WebSocket 客户端持续发送 ping 并记录 pong 往返时间，
+同时并发上传大文件。对照组使用额外注册的 /bench/upload-inline 接口，复现旧的同步拷贝实现。
+
+用法: python benchmarks/bench_upload_ping_latency.py
+"""
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+
+CONCURRENT_UPLOADS = 16
+UPLOAD_SIZE = 4 * 1024 * 1024
+DURATION_SECONDS = 8.0
+PING_INTERVAL = 0.02
+
+
+def serve(port: int):
+    """子进程入口：启动服务端并注册对照接口"""
+    sys.path.insert(0, os.path.join(project_root, "server", "src"))
+    sys.path.insert(0, os.path.join(project_root, "server"))
+    import uvicorn
+    from fastapi import File, Request, UploadFile
+
+    import main
+    from blob_store import BlobStore
+    from file_io import FileIOExecutor
+    from upload_manager import ChunkedUploadManager
+    from services.auth_service import pwd_context
+
+    class InlineFileIO(FileIOExecutor):
+        """对照组：直接在事件循环中执行文件操作"""
+
+        async def run(self, func, *args, **kwargs):
+            self.operations += 1
+            return func(*args, **kwargs)
+
+    inline_io = InlineFileIO()
+    inline_blobs = BlobStore(main.UPLOAD_DIR, main.db_executor, inline_io)
+    inline_uploads = ChunkedUploadManager(main.UPLOAD_DIR, inline_blobs, inline_io)
+
+    @main.app.post("/bench/upload-inline")
+    async def upload_inline(file: UploadFile = File(...)):
+        # 旧实现：在事件循环中同步拷贝文件并计算哈希
+        sha256, _, size = await inline_blobs.store_stream(file.file)
+        return {"sha256": sha256, "file_size": size}
+
+    @main.app.post("/bench/inline/uploads")
+    async def create_inline_upload(upload_data: dict):
+        return (await inline_uploads.create(upload_data["sender_id"], upload_data["file_name"],
+                                            upload_data["file_size"])).to_dict()
+
+    @main.app.put("/bench/inline/uploads/{upload_id}/chunks/{index}")
+    async def upload_inline_chunk(upload_id: str, index: int, request: Request):
+        return (await inline_uploads.write_chunk(upload_id, index, request.stream())).to_dict()
+
+    @main.app.post("/bench/inline/uploads/{upload_id}/complete")
+    async def complete_inline_upload(upload_id: str, complete_data: dict):
+        return (await inline_uploads.complete(upload_id, complete_data["sender_id"])).to_dict()
+
+    db = main.SessionLocal()
+    for name in ("sender", "receiver"):
+        db.add(main.User(username=name, email=f"{name}@test.com", hashed_password=pwd_context.hash("x")))
+    db.commit()
+    db.close()
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(work_dir: str, port: int) -> subprocess.Popen:
+    env = dict(os.environ, SQLITE_PATH=os.path.join(work_dir, "bench.db"))
+    # 服务端输出写入工作目录，便于排查失败的请求
+    log = open(os.path.join(work_dir, "server.log"), "wb")
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", str(port)],
+        cwd=work_dir, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    import requests
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/health", timeout=1).ok:
+                return process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("服务端启动超时")
+
+
+async def ping_loop(port: int, token: str, stop: asyncio.Event) -> list:
+    import websockets
+    samples = []
+    async with websockets.connect(f"ws://127.0.0.1:{port}/ws/1?token={token}", max_size=None) as ws:
+        while not stop.is_set():
+            sent = time.perf_counter()
+            await ws.send(json.dumps({"type": "ping", "data": {}}))
+            while True:
+                reply = json.loads(await ws.recv())
+                if reply.get("type") == "pong":
+                    break
+            samples.append((time.perf_counter() - sent) * 1000)
+            await asyncio.sleep(PING_INTERVAL)
+    return samples
+
+
+async def upload_multipart(client, url: str, data: bytes):
+    response = await client.post(url, files={"file": ("bench.bin", data, "application/octet-stream")},
+                                 data={"sender_id": "1", "receiver_id": "2"})
+    response.raise_for_status()
+
+
+async def upload_chunked(client, url: str, data: bytes):
+    response = await client.post(url, json={"sender_id": 1, "file_name": "bench.bin", "file_size": len(data)})
+    response.raise_for_status()
+    upload = response.json()
+    chunk_size = upload["chunk_size"]
+    for index in range(upload["total_chunks"]):
+        piece = data[index * chunk_size:(index + 1) * chunk_size]
+        response = await client.put(f"{url}/{upload['upload_id']}/chunks/{index}", content=piece)
+        response.raise_for_status()
+    response = await client.post(f"{url}/{upload['upload_id']}/complete", json={"sender_id": 1})
+    response.raise_for_status()
+
+
+async def upload_loop(client, upload, url: str, payload: bytes, stop: asyncio.Event) -> int:
+    count = 0
+    while not stop.is_set():
+        # 每次改动开头几个字节，避免命中去重
+        await upload(client, url, count.to_bytes(8, "big") + payload[8:])
+        count += 1
+    return count
+
+
+async def run_case(port: int, upload, path: str, payloads: list) -> dict:
+    import httpx
+    stop = asyncio.Event()
+    url = f"http://127.0.0.1:{port}{path}"
+    async with httpx.AsyncClient(timeout=120) as client:
+        login = await client.post(f"http://127.0.0.1:{port}/login", json={"username": "sender", "password": "x"})
+        pinger = asyncio.create_task(ping_loop(port, login.json()["access_token"], stop))
+        uploaders = [asyncio.create_task(upload_loop(client, upload, url, payload, stop)) for payload in payloads]
+        await asyncio.sleep(DURATION_SECONDS)
+        stop.set()
+        uploads = sum(await asyncio.gather(*uploaders))
+        samples = await pinger
+    samples.sort()
+    return {
+        "uploads": uploads,
+        "pings": len(samples),
+        "p50": statistics.median(samples),
+        "p99": samples[int(len(samples) * 0.99) - 1] if len(samples) >= 100 else samples[-1],
+        "max": samples[-1]
+    }
+
+
+def main():
+    payloads = [os.urandom(UPLOAD_SIZE) for _ in range(CONCURRENT_UPLOADS)]
+    print(f"📊 {CONCURRENT_UPLOADS} 个并发上传，每个 {UPLOAD_SIZE // (1024 * 1024)} MB，持续 {DURATION_SECONDS:.0f} 秒")
+    cases = (
+        ("表单上传 / 事件循环内读写", upload_multipart, "/bench/upload-inline"),
+        ("表单上传 / FileIOExecutor", upload_multipart, "/upload-file"),
+        ("分块上传 / 事件循环内读写", upload_chunked, "/bench/inline/uploads"),
+        ("分块上传 / FileIOExecutor", upload_chunked, "/uploads"),
+    )
+    results = {}
+    for name, upload, path in cases:
+        work_dir = tempfile.mkdtemp(prefix="bench_upload_")
+        port = free_port()
+        process = start_server(work_dir, port)
+        try:
+            results[name] = asyncio.run(run_case(port, upload, path, payloads))
+        finally:
+            process.terminate()
+            process.wait()
+        r = results[name]
+        print(f"{name:<22} 上传 {r['uploads']:>4} 次  心跳 {r['pings']:>4} 次  "
+              f"p50 {r['p50']:>7.2f} ms  p99 {r['p99']:>8.2f} ms  max {r['max']:>8.2f} ms")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--serve":
+        serve(int(sys.argv[2]))
+    else:
+        main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""帧格式基准：JSON 文本帧与 MessagePack 二进制帧（chat.msgpack.v1）的字节数和编解码耗时对比
+
+服务端广播时每种格式只编码一次，接收端每帧解码一次，所以分别统计编码和解码。
+"""
+import os
+import sys
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, os.path.join(project_root, "server", "src"))
+
+from shared import wire_format
+from shared.wire_format import SUBPROTOCOL_MSGPACK
+
+ITERATIONS = 20_000
+
+
+def message_data(i: int) -> dict:
+    return {
+        "id": 1_000_000 + i,
+        "content": "今晚七点开会，记得带上周的数据",
+        "message_type": "private",
+        "sender_id": 42,
+        "sender_username": "benchmark_user",
+        "receiver_id": 43,
+        "group_id": None,
+        "timestamp": "2024-01-01T12:00:00.123456"
+    }
+
+
+SAMPLES = {
+    "私聊消息": {"type": "private_message", "data": message_data(0)},
+    "发送确认": {"type": "message_sent", "data": {**message_data(0), "delivered": True, "receiver_online": True}},
+    "上线状态": {"type": "user_status_update",
+                 "data": {"user_id": 42, "username": "benchmark_user", "status": "online"}},
+    "输入状态": {"type": "typing_start", "data": {"user_id": 42, "receiver_id": 43, "expires_in": 5.0}},
+    "心跳响应": {"type": "pong", "data": {"timestamp": 123456.789}},
+    "离线补发100条": {"type": "offline_messages",
+                    "data": {"messages": [message_data(i) for i in range(100)], "has_more": True}},
+}
+
+
+def measure(func, arg, iterations: int) -> float:
+    """返回每次调用的平均耗时（微秒）"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(arg)
+    return (time.perf_counter() - start) / iterations * 1_000_000
+
+
+def main():
+    if wire_format.msgpack is None:
+        print("⚠️  未安装 msgpack，无法对比（pip install msgpack）")
+        return
+    print(f"{'帧':<14} {'JSON字节':>9} {'MsgPack字节':>11} {'节省':>6} "
+          f"{'JSON编码(us)':>12} {'MsgPack编码(us)':>15} {'JSON解码(us)':>12} {'MsgPack解码(us)':>15}")
+    for name, message in SAMPLES.items():
+        iterations = ITERATIONS // 20 if name.startswith("离线") else ITERATIONS
+        text = wire_format.encode(message)
+        binary = wire_format.encode(message, SUBPROTOCOL_MSGPACK)
+        assert wire_format.decode(binary) == wire_format.decode(text)
+        json_bytes = len(text.encode("utf-8"))
+        json_encode = measure(wire_format.encode_json, message, iterations)
+        msgpack_encode = measure(wire_format.encode_msgpack, message, iterations)
+        json_decode = measure(wire_format.decode, text, iterations)
+        msgpack_decode = measure(wire_format.decode, binary, iterations)
+        print(f"{name:<14} {json_bytes:>9} {len(binary):>11} {1 - len(binary) / json_bytes:>6.0%} "
+              f"{json_encode:>12.2f} {msgpack_encode:>15.2f} {json_decode:>12.2f} {msgpack_decode:>15.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""推送合并基准：繁忙房间里逐条发送与按周期合并成一帧（?batch=1）的帧数、CPU 和延迟对比
+
+一个房间 CONNECTIONS 个在线用户，每秒 EVENTS_PER_SECOND 条事件（聊天消息、输入状态、上线通知）
+广播给所有人。每个连接的帧写进一个 socketpair，每帧一次 send 系统调用，对端由事件循环读出丢弃，
+所以帧数就是系统调用次数。延迟是从入队到写进 socket 的时间。
+"""
+import asyncio
+import os
+import socket
+import sys
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, os.path.join(project_root, "server", "src"))
+
+from fanout import EncodedFrame, FanoutEngine
+from shared import wire_format
+from shared.wire_format import SUBPROTOCOL_MSGPACK
+
+CONNECTIONS = 100
+EVENTS_PER_SECOND = 1000
+DURATION = 2.0
+TICK = 0.001  # 事件产生的时间粒度
+
+
+class SocketWebSocket:
+    """把帧写进 socketpair 的假连接，记录每帧的写出时间"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.sock, self.peer = socket.socketpair()
+        self.sock.setblocking(False)
+        self.peer.setblocking(False)
+        loop.add_reader(self.peer.fileno(), self._drain)
+        self.bytes = 0
+        self.frames = []
+
+    def _drain(self):
+        try:
+            while self.peer.recv(1 << 16):
+                pass
+        except BlockingIOError:
+            pass
+
+    async def send_text(self, text: str):
+        await self._write(text.encode("utf-8"), text)
+
+    async def send_bytes(self, data: bytes):
+        await self._write(data, data)
+
+    async def send_json(self, data: dict):
+        await self.send_text(wire_format.encode_json(data))
+
+    async def _write(self, payload: bytes, frame):
+        await self.loop.sock_sendall(self.sock, payload)
+        self.bytes += len(payload)
+        self.frames.append((time.perf_counter(), frame))
+
+    def close(self):
+        self.loop.remove_reader(self.peer.fileno())
+        self.sock.close()
+        self.peer.close()
+
+
+def make_event(i: int) -> dict:
+    sent_at = time.perf_counter()
+    kind = i % 20
+    if kind < 12:
+        return {"type": "group_message", "data": {
+            "id": i, "content": f"大家看一下第 {i} 版的方案", "message_type": "group", "sender_id": i % CONNECTIONS,
+            "sender_username": f"user{i % CONNECTIONS}", "group_id": 1, "timestamp": "2024-01-01T12:00:00",
+            "sent_at": sent_at}}
+    if kind < 17:
+        return {"type": "typing_start", "data": {"id": i, "user_id": i % CONNECTIONS, "group_id": 1,
+                                                  "expires_in": 5.0, "sent_at": sent_at}}
+    return {"type": "user_status_update", "data": {"id": i, "user_id": i % CONNECTIONS,
+                                                    "username": f"user{i % CONNECTIONS}",
+                                                    "status": "online", "sent_at": sent_at}}
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(subprotocol, batch_interval) -> dict:
+    loop = asyncio.get_running_loop()
+    engine = FanoutEngine(max_queue_size=1_000_000, batch_interval=batch_interval)
+    sockets = []
+    for user_id in range(CONNECTIONS):
+        websocket = SocketWebSocket(loop)
+        sockets.append(websocket)
+        engine.register(user_id, websocket, subprotocol, batch=batch_interval is not None)
+
+    total_events = int(EVENTS_PER_SECOND * DURATION)
+    per_tick = max(1, int(EVENTS_PER_SECOND * TICK))
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    for i in range(total_events):
+        engine.broadcast(EncodedFrame(make_event(i)))
+        if (i + 1) % per_tick == 0:
+            # 按产生速率等到下一个时间点，处理不过来时不再等待
+            delay = start + (i + 1) / EVENTS_PER_SECOND - time.perf_counter()
+            await asyncio.sleep(max(delay, 0))
+    for user_id in range(CONNECTIONS):
+        await engine.flush(user_id)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+
+    latencies = []
+    frames = 0
+    total_bytes = 0
+    for websocket in sockets:
+        frames += len(websocket.frames)
+        total_bytes += websocket.bytes
+        for written_at, frame in websocket.frames:
+            for message in wire_format.unpack(wire_format.decode(frame)):
+                latencies.append(written_at - message["data"]["sent_at"])
+    latencies.sort()
+    for user_id, websocket in enumerate(sockets):
+        engine.unregister(user_id)
+        websocket.close()
+    return {
+        "deliveries": len(latencies),
+        "frames": frames,
+        "bytes": total_bytes,
+        "elapsed": elapsed,
+        "cpu": cpu,
+        "p50": percentile(latencies, 0.5) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+        "dropped": engine.total_dropped_count()
+    }
+
+
+async def main():
+    formats = [("JSON", None)]
+    if wire_format.msgpack is not None:
+        formats.append(("MsgPack", SUBPROTOCOL_MSGPACK))
+    modes = [("逐条发送", None), ("合并 5ms", 0.005), ("合并 10ms", 0.010), ("合并 25ms", 0.025)]
+    print(f"{CONNECTIONS} 个连接的房间，每秒 {EVENTS_PER_SECOND} 条广播事件，持续 {DURATION:.0f} 秒")
+    for name, subprotocol in formats:
+        print(f"\n{name}")
+        print(f"{'模式':<10} {'送达':>8} {'帧数(系统调用)':>14} {'字节':>11} {'耗时(s)':>8} {'CPU(s)':>7} "
+              f"{'p50(ms)':>8} {'p99(ms)':>8} {'丢弃':>5}")
+        for label, interval in modes:
+            result = await run(subprotocol, interval)
+            print(f"{label:<10} {result['deliveries']:>8} {result['frames']:>14} {result['bytes']:>11} "
+                  f"{result['elapsed']:>8.2f} {result['cpu']:>7.2f} {result['p50']:>8.1f} {result['p99']:>8.1f} "
+                  f"{result['dropped']:>5}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""WebSocket 压缩基准：不同 permessage-deflate 配置下，一个连接上一串典型帧的字节数、压缩耗时和压缩器内存
+
+帧序列模拟一个在线用户收到的推送：大量私聊、发送确认、输入状态、心跳响应和上线通知，
+夹杂少量离线补发批次和用户列表。同一连接上压缩上下文会保留（context takeover），
+所以按顺序压缩整串帧，而不是逐帧单独压缩。
+"""
+import os
+import sys
+import tracemalloc
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, os.path.join(project_root, "server", "src"))
+
+from websockets import frames
+
+from shared import wire_format
+from shared.wire_format import SUBPROTOCOL_MSGPACK
+from ws_compression import CompressionStats, ThresholdPerMessageDeflate
+
+ROUNDS = 200
+
+
+def message_data(i: int) -> dict:
+    return {
+        "id": 1_000_000 + i,
+        "content": f"今晚七点开会，记得带上周的数据 #{i}",
+        "message_type": "private",
+        "sender_id": 42 + i % 7,
+        "sender_username": f"benchmark_user_{i % 7}",
+        "receiver_id": 43,
+        "group_id": None,
+        "timestamp": f"2024-01-01T12:{i % 60:02d}:00.123456"
+    }
+
+
+def frame_sequence() -> list:
+    """一个连接上按顺序收到的消息"""
+    messages = []
+    for i in range(ROUNDS):
+        messages.append({"type": "private_message", "data": message_data(i)})
+        messages.append({"type": "message_sent", "data": {**message_data(i), "delivered": True, "receiver_online": True}})
+        messages.append({"type": "typing_start", "data": {"user_id": 42 + i % 7, "receiver_id": 43, "expires_in": 5.0}})
+        messages.append({"type": "pong", "data": {"timestamp": 123456.789 + i}})
+        messages.append({"type": "user_status_update",
+                         "data": {"user_id": 1000 + i, "username": f"user{1000 + i}", "status": "online"}})
+        if i % 50 == 0:
+            messages.append({"type": "offline_messages",
+                             "data": {"messages": [message_data(i + j) for j in range(100)], "has_more": True}})
+            messages.append({"type": "user_list",
+                             "data": {"users": [{"id": u, "username": f"user{u}", "status": "online"}
+                                                for u in range(500)]}})
+    return messages
+
+
+CONFIGS = [
+    ("不压缩", None),
+    ("zlib 默认 15/8", {"window_bits": 15, "mem_level": 8, "min_size": 0}),
+    ("12/5", {"window_bits": 12, "mem_level": 5, "min_size": 0}),
+    ("12/5 阈值32", {"window_bits": 12, "mem_level": 5, "min_size": 32}),
+    ("12/5 阈值64", {"window_bits": 12, "mem_level": 5, "min_size": 64}),
+    ("12/5 阈值128", {"window_bits": 12, "mem_level": 5, "min_size": 128}),
+    ("12/5 阈值256", {"window_bits": 12, "mem_level": 5, "min_size": 256}),
+    ("10/4 阈值256", {"window_bits": 10, "mem_level": 4, "min_size": 256}),
+]
+
+
+def run(payloads: list, opcode, config) -> dict:
+    raw_bytes = sum(len(p) for p in payloads)
+    if config is None:
+        return {"bytes": raw_bytes, "ratio": 1.0, "compress_us": 0.0, "decompress_us": 0.0,
+                "memory": 0, "skipped": 0}
+    stats = CompressionStats()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    encoder = ThresholdPerMessageDeflate(False, False, config["window_bits"], config["window_bits"],
+                                         {"memLevel": config["mem_level"]}, min_size=config["min_size"], stats=stats)
+    encoded = [encoder.encode(frames.Frame(opcode, payloads[0]))]
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    encoded += [encoder.encode(frames.Frame(opcode, payload)) for payload in payloads[1:]]
+    decoder = ThresholdPerMessageDeflate(False, False, config["window_bits"], config["window_bits"],
+                                         min_size=config["min_size"], stats=stats)
+    for frame, payload in zip(encoded, payloads):
+        assert decoder.decode(frame).data == payload
+    wire_bytes = sum(len(frame.data) for frame in encoded)
+    return {
+        "bytes": wire_bytes,
+        "ratio": wire_bytes / raw_bytes,
+        "compress_us": stats.compress_seconds / len(payloads) * 1_000_000,
+        "decompress_us": stats.decompress_seconds / len(payloads) * 1_000_000,
+        "memory": memory,
+        "skipped": stats.skipped_messages
+    }
+
+
+def main():
+    messages = frame_sequence()
+    formats = [("JSON", [wire_format.encode(m).encode("utf-8") for m in messages], frames.OP_TEXT)]
+    if wire_format.msgpack is not None:
+        formats.append(("MsgPack", [wire_format.encode(m, SUBPROTOCOL_MSGPACK) for m in messages], frames.OP_BINARY))
+    print(f"每个连接 {len(messages)} 帧（含 {ROUNDS // 50} 批离线补发和用户列表），按顺序压缩")
+    for name, payloads, opcode in formats:
+        small = sum(1 for p in payloads if len(p) < 256)
+        print(f"\n{name}：原始 {sum(len(p) for p in payloads)} 字节，其中 {small} 帧小于 256 字节")
+        print(f"{'配置':<16} {'线上字节':>10} {'压缩比':>7} {'跳过帧':>7} "
+              f"{'压缩(us/帧)':>11} {'解压(us/帧)':>11} {'压缩器内存':>10}")
+        for label, config in CONFIGS:
+            result = run(payloads, opcode, config)
+            print(f"{label:<16} {result['bytes']:>10} {result['ratio']:>7.1%} {result['skipped']:>7} "
+                  f"{result['compress_us']:>11.2f} {result['decompress_us']:>11.2f} "
+                  f"{result['memory'] / 1024:>8.0f}KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""WebSocket 负载测试：启动本地服务端（子进程、临时 SQLite），打开 N 个 WebSocket 客户端，
+按设定速率发送私聊、公共广播和输入状态，统计吞吐、送达延迟、每连接内存和 CPU
+
+- 用户直接写入数据库，令牌由服务端子进程签发后写到工作目录，不经过 bcrypt 登录
+- 私聊和广播的送达延迟通过消息内容中的发送时间计算；输入状态事件没有可携带时间的字段，
+  按 (发送者, 接收者) 记录最后一次发送时间来匹配
+- 每连接内存 = (全部连接后的服务端 RSS - 空闲 RSS) / 连接数；CPU 为测量期间进程 CPU 时间 / 墙钟时间
+- 结果保存为 JSON（带 git 提交号），便于比较不同提交
+
+用法:
+    python benchmarks/load_test.py --clients 2000 --duration 30 --private-rate 2000 --broadcast-rate 2
+    python benchmarks/load_test.py --clients 500 --typing-rate 500 --output results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+
+PASSWORD = "loadtest"
+WORKLOADS = ("private", "broadcast", "typing")
+
+
+def raise_fd_limit():
+    """数千个连接需要同样多的文件描述符"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def serve(port: int, work_dir: str, clients: int):
+    """子进程入口：写入测试用户、签发令牌，然后启动服务端"""
+    sys.path.insert(0, os.path.join(project_root, "server", "src"))
+    sys.path.insert(0, os.path.join(project_root, "server"))
+    raise_fd_limit()
+    from datetime import timedelta
+
+    import uvicorn
+
+    import main
+    from password_hasher import pwd_context
+    from services.auth_service import AuthService
+    from ws_compression import uvicorn_ws_options
+
+    db = main.SessionLocal()
+    hashed_password = pwd_context.hash(PASSWORD)
+    db.add_all([
+        main.User(username=f"load{i:05d}", email=f"load{i:05d}@test.com", hashed_password=hashed_password)
+        for i in range(clients)
+    ])
+    db.commit()
+    auth_service = AuthService(db)
+    users = [
+        {
+            "id": user.id,
+            "token": auth_service.create_access_token({"sub": user.username, "uid": user.id}, timedelta(hours=12))
+        }
+        for user in db.query(main.User).order_by(main.User.id)
+    ]
+    db.close()
+    with open(os.path.join(work_dir, "users.json"), "w") as f:
+        json.dump(users, f)
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning", backlog=4096,
+                **uvicorn_ws_options())
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(work_dir: str, port: int, clients: int, log_level: str) -> subprocess.Popen:
+    env = dict(os.environ, SQLITE_PATH=os.path.join(work_dir, "load.db"), LOG_LEVEL=log_level)
+    log = open(os.path.join(work_dir, "server.log"), "wb")
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", str(port), work_dir, str(clients)],
+        cwd=work_dir, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    import requests
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"服务端启动失败，见 {work_dir}/server.log")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/health", timeout=1).ok:
+                return process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("服务端启动超时")
+
+
+def process_rss_kb(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def process_cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        # 进程名可能包含空格，从最后一个 ')' 之后开始数字段
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=project_root,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def percentile(ordered: list, q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class WorkloadStats:
+    def __init__(self):
+        self.sent = 0
+        self.delivered = 0
+        self.latencies = []
+
+    def summary(self, duration: float) -> dict:
+        ordered = sorted(self.latencies)
+        return {
+            "sent": self.sent,
+            "delivered": self.delivered,
+            "sent_per_sec": round(self.sent / duration, 1),
+            "delivered_per_sec": round(self.delivered / duration, 1),
+            "latency_ms": {
+                "samples": len(ordered),
+                "p50": round(percentile(ordered, 0.5) * 1000, 3),
+                "p99": round(percentile(ordered, 0.99) * 1000, 3),
+                "p999": round(percentile(ordered, 0.999) * 1000, 3),
+                "max": round(ordered[-1] * 1000, 3) if ordered else 0.0
+            }
+        }
+
+
+class LoadTest:
+    def __init__(self, args, users: list, port: int):
+        self.args = args
+        self.users = users
+        self.url = f"ws://127.0.0.1:{port}/ws"
+        self.connections = {}
+        self.receivers = []
+        self.stats = {name: WorkloadStats() for name in WORKLOADS}
+        self.typing_sent = {}  # (发送者, 接收者) -> 最后一次发送时间
+        self.measuring = False
+        self.connect_failures = 0
+
+    async def _connect(self, user: dict):
+        import websockets
+        try:
+            ws = await websockets.connect(f"{self.url}/{user['id']}?token={user['token']}",
+                                          max_size=None, ping_interval=None, open_timeout=60)
+        except Exception:
+            self.connect_failures += 1
+            return
+        self.connections[user["id"]] = ws
+        self.receivers.append(asyncio.create_task(self._receive(user["id"], ws)))
+
+    async def connect_all(self):
+        batch = self.args.connect_batch
+        for start in range(0, len(self.users), batch):
+            await asyncio.gather(*(self._connect(user) for user in self.users[start:start + batch]))
+
+    async def _receive(self, user_id: int, ws):
+        try:
+            async for raw in ws:
+                if not self.measuring:
+                    continue
+                now = time.perf_counter()
+                message = json.loads(raw)
+                kind = message.get("type")
+                data = message.get("data") or {}
+                if kind in ("private_message", "group_message"):
+                    content = data.get("content") or ""
+                    if content.startswith("lt|"):
+                        _, sent_at, workload = content.split("|", 2)
+                        stats = self.stats[workload]
+                        stats.delivered += 1
+                        stats.latencies.append(now - float(sent_at))
+                elif kind == "typing_start":
+                    sent_at = self.typing_sent.pop((data.get("user_id"), user_id), None)
+                    if sent_at is not None:
+                        self.stats["typing"].delivered += 1
+                        self.stats["typing"].latencies.append(now - sent_at)
+        except Exception:
+            pass
+
+    def _pick_pair(self):
+        sender, receiver = random.sample(list(self.connections), 2)
+        return sender, receiver
+
+    async def _send_private(self):
+        sender, receiver = self._pick_pair()
+        content = f"lt|{time.perf_counter():.6f}|private"
+        await self.connections[sender].send(json.dumps({
+            "type": "message_send",
+            "data": {"content": content, "receiver_id": receiver, "message_type": "private"}
+        }))
+
+    async def _send_broadcast(self):
+        sender = random.choice(list(self.connections))
+        content = f"lt|{time.perf_counter():.6f}|broadcast"
+        await self.connections[sender].send(json.dumps({
+            "type": "message_send",
+            "data": {"content": content, "message_type": "public"}
+        }))
+
+    async def _send_typing(self):
+        sender, receiver = self._pick_pair()
+        self.typing_sent[(sender, receiver)] = time.perf_counter()
+        await self.connections[sender].send(json.dumps({
+            "type": "typing_start",
+            "data": {"receiver_id": receiver}
+        }))
+
+    async def _drive(self, workload: str, rate: float, send_one, stop: asyncio.Event):
+        """按固定速率发送，落后时在下一个周期补发"""
+        if rate <= 0 or len(self.connections) < 2:
+            return
+        stats = self.stats[workload]
+        start = time.perf_counter()
+        while not stop.is_set():
+            due = int((time.perf_counter() - start) * rate) - stats.sent
+            for _ in range(due):
+                try:
+                    await send_one()
+                except Exception:
+                    continue
+                stats.sent += 1
+            await asyncio.sleep(0.01)
+
+    async def run_workloads(self) -> float:
+        stop = asyncio.Event()
+        self.measuring = True
+        drivers = [
+            asyncio.create_task(self._drive("private", self.args.private_rate, self._send_private, stop)),
+            asyncio.create_task(self._drive("broadcast", self.args.broadcast_rate, self._send_broadcast, stop)),
+            asyncio.create_task(self._drive("typing", self.args.typing_rate, self._send_typing, stop)),
+        ]
+        start = time.perf_counter()
+        await asyncio.sleep(self.args.duration)
+        stop.set()
+        await asyncio.gather(*drivers)
+        duration = time.perf_counter() - start
+        # 等待发送中的消息送达
+        await asyncio.sleep(self.args.drain)
+        self.measuring = False
+        return duration
+
+    async def close(self):
+        await asyncio.gather(*(ws.close() for ws in self.connections.values()), return_exceptions=True)
+        for task in self.receivers:
+            task.cancel()
+        await asyncio.gather(*self.receivers, return_exceptions=True)
+
+
+async def run(args, users: list, port: int, server_pid: int) -> dict:
+    import httpx
+    test = LoadTest(args, users, port)
+
+    rss_idle = process_rss_kb(server_pid)
+    connect_start = time.perf_counter()
+    await test.connect_all()
+    connect_seconds = time.perf_counter() - connect_start
+    # 等待上线状态广播发完
+    await asyncio.sleep(args.settle)
+    rss_connected = process_rss_kb(server_pid)
+    connected = len(test.connections)
+    print(f"🔗 已连接 {connected}/{len(users)}，耗时 {connect_seconds:.1f} 秒")
+
+    server_cpu_start = process_cpu_seconds(server_pid)
+    client_cpu_start = time.process_time()
+    duration = await test.run_workloads()
+    measured = duration + args.drain
+    server_cpu = process_cpu_seconds(server_pid) - server_cpu_start
+    client_cpu = time.process_time() - client_cpu_start
+
+    async with httpx.AsyncClient(timeout=30) as client:
+        health = (await client.get(f"http://127.0.0.1:{port}/health")).json()
+    await test.close()
+
+    return {
+        "connections": {
+            "requested": len(users),
+            "connected": connected,
+            "failed": test.connect_failures,
+            "connect_seconds": round(connect_seconds, 3)
+        },
+        "server": {
+            "rss_idle_mb": round(rss_idle / 1024, 1),
+            "rss_connected_mb": round(rss_connected / 1024, 1),
+            "memory_per_connection_kb": round((rss_connected - rss_idle) / connected, 2) if connected else 0,
+            "cpu_percent": round(server_cpu / measured * 100, 1),
+            "event_loop_lag": health.get("event_loop_lag"),
+            "message_writer": health.get("message_writer")
+        },
+        "client": {
+            "cpu_percent": round(client_cpu / measured * 100, 1)
+        },
+        "duration_seconds": round(duration, 3),
+        "workloads": {name: stats.summary(duration) for name, stats in test.stats.items()}
+    }
+
+
+def print_report(result: dict):
+    server = result["server"]
+    print(f"🧠 服务端内存: 空闲 {server['rss_idle_mb']} MB，连接后 {server['rss_connected_mb']} MB，"
+          f"每连接 {server['memory_per_connection_kb']} KB")
+    print(f"⚙️  CPU: 服务端 {server['cpu_percent']}%，压测客户端 {result['client']['cpu_percent']}%")
+    print(f"{'负载':<10} {'发送':>8} {'送达':>9} {'送达/秒':>10} {'p50(ms)':>9} {'p99(ms)':>9} {'p999(ms)':>9}")
+    for name, stats in result["workloads"].items():
+        if not stats["sent"]:
+            continue
+        latency = stats["latency_ms"]
+        print(f"{name:<10} {stats['sent']:>8} {stats['delivered']:>9} {stats['delivered_per_sec']:>10} "
+              f"{latency['p50']:>9} {latency['p99']:>9} {latency['p999']:>9}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="WebSocket 负载测试")
+    parser.add_argument("--clients", type=int, default=1000, help="WebSocket 客户端数")
+    parser.add_argument("--duration", type=float, default=20.0, help="测量时长（秒）")
+    parser.add_argument("--private-rate", type=float, default=500.0, help="每秒私聊消息数（全体合计）")
+    parser.add_argument("--broadcast-rate", type=float, default=1.0, help="每秒公共广播数（每条发给所有连接）")
+    parser.add_argument("--typing-rate", type=float, default=100.0, help="每秒输入状态事件数")
+    parser.add_argument("--connect-batch", type=int, default=100, help="每批并发建立的连接数")
+    parser.add_argument("--settle", type=float, default=3.0, help="全部连接后等待上线广播发完的时间（秒）")
+    parser.add_argument("--drain", type=float, default=2.0, help="停止发送后等待送达的时间（秒）")
+    parser.add_argument("--log-level", default="WARNING", help="服务端日志级别")
+    parser.add_argument("--output", help="结果 JSON 路径，默认 load_test_<提交>_<时间>.json")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    raise_fd_limit()
+    commit = git_commit()
+    work_dir = tempfile.mkdtemp(prefix="load_test_")
+    port = free_port()
+    print(f"🚀 启动服务端（{args.clients} 个用户，工作目录 {work_dir}）")
+    process = start_server(work_dir, port, args.clients, args.log_level)
+    try:
+        with open(os.path.join(work_dir, "users.json")) as f:
+            users = json.load(f)
+        result = asyncio.run(run(args, users, port, process.pid))
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        **result
+    }
+    print_report(report)
+    output = args.output or f"load_test_{commit}_{datetime.now():%Y%m%d-%H%M%S}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"💾 结果已保存到 {output}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 5 and sys.argv[1] == "--serve":
+        serve(int(sys.argv[2]), sys.argv[3], int(sys.argv[4]))
+    else:
+        main()
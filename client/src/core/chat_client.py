@@ -5,22 +5,44 @@ import requests
 import threading
 import logging
 import base64
+import hashlib
 import os
+import sys
 import mimetypes
+from urllib.parse import quote
+import time
+from websockets.extensions.permessage_deflate import ClientPerMessageDeflateFactory
 from datetime import datetime
 
+# 线路格式与服务端共用 server/src/shared/wire_format.py
+_SERVER_SRC = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))), "server", "src"
+)
+if _SERVER_SRC not in sys.path:
+    sys.path.append(_SERVER_SRC)
+
+from shared.wire_format import supported_subprotocols, decode, unpack
+
 # 设置websockets日志级别
 logging.getLogger('websockets').setLevel(logging.ERROR)
 
 class SimpleChatClient:
     """简化的聊天客户端 - 使用HTTP API发送消息"""
     
+    # 令牌默认 30 分钟过期，连接期间每 10 分钟换一个新令牌，断线重连时总能带上有效的令牌
+    TOKEN_REFRESH_INTERVAL = 600
+    # 断线后的重连间隔（秒），连上后从头开始
+    RECONNECT_DELAYS = (1, 2, 5, 10, 30)
+    
     def __init__(self, gui_app):
         self.gui_app = gui_app
         self.websocket = None
         self.is_connected = False
         self.user_id = None
         self.username = None
+        self.token = None
+        self.password = None
+        self.close_code = None
         self.stop_listening = False
         self.server_url = None
         self.websocket_thread = None
@@ -28,25 +50,51 @@ class SimpleChatClient:
         # 存储待发送的文件
         self.pending_files = []
         
-    def set_server_info(self, server_url, user_id, username):
-        """设置服务器信息"""
+    def set_server_info(self, server_url, user_id, username, token=None, password=None):
+        """设置服务器信息，token 为 /login 返回的访问令牌，用于 WebSocket 认证
+
+        password 只保存在内存中，令牌已经过期（例如电脑休眠后）无法刷新时用它重新登录
+        """
         self.server_url = server_url
         self.user_id = user_id
         self.username = username
+        self.token = token
+        self.password = password
+    
+    def refresh_token(self):
+        """用当前令牌换一个新令牌，令牌已经失效时用保存的密码重新登录；成功返回 True"""
+        try:
+            if self.token:
+                response = requests.post(
+                    f"{self.server_url}/token/refresh",
+                    headers={"Authorization": f"Bearer {self.token}"},
+                    timeout=10
+                )
+                if response.status_code == 200:
+                    self.token = response.json().get('access_token')
+                    return True
+                print(f"⚠️ 刷新令牌失败: HTTP {response.status_code}")
+            if self.password:
+                response = requests.post(
+                    f"{self.server_url}/login",
+                    json={"username": self.username, "password": self.password},
+                    timeout=10
+                )
+                if response.status_code == 200:
+                    self.token = response.json().get('access_token')
+                    print("🔑 令牌已失效，已重新登录")
+                    return True
+                print(f"❌ 重新登录失败: HTTP {response.status_code}")
+        except Exception as e:
+            print(f"❌ 刷新令牌错误: {str(e)}")
+        return False
         
     def add_pending_file(self, file_path):
-        """添加待发送文件"""
+        """添加待发送文件（只记录元数据，发送时再分块读取上传）"""
         try:
             file_name = os.path.basename(file_path)
             file_size = os.path.getsize(file_path)
             
-            # 读取文件数据
-            with open(file_path, 'rb') as file:
-                file_data = file.read()
-            
-            # 编码为base64
-            file_data_base64 = base64.b64encode(file_data).decode('utf-8')
-            
             # 获取MIME类型
             mime_type, _ = mimetypes.guess_type(file_path)
             if not mime_type:
@@ -56,7 +104,6 @@ class SimpleChatClient:
                 "file_name": file_name,
                 "file_path": file_path,
                 "file_size": file_size,
-                "file_data": file_data_base64,
                 "mime_type": mime_type,
                 "is_image": mime_type.startswith('image/')
             }
@@ -90,6 +137,20 @@ class SimpleChatClient:
             if not self.server_url:
                 raise Exception("服务器地址未设置")
             
+            # 先分块上传所有文件，消息中只引用 upload_id
+            files = []
+            for file_info in self.pending_files:
+                upload = self.upload_file_chunked(file_info["file_path"], file_info["mime_type"])
+                if not upload:
+                    return False
+                files.append({
+                    "upload_id": upload["upload_id"],
+                    "file_name": file_info["file_name"],
+                    "file_size": file_info["file_size"],
+                    "mime_type": file_info["mime_type"],
+                    "is_image": file_info["is_image"]
+                })
+            
             # 构建消息数据
             message_data = {
                 "sender_id": self.user_id,
@@ -98,7 +159,7 @@ class SimpleChatClient:
                 "receiver_id": receiver_id,
                 "message_type": "private" if receiver_id else "public",
                 "timestamp": datetime.now().isoformat(),
-                "files": self.pending_files.copy()  # 复制文件列表
+                "files": files
             }
             
             print(f"📤 发送组合消息: 文本='{text_content}', 文件数量={len(self.pending_files)}")
@@ -132,6 +193,7 @@ class SimpleChatClient:
         """启动WebSocket连接"""
         try:
             print(f"🔗 启动WebSocket连接，用户ID: {self.user_id}")
+            self.stop_listening = False
             
             # 在新的线程中运行WebSocket连接
             self.websocket_thread = threading.Thread(
@@ -161,29 +223,77 @@ class SimpleChatClient:
             print(f"❌ WebSocket循环错误: {str(e)}")
     
     async def _websocket_main(self):
-        """WebSocket主循环"""
+        """WebSocket主循环：断线后刷新令牌并按退避间隔重连，直到调用 stop_websocket"""
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while not self.stop_listening:
+            # 握手后立刻被 1008 关闭不算连上，退避间隔继续增长
+            if await self._connect_and_listen() and self.close_code != 1008:
+                attempt = 0
+            if self.stop_listening:
+                break
+            
+            # 握手只认令牌，重连前先换一个新令牌；被 1008 拒绝且无法刷新或重新登录时不再重试
+            refreshed = await loop.run_in_executor(None, self.refresh_token)
+            if self.close_code == 1008 and not refreshed:
+                self.gui_app.root.after(0, self.gui_app.on_websocket_disconnected, "登录已过期，请重新登录")
+                break
+            
+            delay = self.RECONNECT_DELAYS[min(attempt, len(self.RECONNECT_DELAYS) - 1)]
+            attempt += 1
+            print(f"🔄 {delay} 秒后重连WebSocket...")
+            for _ in range(delay):
+                if self.stop_listening:
+                    break
+                await asyncio.sleep(1)
+    
+    async def _connect_and_listen(self):
+        """连接一次并监听到断开；返回是否连接成功，服务端的关闭码记录在 close_code"""
+        self.close_code = None
         try:
             # 构建WebSocket URL
             ws_url = self.server_url.replace('http', 'ws') + f"/ws/{self.user_id}"
             print(f"🔗 连接WebSocket: {ws_url}")
-            
-            # 连接WebSocket
-            async with websockets.connect(ws_url, ping_interval=30, ping_timeout=10) as websocket:
+            # batch=1：服务端可以把短时间内的多条推送合成一帧发送
+            ws_url += "?batch=1"
+            if self.token:
+                ws_url += f"&token={quote(self.token)}"
+            
+            # 连接WebSocket，安装了 msgpack 时请求二进制帧格式，服务端不支持时仍使用 JSON；
+            # 压缩窗口和内存级别与服务端默认配置一致，每个连接的压缩器约 45KB
+            async with websockets.connect(ws_url, ping_interval=30, ping_timeout=10,
+                                          subprotocols=supported_subprotocols() or None,
+                                          extensions=[ClientPerMessageDeflateFactory(
+                                              client_max_window_bits=12,
+                                              compress_settings={"memLevel": 5})]) as websocket:
                 self.websocket = websocket
                 self.is_connected = True
                 
-                print(f"✅ WebSocket连接成功! 用户: {self.username} (ID: {self.user_id})")
+                print(f"✅ WebSocket连接成功! 用户: {self.username} (ID: {self.user_id}), 帧格式: {websocket.subprotocol or 'json'}")
                 
                 # 通知GUI连接成功
                 self.gui_app.root.after(0, self.gui_app.on_websocket_connected)
                 
-                # 监听消息
-                await self._listen_for_messages()
+                # 监听消息，同时定期刷新令牌
+                refresher = asyncio.create_task(self._refresh_token_periodically())
+                try:
+                    await self._listen_for_messages()
+                finally:
+                    refresher.cancel()
+                return True
                 
         except Exception as e:
             print(f"❌ WebSocket连接错误: {str(e)}")
             self.is_connected = False
             self.gui_app.root.after(0, self.gui_app.on_websocket_disconnected, str(e))
+            return False
+    
+    async def _refresh_token_periodically(self):
+        """连接期间定期刷新令牌；令牌只在握手时校验，已建立的连接不受过期影响"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.TOKEN_REFRESH_INTERVAL)
+            await loop.run_in_executor(None, self.refresh_token)
     
     async def _listen_for_messages(self):
         """监听WebSocket消息"""
@@ -194,8 +304,9 @@ class SimpleChatClient:
                     await self._handle_websocket_message(message)
                 except asyncio.TimeoutError:
                     continue
-                except websockets.exceptions.ConnectionClosed:
-                    print("❌ WebSocket连接已关闭")
+                except websockets.exceptions.ConnectionClosed as e:
+                    self.close_code = e.rcvd.code if e.rcvd else None
+                    print(f"❌ WebSocket连接已关闭 (code={self.close_code})")
                     break
                 except Exception as e:
                     print(f"❌ 接收消息错误: {str(e)}")
@@ -208,9 +319,18 @@ class SimpleChatClient:
             self.gui_app.root.after(0, self.gui_app.on_websocket_disconnected, "连接断开")
     
     async def _handle_websocket_message(self, message):
-        """处理WebSocket消息"""
+        """处理WebSocket消息，合并帧拆开后逐条处理"""
+        try:
+            messages = unpack(decode(message))
+        except Exception as e:
+            print(f"❌ 解码WebSocket消息错误: {str(e)}")
+            return
+        for data in messages:
+            await self._dispatch_websocket_message(data)
+    
+    async def _dispatch_websocket_message(self, data):
+        """按类型处理一条消息"""
         try:
-            data = json.loads(message)
             message_type = data.get('type')
             
             print(f"📨 收到WebSocket消息类型: {message_type}, 数据: {data}")
@@ -230,6 +350,8 @@ class SimpleChatClient:
                 await self._handle_file_message(data)
             elif message_type == "combined_message":
                 await self._handle_combined_message(data)
+            elif message_type == "offline_messages":
+                await self._handle_offline_messages(data)
             elif message_type == "pong":
                 print("💓 收到心跳响应")
             else:
@@ -256,6 +378,24 @@ class SimpleChatClient:
         except Exception as e:
             print(f"❌ 处理私聊消息错误: {str(e)}")
     
+    async def _handle_offline_messages(self, data):
+        """处理上线后补发的离线消息（服务器分批发送）"""
+        try:
+            messages = data.get('data', {}).get('messages', [])
+            print(f"📬 收到离线消息 {len(messages)} 条")
+            
+            for message_data in messages:
+                content = message_data.get('content', '')
+                if message_data.get('message_type') in ('file', 'image'):
+                    content = f"[文件] {message_data.get('file_name') or content}"
+                self.gui_app.root.after(0, self.gui_app.handle_private_message,
+                                      message_data.get('sender_id'),
+                                      message_data.get('sender_username', 'Unknown'),
+                                      content, message_data.get('timestamp', ''))
+            
+        except Exception as e:
+            print(f"❌ 处理离线消息错误: {str(e)}")
+    
     async def _handle_group_message(self, data):
         """处理群聊消息"""
         try:
@@ -343,14 +483,14 @@ class SimpleChatClient:
                         print(f"✅ 私聊消息已送达接收者 {receiver_id}")
                 else:
                     if message_type == 'file':
-                        print(f"⚠️ 文件消息未送达接收者 {receiver_id} (用户离线)")
+                        print(f"⚠️ 文件消息暂未送达接收者 {receiver_id} (用户离线，上线后补发)")
                         self.gui_app.root.after(0, lambda: self.gui_app.add_message_to_chat(
-                            "系统", f"用户离线，文件未送达", "system"
+                            "系统", f"用户离线，文件将在对方上线后送达", "system"
                         ))
                     else:
-                        print(f"⚠️ 私聊消息未送达接收者 {receiver_id} (用户离线)")
+                        print(f"⚠️ 私聊消息暂未送达接收者 {receiver_id} (用户离线，上线后补发)")
                         self.gui_app.root.after(0, lambda: self.gui_app.add_message_to_chat(
-                            "系统", f"用户离线，消息未送达", "system"
+                            "系统", f"用户离线，消息将在对方上线后送达", "system"
                         ))
             else:
                 if message_type == 'file':
@@ -428,39 +568,113 @@ class SimpleChatClient:
             print(f"❌ HTTP发送消息错误: {str(e)}")
             return False
 
-    def send_file_via_http(self, file_path, receiver_id=None, is_group_message=False):
-        """通过HTTP API发送文件"""
+    @staticmethod
+    def _file_digests(file_path, challenge, block_size=1024 * 1024):
+        """逐块计算文件的 sha256，以及证明持有内容的 sha256(challenge + 文件内容)"""
+        hasher = hashlib.sha256()
+        proof = hashlib.sha256(challenge.encode())
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(block_size), b''):
+                hasher.update(block)
+                proof.update(block)
+        return hasher.hexdigest(), proof.hexdigest()
+    
+    def upload_file_chunked(self, file_path, mime_type=None, max_retries=5):
+        """分块上传文件，每次只读取一个分块；连接中断时从断点继续，返回上传信息
+        
+        先用服务端给的 challenge 证明持有内容，服务端已有相同文件时跳过上传。
+        """
         try:
             if not self.server_url:
                 raise Exception("服务器地址未设置")
             
-            # 读取文件
-            with open(file_path, 'rb') as file:
-                file_data = file.read()
-            
-            # 编码为base64
-            file_data_base64 = base64.b64encode(file_data).decode('utf-8')
             file_name = os.path.basename(file_path)
-            file_size = len(file_data)
+            file_size = os.path.getsize(file_path)
+            if not mime_type:
+                mime_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
             
-            file_message_data = {
+            response = requests.post(f"{self.server_url}/uploads", json={
                 "sender_id": self.user_id,
-                "sender_username": self.username,
                 "file_name": file_name,
-                "file_data": file_data_base64,
                 "file_size": file_size,
+                "mime_type": mime_type
+            }, timeout=10)
+            response.raise_for_status()
+            upload = response.json()
+            upload_id = upload["upload_id"]
+            chunk_size = upload["chunk_size"]
+            sha256, proof = self._file_digests(file_path, upload["challenge"])
+            
+            response = requests.post(f"{self.server_url}/uploads/{upload_id}/complete", json={
+                "sender_id": self.user_id,
+                "sha256": sha256,
+                "proof": proof
+            }, timeout=30)
+            if response.status_code == 200:
+                print(f"♻️ 服务器已有相同文件，跳过上传: {file_name}")
+                return response.json()
+            if response.status_code != 409:
+                response.raise_for_status()
+            
+            print(f"📤 分块上传文件: {file_name} ({file_size} bytes, {upload['total_chunks']} 块)")
+            
+            index = 0
+            retries = 0
+            with open(file_path, 'rb') as file:
+                while index < upload["total_chunks"]:
+                    file.seek(index * chunk_size)
+                    chunk = file.read(chunk_size)
+                    try:
+                        response = requests.put(
+                            f"{self.server_url}/uploads/{upload_id}/chunks/{index}",
+                            data=chunk,
+                            headers={"Content-Type": "application/octet-stream"},
+                            timeout=60
+                        )
+                        if response.status_code == 409:
+                            # 上一次中断的请求服务端还没处理完，稍后重试
+                            raise requests.RequestException(response.json().get("detail"))
+                        response.raise_for_status()
+                    except requests.RequestException as e:
+                        retries += 1
+                        if retries > max_retries:
+                            raise
+                        print(f"⚠️ 分块 {index} 上传中断，准备续传: {e}")
+                        time.sleep(min(2 ** retries, 10))
+                        # 重发同一分块即可：服务端已写入的分块会直接返回最新进度
+                        continue
+                    index = response.json()["next_chunk"]
+            
+            response = requests.post(f"{self.server_url}/uploads/{upload_id}/complete", json={
+                "sender_id": self.user_id,
+                "sha256": sha256
+            }, timeout=30)
+            response.raise_for_status()
+            print(f"✅ 文件上传完成: {file_name}")
+            return response.json()
+            
+        except Exception as e:
+            print(f"❌ 分块上传文件错误: {str(e)}")
+            return None
+    
+    def send_file_via_http(self, file_path, receiver_id=None, is_group_message=False):
+        """通过HTTP API发送文件（先分块上传，再发送文件消息）"""
+        try:
+            upload = self.upload_file_chunked(file_path)
+            if not upload:
+                return False
+            
+            file_message_data = {
+                "sender_id": self.user_id,
+                "upload_id": upload["upload_id"],
                 "receiver_id": receiver_id,
-                "is_group_message": is_group_message,
-                "message_type": "file",
-                "timestamp": datetime.now().isoformat()
+                "is_group_message": is_group_message
             }
             
-            print(f"📤 通过HTTP发送文件: {file_name} ({file_size} bytes)")
-            
             response = requests.post(
                 f"{self.server_url}/send-file",
                 json=file_message_data,
-                timeout=30  # 文件传输需要更长的超时时间
+                timeout=30
             )
             
             if response.status_code == 200:
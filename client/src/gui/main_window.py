@@ -7,7 +7,6 @@ import sys
 import os
 import tempfile
 from PIL import Image, ImageTk
-import base64
 
 # 设置路径
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -560,13 +559,6 @@ class ModernChatGUI:
                 file_name = os.path.basename(file_path)
                 file_size = os.path.getsize(file_path)
                 
-                # 读取文件数据
-                with open(file_path, 'rb') as file:
-                    file_data = file.read()
-                
-                # 编码为base64
-                file_data_base64 = base64.b64encode(file_data).decode('utf-8')
-                
                 # 获取MIME类型
                 import mimetypes
                 mime_type, _ = mimetypes.guess_type(file_path)
@@ -577,13 +569,13 @@ class ModernChatGUI:
                     "file_name": file_name,
                     "file_path": file_path,
                     "file_size": file_size,
-                    "file_data": file_data_base64,
                     "mime_type": mime_type,
                     "is_image": mime_type.startswith('image/')
                 }
                 
-                # 添加到待发送文件列表
+                # 添加到待发送文件列表（只记录路径等元数据，发送时由客户端分块上传）
                 self.pending_files.append(file_info)
+                self.client.add_pending_file(file_path)
                 
                 # 在输入框中显示文件预览
                 self.message_input.insert(tk.END, f"📎 {file_name}\n")
@@ -613,13 +605,6 @@ class ModernChatGUI:
                 file_name = os.path.basename(file_path)
                 file_size = os.path.getsize(file_path)
                 
-                # 读取文件数据
-                with open(file_path, 'rb') as file:
-                    file_data = file.read()
-                
-                # 编码为base64
-                file_data_base64 = base64.b64encode(file_data).decode('utf-8')
-                
                 # 创建图片预览
                 image = Image.open(file_path)
                 # 调整图片大小以适应输入框
@@ -638,15 +623,15 @@ class ModernChatGUI:
                     "file_name": file_name,
                     "file_path": file_path,
                     "file_size": file_size,
-                    "file_data": file_data_base64,
                     "mime_type": "image/jpeg",
                     "is_image": True,
                     "preview_image": preview_image,
                     "temp_file": temp_file.name
                 }
                 
-                # 添加到待发送文件列表
+                # 添加到待发送文件列表（只记录路径等元数据，发送时由客户端分块上传）
                 self.pending_files.append(file_info)
+                self.client.add_pending_file(file_path)
                 # 保存图片引用防止被垃圾回收
                 self.pending_images[file_name] = preview_image
                 
@@ -673,6 +658,7 @@ class ModernChatGUI:
         
         self.pending_files.clear()
         self.pending_images.clear()
+        self.client.clear_pending_files()
         print("🧹 清空所有待发送文件")
 
     def clear_input_area(self):
@@ -1177,7 +1163,7 @@ class ModernChatGUI:
                 
                 self.server_url = server_url
                 # 设置客户端服务器信息
-                self.client.set_server_info(server_url, user_id, username)
+                self.client.set_server_info(server_url, user_id, username, access_token, password)
                 
                 # 更新UI状态
                 self.root.after(0, self.on_login_success, user_id, username)
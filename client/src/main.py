@@ -5,13 +5,17 @@ import os
 current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(current_dir)
 sys.path.insert(0, project_root)
+# 协议定义和线路格式与服务端共用 server/src/shared
+sys.path.insert(0, os.path.join(os.path.dirname(project_root), "server", "src"))
 
 import asyncio
 import websockets
-import json
+from websockets.extensions.permessage_deflate import ClientPerMessageDeflateFactory
 from datetime import datetime
 from typing import List, Callable, Any, Dict
+from urllib.parse import quote
 from shared.protocols import *
+from shared.wire_format import supported_subprotocols, encode, decode, unpack
 
 class ChatClient:
     def __init__(self, server_url: str = "ws://localhost:8000"):
@@ -24,10 +28,21 @@ class ChatClient:
         self.connection_handlers: List[Callable[[bool], Any]] = []
         self.user_status_handlers: List[Callable[[Dict[str, Any]], Any]] = []
     
-    async def connect(self, user_id: int, username: str):
-        """连接到服务器"""
+    async def connect(self, user_id: int, username: str, token: str = None):
+        """连接到服务器，token 为 /login 返回的访问令牌"""
         try:
-            self.websocket = await websockets.connect(f"{self.server_url}/ws/{user_id}")
+            # batch=1：服务端可以把短时间内的多条推送合成一帧发送
+            url = f"{self.server_url}/ws/{user_id}?batch=1"
+            if token:
+                url += f"&token={quote(token)}"
+            # 安装了 msgpack 时请求二进制帧格式，服务端不支持时仍使用 JSON；
+            # 压缩窗口和内存级别与服务端默认配置一致，每个连接的压缩器约 45KB
+            self.websocket = await websockets.connect(
+                url,
+                subprotocols=supported_subprotocols() or None,
+                extensions=[ClientPerMessageDeflateFactory(client_max_window_bits=12,
+                                                           compress_settings={"memLevel": 5})]
+            )
             self.user_id = user_id
             self.username = username
             self.is_connected = True
@@ -60,10 +75,20 @@ class ChatClient:
             self.is_connected = False
             self._notify_connection_handlers(False, str(e))
     
-    async def handle_message(self, message_data: str):
-        """处理接收到的消息"""
+    async def handle_message(self, message_data):
+        """处理接收到的消息，合并帧拆开后逐条处理"""
+        try:
+            messages = unpack(decode(message_data))
+        except Exception as e:
+            print(f"❌ 解码消息错误: {e}")
+            return
+        for data in messages:
+            await self._dispatch_message(data)
+    
+    async def _dispatch_message(self, data: Dict[str, Any]):
+        """按类型处理一条消息"""
         try:
-            message = WSMessage.parse_raw(message_data)
+            message = WSMessage(**data)
             
             # 调用注册的消息处理器
             for handler in self.message_handlers:
@@ -274,7 +299,7 @@ class ChatClient:
                 }
             )
             
-            await self.websocket.send(message.json())
+            await self.websocket.send(encode(message.dict(), self.websocket.subprotocol))
             
             # 如果是私聊消息，在本地也显示
             if receiver_id:
@@ -307,21 +332,32 @@ class ChatClient:
             })
             return False
     
-    async def start_typing(self):
-        """开始输入指示"""
+    @staticmethod
+    def _typing_scope(receiver_id: int = None, group_id: int = None) -> Dict[str, Any]:
+        """输入状态只发给会话参与者：私聊指定 receiver_id，群聊指定 group_id；都不指定时发给所有在线用户"""
+        if receiver_id:
+            return {"receiver_id": receiver_id}
+        if group_id:
+            return {"group_id": group_id}
+        return {}
+    
+    async def start_typing(self, receiver_id: int = None, group_id: int = None):
+        """开始输入指示（可在每次按键时调用，服务端会合并重复事件并在停止输入后自动过期）"""
         if self.is_connected:
             try:
-                message = WSMessage(type=WSMessageTypes.TYPING_START, data={})
-                await self.websocket.send(message.json())
+                message = WSMessage(type=WSMessageTypes.TYPING_START,
+                                    data=self._typing_scope(receiver_id, group_id))
+                await self.websocket.send(encode(message.dict(), self.websocket.subprotocol))
             except Exception as e:
                 print(f"❌ 发送输入指示失败: {e}")
     
-    async def stop_typing(self):
-        """停止输入指示"""
+    async def stop_typing(self, receiver_id: int = None, group_id: int = None):
+        """停止输入指示（可选，服务端超时后会自动发出停止通知）"""
         if self.is_connected:
             try:
-                message = WSMessage(type=WSMessageTypes.TYPING_STOP, data={})
-                await self.websocket.send(message.json())
+                message = WSMessage(type=WSMessageTypes.TYPING_STOP,
+                                    data=self._typing_scope(receiver_id, group_id))
+                await self.websocket.send(encode(message.dict(), self.websocket.subprotocol))
             except Exception as e:
                 print(f"❌ 停止输入指示失败: {e}")
     
@@ -2,6 +2,7 @@
 import asyncio
 import sys
 import os
+import getpass
 import requests
 
 # 添加项目根目录到Python路径
@@ -36,6 +37,18 @@ def get_available_users(server_url: str = "http://localhost:8000"):
         print(f"❌ 无法连接到服务器: {e}")
         return []
 
+def login(server_url: str, username: str, password: str):
+    """登录并返回访问令牌，WebSocket 连接需要携带它"""
+    try:
+        response = requests.post(f"{server_url}/login", json={"username": username, "password": password})
+        if response.status_code == 200:
+            return response.json().get("access_token")
+        print(f"❌ 登录失败: HTTP {response.status_code}")
+        return None
+    except Exception as e:
+        print(f"❌ 无法连接到服务器: {e}")
+        return None
+
 async def interactive_client():
     """交互式客户端"""
     print_help()
@@ -95,6 +108,9 @@ async def interactive_client():
             print("\n👋 退出程序")
             return
     
+    # 登录获取令牌
+    token = login(server_url, username, getpass.getpass(f"请输入 {username} 的密码: "))
+    
     # WebSocket 地址
     ws_url = server_url.replace("http", "ws")
     
@@ -103,7 +119,7 @@ async def interactive_client():
     
     try:
         print(f"\n🔄 正在连接... 用户: {username} (ID: {user_id})")
-        await client.connect(user_id, username)
+        await client.connect(user_id, username, token)
         print(f"✅ 连接成功!")
         print("💬 输入消息开始聊天，输入 /help 查看帮助")
         
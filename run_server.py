@@ -8,6 +8,8 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, current_dir)  # 项目根目录
 sys.path.insert(0, os.path.join(current_dir, "server", "src"))  # server/src 目录
 
+from ws_compression import uvicorn_ws_options
+
 if __name__ == "__main__":
     print("🚀 启动即时消息系统服务器...")
     
@@ -17,5 +19,6 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8000,
         reload=True,
-        log_level="info"
+        log_level="info",
+        **uvicorn_ws_options()
     )
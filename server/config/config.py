@@ -24,17 +24,88 @@ class Settings(BaseSettings):
     MYSQL_POOL_SIZE: int = 5
     MYSQL_POOL_RECYCLE: int = 3600
     
+    # 本地测试可改用SQLite，设置数据库文件路径即可（为空时使用MySQL）
+    SQLITE_PATH: str = ""
+    
+    # 数据库线程池大小，所有ORM调用都在这里执行
+    DB_EXECUTOR_WORKERS: int = 5
+    
+    # 消息批量写入（group commit）配置
+    # 发送方总是在事务提交后才收到确认；提交是否落盘由数据库决定
+    # （MySQL 的 innodb_flush_log_at_trx_commit / sync_binlog，SQLite 的 PRAGMA synchronous）
+    MESSAGE_BATCH_WINDOW_MS: float = 2.0     # 攒批等待时间上限（毫秒），0 表示不等待
+    MESSAGE_BATCH_MAX_SIZE: int = 256        # 每批最多消息数
+    MESSAGE_WRITE_MAX_PENDING: int = 10000   # 等待写入的消息上限，超过后发送方等待
+    
+    # 分块上传配置
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024  # 分块大小上限（字节）
+    UPLOAD_MAX_FILE_SIZE: int = 2 * 1024 * 1024 * 1024  # 单个文件大小上限（字节）
+    UPLOAD_SESSION_TTL: float = 24 * 3600  # 上传会话多久没有进展后清理（秒）
+    
+    # 密码哈希进程池
+    PASSWORD_HASH_WORKERS: int = 2  # bcrypt 计算进程数
+    PASSWORD_HASH_MAX_QUEUE: int = 64  # 排队等待的登录/注册上限，超过后返回 503
+    
+    # 文件读写线程池
+    FILE_IO_WORKERS: int = 8  # 文件读写线程数
+    FILE_IO_MAX_WRITERS: int = 4  # 同时写盘的上限，超过后在事件循环中排队等待
+    
+    # 文件下载配置
+    DOWNLOAD_CACHE_SIZE: int = 4096  # 缓存的文件信息条数
+    DOWNLOAD_CHUNK_SIZE: int = 256 * 1024  # 不支持零拷贝时每次读取的字节数
+    
+    # 图片缩略图配置（需要安装 Pillow）
+    THUMBNAIL_SIZE: int = 256  # 缩略图最长边（像素）
+    THUMBNAIL_QUALITY: int = 75  # WebP 质量
+    THUMBNAIL_WORKERS: int = 2  # 生成缩略图的进程数
+    
+    # 统计计数器
+    STATS_RECONCILE_INTERVAL: float = 300.0  # 与数据库 COUNT(*) 对账的间隔（秒）
+    
+    # 用户目录缓存
+    USER_CACHE_SIZE: int = 10000  # 缓存的用户条数，超过后按最近最少使用淘汰
+    USER_CACHE_TTL: float = 300.0  # 缓存条目的最长保留时间（秒），跨 worker 的失效通知丢失时的兜底
+    
     # JWT配置
     SECRET_KEY: str = "your-super-secret-jwt-key-change-this-in-production"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    TOKEN_CACHE_SIZE: int = 10000  # 已校验令牌的缓存条数
+    TOKEN_CACHE_TTL: float = 300.0  # 已校验令牌的缓存时间（秒），不超过令牌本身的过期时间
+    WS_REQUIRE_TOKEN: bool = True  # WebSocket 连接必须携带登录令牌；关闭后兼容只带用户ID的旧客户端
+    
+    # 日志配置
+    LOG_LEVEL: str = "INFO"  # DEBUG / INFO / WARNING / ERROR
+    LOG_QUEUE_SIZE: int = 10000  # 等待后台线程写出的日志条数上限，超过后丢弃
+    LOG_DEBUG_SAMPLE_EVERY: int = 100  # 逐条消息的 DEBUG 日志每 N 条记录 1 条，1 表示全部记录
     
     # CORS配置
     CORS_ORIGINS: List[str] = ["http://localhost:3000", "http://127.0.0.1:3000"]
     
+    # WebSocket 推送配置
+    OUTBOUND_QUEUE_SIZE: int = 1000  # 每个连接的发送队列上限，满了之后丢弃新消息
+    OFFLINE_REPLAY_BATCH_SIZE: int = 100  # 上线补发离线消息时每帧包含的消息数
+    OFFLINE_REPLAY_FLUSH_TIMEOUT: float = 30.0  # 等待每批补发消息写出的超时（秒）
+    TYPING_TTL_SECONDS: float = 5.0  # 输入状态多久没有刷新后由服务端发出 typing_stop
+    TYPING_MIN_INTERVAL: float = 1.0  # 同一用户两次转发 typing_start 的最小间隔（秒）
+    WS_BATCH_TICK_MS: float = 10.0  # 连接时带 ?batch=1 的客户端，每个周期内的推送合成一帧发送（毫秒），0 表示关闭
+    WS_BATCH_MAX_MESSAGES: int = 256  # 每个合并帧最多包含的消息数
+    
+    # WebSocket 压缩（permessage-deflate）
+    WS_COMPRESSION: bool = True  # 客户端请求时启用压缩
+    WS_COMPRESSION_MIN_SIZE: int = 0  # 小于该字节数的消息不压缩；默认全部压缩，阈值 128 时线上字节翻倍多（见 benchmarks/bench_ws_compression.py）
+    WS_COMPRESSION_WINDOW_BITS: int = 12  # 压缩窗口 2^N 字节（9-15），越小每个连接占用内存越少
+    WS_COMPRESSION_MEM_LEVEL: int = 5  # zlib 内存级别（1-9），压缩器约占 2^(N+2) + 2^(level+9) 字节
+    
+    # 消息总线：local 为单进程；unix 用于本机 uvicorn workers>1，worker 之间经 Unix socket 转发
+    MESSAGE_BUS_BACKEND: str = "local"
+    MESSAGE_BUS_DIR: str = "/tmp/ims-message-bus"
+    
     @property
     def DATABASE_URL(self):
         """获取MySQL数据库连接URL - 对密码进行URL编码"""
+        if self.SQLITE_PATH:
+            return f"sqlite:///{self.SQLITE_PATH}"
         encoded_password = quote_plus(self.MYSQL_PASSWORD)
         return f"mysql+pymysql://{self.MYSQL_USER}:{encoded_password}@{self.MYSQL_HOST}:{self.MYSQL_PORT}/{self.MYSQL_DATABASE}?charset={self.MYSQL_CHARSET}"
     
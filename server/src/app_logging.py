@@ -0,0 +1,97 @@
+# server/src/app_logging.py
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+from typing import Optional
+
+ROOT_LOGGER = "chat"
+LOG_FORMAT = "%(asctime)s %(levelname)-5s %(name)s: %(message)s"
+
+# 逐条消息的 DEBUG 事件每 N 条只记录 1 条
+_sample_every = 1
+_sample_seen = 0
+_sample_skipped = 0
+
+_handler: Optional["DroppingQueueHandler"] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """把日志放进有界队列，由后台线程写出；队列满时丢弃并计数，不阻塞事件循环"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.enqueued = 0
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+
+def get_logger(name: str) -> logging.Logger:
+    """模块日志器，统一挂在 chat 下，例如 get_logger("connection") -> chat.connection"""
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def setup_logging(level: str = "INFO", queue_size: int = 10000, sample_every: int = 1):
+    """配置 chat 日志：日志调用只做级别判断和入队，格式化与写 stdout 在后台线程完成
+
+    低于 level 的日志在 isEnabledFor 处直接返回，不会格式化参数。重复调用会替换原有配置。
+    """
+    global _handler, _listener, _sample_every
+    shutdown_logging()
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    root.propagate = False
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(logging.Formatter(LOG_FORMAT))
+    _handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    _listener = logging.handlers.QueueListener(_handler.queue, output, respect_handler_level=True)
+    root.addHandler(_handler)
+    _listener.start()
+    _sample_every = max(1, int(sample_every))
+
+
+def shutdown_logging():
+    """停止后台线程，写出队列中剩余的日志"""
+    global _handler, _listener
+    if _handler is not None:
+        logging.getLogger(ROOT_LOGGER).removeHandler(_handler)
+    if _listener is not None:
+        _listener.stop()
+    _handler = None
+    _listener = None
+
+
+atexit.register(shutdown_logging)
+
+
+def debug_sampled(logger: logging.Logger, msg: str, *args):
+    """记录逐条消息的 DEBUG 事件，按 sample_every 采样；DEBUG 未开启时不做任何事"""
+    global _sample_seen, _sample_skipped
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    _sample_seen += 1
+    if _sample_every > 1 and _sample_seen % _sample_every != 1:
+        _sample_skipped += 1
+        return
+    logger.debug(msg, *args)
+
+
+def logging_stats() -> dict:
+    return {
+        "level": logging.getLevelName(logging.getLogger(ROOT_LOGGER).getEffectiveLevel()),
+        "queued": _handler.queue.qsize() if _handler else 0,
+        "enqueued": _handler.enqueued if _handler else 0,
+        "dropped": _handler.dropped if _handler else 0,
+        "debug_sample_every": _sample_every,
+        "debug_sampled_out": _sample_skipped
+    }
@@ -0,0 +1,155 @@
+# server/src/blob_store.py
+import hashlib
+import hmac
+import os
+import re
+import tempfile
+import uuid
+from typing import BinaryIO, Optional, Tuple
+
+from db_executor import DatabaseExecutor
+from file_io import FileIOExecutor
+from services.blob_service import BlobService
+
+_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+_COPY_BUFFER = 1024 * 1024
+
+
+class BlobStore:
+    """内容寻址的附件存储：文件以 sha256 命名保存在上传目录，相同内容只写一次
+
+    文件只有在服务端计算出哈希后才会放到最终位置，所以同名文件一定是完整且内容一致的。
+    存储文件名只在服务端使用：下载URL使用每条消息随机生成的文件ID（new_file_id），
+    否则知道哈希就能下载别人的文件。
+    每份内容在 blobs 表中有一条记录（见 BlobService）。消息没有删除接口，文件一旦写入就一直保留，
+    所以不维护引用计数；以后加上删除时，需要在最后一条引用它的消息删除后再删除文件。
+    """
+
+    def __init__(self, blob_dir: str, db_executor: DatabaseExecutor, file_io: FileIOExecutor):
+        self.blob_dir = blob_dir
+        self.db_executor = db_executor
+        self.file_io = file_io
+        os.makedirs(blob_dir, exist_ok=True)
+
+        # 统计信息
+        self.stored_count = 0
+        self.deduplicated_count = 0
+        self.bytes_written = 0
+        self.bytes_deduplicated = 0
+        self.uploads_skipped = 0
+        self.bytes_not_uploaded = 0
+
+    @staticmethod
+    def is_valid_hash(sha256: str) -> bool:
+        return bool(sha256) and bool(_SHA256.match(sha256))
+
+    def path_for(self, sha256: str) -> str:
+        return os.path.join(self.blob_dir, sha256)
+
+    @staticmethod
+    def new_file_id() -> str:
+        """下载URL中的文件ID，与内容无关，无法猜测"""
+        return uuid.uuid4().hex
+
+    async def prove_possession(self, sha256: str, size: int, challenge: str, proof: str) -> Optional[str]:
+        """客户端证明持有完整内容时返回已有文件的路径，可以跳过上传
+
+        proof 为 sha256(challenge + 文件内容)，challenge 由服务端为每次上传随机生成，
+        只知道内容哈希无法算出；服务端没有该内容或 proof 不对时都返回 None。
+        """
+        if not self.is_valid_hash(sha256) or not isinstance(proof, str):
+            return None
+        path = self.path_for(sha256)
+        try:
+            stat = await self.file_io.run(os.stat, path)
+        except FileNotFoundError:
+            return None
+        if stat.st_size != size:
+            return None
+        expected = await self.file_io.run(self._keyed_digest, path, challenge)
+        return path if hmac.compare_digest(expected, proof.lower()) else None
+
+    @staticmethod
+    def _keyed_digest(path: str, challenge: str) -> str:
+        hasher = hashlib.sha256(challenge.encode())
+        with open(path, "rb") as f:
+            for piece in iter(lambda: f.read(_COPY_BUFFER), b""):
+                hasher.update(piece)
+        return hasher.hexdigest()
+
+    def record_skipped_upload(self, size: int):
+        self.uploads_skipped += 1
+        self.bytes_not_uploaded += size
+
+    async def store_file(self, tmp_path: str, sha256: str) -> str:
+        """把已算好哈希的临时文件放入存储；内容已存在时直接删除临时文件"""
+        return await self.file_io.write(self._store_file, tmp_path, sha256)
+
+    def _store_file(self, tmp_path: str, sha256: str) -> str:
+        path = self.path_for(sha256)
+        size = os.path.getsize(tmp_path)
+        if os.path.exists(path):
+            os.unlink(tmp_path)
+            self.deduplicated_count += 1
+            self.bytes_deduplicated += size
+        else:
+            os.replace(tmp_path, path)
+            self.stored_count += 1
+            self.bytes_written += size
+        return path
+
+    async def store_stream(self, source: BinaryIO) -> Tuple[str, str, int]:
+        """边读边计算哈希写入临时文件，再放入存储；返回 (sha256, 路径, 大小)"""
+        return await self.file_io.write(self._store_stream, source)
+
+    def _store_stream(self, source: BinaryIO) -> Tuple[str, str, int]:
+        hasher = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.blob_dir, prefix=".incoming-")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                while True:
+                    piece = source.read(_COPY_BUFFER)
+                    if not piece:
+                        break
+                    hasher.update(piece)
+                    tmp.write(piece)
+                    size += len(piece)
+            sha256 = hasher.hexdigest()
+            return sha256, self._store_file(tmp_path, sha256), size
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    async def store_bytes(self, data: bytes) -> Tuple[str, str, int]:
+        """保存内存中的文件内容（兼容 base64 上传的旧客户端）"""
+        return await self.file_io.write(self._store_bytes, data)
+
+    def _store_bytes(self, data: bytes) -> Tuple[str, str, int]:
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self.path_for(sha256)
+        if os.path.exists(path):
+            self.deduplicated_count += 1
+            self.bytes_deduplicated += len(data)
+            return sha256, path, len(data)
+        fd, tmp_path = tempfile.mkstemp(dir=self.blob_dir, prefix=".incoming-")
+        with os.fdopen(fd, "wb") as tmp:
+            tmp.write(data)
+        return sha256, self._store_file(tmp_path, sha256), len(data)
+
+    async def register(self, sha256: str, path: str, size: int, mime_type: str = None):
+        """一条消息引用了该文件，第一次出现时记录到 blobs 表"""
+        await self.db_executor.run_in_session(
+            lambda db: BlobService(db).register(sha256, path, size, mime_type)
+        )
+
+    def stats(self) -> dict:
+        return {
+            "stored": self.stored_count,
+            "deduplicated": self.deduplicated_count,
+            "bytes_written": self.bytes_written,
+            "bytes_deduplicated": self.bytes_deduplicated,
+            "uploads_skipped": self.uploads_skipped,
+            "bytes_not_uploaded": self.bytes_not_uploaded
+        }
@@ -1,5 +1,7 @@
 import sys
 import os
+import time
+import asyncio
 from datetime import datetime
 
 # 添加项目根目录到Python路径
@@ -10,85 +12,264 @@ if project_root not in sys.path:
 
 from fastapi import WebSocket
 from sqlalchemy.orm import Session
-from typing import Dict
-import json
+from typing import Dict, List, Optional
+
+from shared.protocols import WSMessage, WSMessageTypes, MessageResponse
+from models.user import Message
+from config.config import settings
+from fanout import FanoutEngine, EncodedFrame
+from message_bus import MessageBus, InProcessBus
+from group_index import GroupMembershipIndex
+from typing_indicator import PUBLIC_SCOPE, TypingTracker
+from stats_counters import StatsCounters
+from app_logging import get_logger, debug_sampled
+from metrics import MESSAGE_SEND_SECONDS, FANOUT_SECONDS, recipient_bucket
+from services.message_service import MessageService
+from user_directory import UserDirectory
+
+logger = get_logger("connection")
 
-from src.shared.protocols import WSMessage, WSMessageTypes, MessageResponse
-from server.models.user import Message
 
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, db_executor=None, message_writer=None, message_bus: MessageBus = None,
+                 stats_counters: StatsCounters = None, user_directory: UserDirectory = None):
+        # 数据库执行器，消息落库在线程池中完成，不阻塞事件循环
+        self.db_executor = db_executor
+        # 批量写入器，并发到达的消息合并为一次事务提交
+        self.message_writer = message_writer
+        # 统计计数器，消息落库和连接时增量更新
+        self.stats_counters = stats_counters
+        # 已实时推送、等待标记为已送达的私聊消息ID，一次 UPDATE 处理一批
+        self._delivered_ids: List[int] = []
+        self._delivered_task: Optional[asyncio.Task] = None
         self.active_connections: Dict[int, WebSocket] = {}
         self.user_status: Dict[int, str] = {}
+        # 每个连接独立的发送队列，广播不再等待慢客户端
+        self.fanout = FanoutEngine(
+            max_queue_size=settings.OUTBOUND_QUEUE_SIZE,
+            on_failure=self._handle_send_failure,
+            batch_interval=settings.WS_BATCH_TICK_MS / 1000,
+            batch_max_messages=settings.WS_BATCH_MAX_MESSAGES
+        )
+        # 消息总线，多 worker 部署时把消息转发给其他进程上的用户
+        self.message_bus = message_bus or InProcessBus()
+        # 群组成员索引，群消息只投递给该群的在线成员
+        self.group_index = GroupMembershipIndex()
+        # 用户目录缓存，本进程的失效经消息总线通知其他 worker
+        self.user_directory = user_directory
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        if user_directory is not None:
+            user_directory.on_invalidate = self._publish_user_invalidation
+        # 输入状态只发给会话参与者（未指定会话时广播），重复事件合并，超时由服务端发出 typing_stop
+        self.typing = TypingTracker(
+            ttl=settings.TYPING_TTL_SECONDS,
+            min_interval=settings.TYPING_MIN_INTERVAL,
+            on_expire=self._expire_typing
+        )
+    
+    async def start_bus(self):
+        self._loop = asyncio.get_running_loop()
+        await self.message_bus.start(self._deliver_from_bus)
+    
+    async def stop_bus(self):
+        await self.message_bus.stop()
+    
+    def _deliver_from_bus(self, op: str, target, message: dict):
+        """投递其他 worker 转发过来的消息，只发给本进程的连接"""
+        if op == "personal":
+            self.fanout.send(target, message)
+        elif op == "private":
+            user_id, message_ids = target
+            self.fanout.send(user_id, message, on_sent=lambda: self._queue_delivered(message_ids))
+        elif op == "broadcast":
+            self.fanout.broadcast(EncodedFrame(message), exclude_user_id=target)
+        elif op == "multicast":
+            frame = EncodedFrame(message)
+            for user_id in target:
+                self.fanout.send(user_id, frame)
+        elif op == "control":
+            self._apply_control_event(message)
+    
+    async def load_group_index(self):
+        """启动时从数据库加载群组成员索引"""
+        group_count = await self.db_executor.run_in_session(self.group_index.load)
+        logger.info("👥 Loaded %d groups into membership index", group_count)
+    
+    def add_group(self, group_id: int, member_ids):
+        """新建群组后加入索引，并通知其他 worker"""
+        event = {"kind": "group_created", "group_id": group_id, "member_ids": list(member_ids)}
+        self._apply_group_event(event)
+        self.message_bus.publish_control(event)
+    
+    def add_group_member(self, group_id: int, user_id: int):
+        """群组成员增加后更新索引，并通知其他 worker"""
+        event = {"kind": "group_member_added", "group_id": group_id, "user_id": user_id}
+        self._apply_group_event(event)
+        self.message_bus.publish_control(event)
+    
+    def remove_group_member(self, group_id: int, user_id: int):
+        event = {"kind": "group_member_removed", "group_id": group_id, "user_id": user_id}
+        self._apply_group_event(event)
+        self.message_bus.publish_control(event)
+    
+    def _publish_user_invalidation(self, user_id: Optional[int], username: Optional[str]):
+        """用户目录失效后通知其他 worker；失效发生在线程池中，总线只能在事件循环中写"""
+        if self._loop is None:
+            return
+        event = {"kind": "user_invalidated", "user_id": user_id, "username": username}
+        self._loop.call_soon_threadsafe(self.message_bus.publish_control, event)
     
-    async def connect(self, websocket: WebSocket, user):
+    def _apply_control_event(self, event: dict):
+        if event["kind"] == "user_invalidated":
+            if self.user_directory is not None:
+                self.user_directory.invalidate_local(event["user_id"], event["username"], remote=True)
+        else:
+            self._apply_group_event(event)
+    
+    def _apply_group_event(self, event: dict):
+        if event["kind"] == "group_created":
+            self.group_index.add_group(event["group_id"], event["member_ids"])
+        elif event["kind"] == "group_member_added":
+            self.group_index.add_member(event["group_id"], event["user_id"])
+        elif event["kind"] == "group_member_removed":
+            self.group_index.remove_member(event["group_id"], event["user_id"])
+    
+    async def send_to_users(self, message: dict, user_ids, exclude_user_id: int = None) -> int:
+        """发给指定的一组用户：只序列化一次，只遍历这组用户，不在线的跳过；返回投递数量"""
+        start = time.perf_counter()
+        frame = message if isinstance(message, EncodedFrame) else EncodedFrame(message)
+        queued = 0
+        remote_user_ids = []
+        for user_id in user_ids:
+            if user_id == exclude_user_id:
+                continue
+            if user_id in self.active_connections:
+                if self.fanout.send(user_id, frame):
+                    queued += 1
+            elif self.message_bus.is_remote_online(user_id):
+                remote_user_ids.append(user_id)
+        if remote_user_ids:
+            queued += await self.message_bus.publish_multicast(remote_user_ids, frame)
+        FANOUT_SECONDS.labels(recipient_bucket(queued)).observe(time.perf_counter() - start)
+        return queued
+    
+    async def connect(self, websocket: WebSocket, user, subprotocol: str = None, batch: bool = False):
         self.active_connections[user.id] = websocket
         self.user_status[user.id] = "online"
+        self.fanout.register(user.id, websocket, subprotocol, batch)
+        self.message_bus.register_user(user.id)
+        if self.stats_counters:
+            self.stats_counters.record_connection()
         
         # 广播用户上线状态
         await self.broadcast_user_status(user, "online")
-        print(f"✅ User {user.username} (ID: {user.id}) connected. Total users: {len(self.active_connections)}")
-        print(f"📊 Active connections: {list(self.active_connections.keys())}")
+        logger.info("✅ User %s (ID: %s) connected. Total users: %d",
+                    user.username, user.id, len(self.active_connections))
     
-    def disconnect(self, user):
-        if user.id in self.active_connections:
-            del self.active_connections[user.id]
-        if user.id in self.user_status:
-            self.user_status[user.id] = "offline"
-        print(f"🔌 User {user.username} (ID: {user.id}) disconnected. Total users: {len(self.active_connections)}")
-        print(f"📊 Active connections: {list(self.active_connections.keys())}")
+    def disconnect(self, user, websocket: WebSocket = None) -> bool:
+        """连接关闭后的清理，返回用户是否因此下线
+
+        同一用户重新登录后旧连接才关闭时，新连接已经替换了登记的连接，旧连接的清理不能
+        把新连接一起移除；指定 websocket 时只在登记的仍是这个连接时清理。
+        """
+        went_offline = self._remove_connection(user.id, websocket)
+        logger.info("🔌 User %s (ID: %s) disconnected%s. Total users: %d",
+                    user.username, user.id, "" if went_offline else " (replaced by a newer connection)",
+                    len(self.active_connections))
+        return went_offline
+    
+    def _remove_connection(self, user_id: int, websocket: WebSocket = None) -> bool:
+        self.fanout.unregister(user_id, websocket)
+        current = self.active_connections.get(user_id)
+        if current is None or (websocket is not None and current is not websocket):
+            return False
+        del self.active_connections[user_id]
+        self.message_bus.unregister_user(user_id)
+        if user_id in self.user_status:
+            self.user_status[user_id] = "offline"
+        return True
     
     async def send_personal_json(self, message: dict, user_id: int):
         """发送JSON消息给特定用户"""
-        print(f"📤 Attempting to send message to user {user_id}")
-        print(f"📤 Message type: {message.get('type')}")
-        print(f"📤 Active connections: {list(self.active_connections.keys())}")
-        
         if user_id in self.active_connections:
-            try:
-                await self.active_connections[user_id].send_json(message)
-                print(f"✅ Successfully sent message to user {user_id}")
-                print(f"✅ Message content: {message.get('data', {}).get('content', 'No content')}")
+            # 只入队，由该连接的写协程负责实际发送
+            start = time.perf_counter()
+            if self.fanout.send(user_id, message):
+                FANOUT_SECONDS.labels("1").observe(time.perf_counter() - start)
+                debug_sampled(logger, "📤 Queued %s for user %s", message.get("type"), user_id)
                 return True
-            except Exception as e:
-                print(f"❌ Error sending message to user {user_id}: {e}")
-                # 清理失效的连接
-                if user_id in self.active_connections:
-                    del self.active_connections[user_id]
-                return False
+            logger.warning("⚠️ Outbound queue for user %s is full, message dropped", user_id)
+            return False
+        elif self.message_bus.is_remote_online(user_id):
+            # 用户连接在其他 worker 上，经消息总线转发
+            return await self.message_bus.publish_personal(user_id, message)
         else:
-            print(f"⚠️ User {user_id} is not online, message not delivered")
-            print(f"⚠️ Available users: {list(self.active_connections.keys())}")
+            debug_sampled(logger, "⚠️ User %s is not online, message not delivered", user_id)
             return False
     
-    async def broadcast_json(self, message: dict, exclude_user_id: int = None):
-        """广播JSON消息给所有用户"""
-        disconnected = []
-        print(f"📢 Broadcasting message to all users (excluding: {exclude_user_id})")
-        
-        for user_id, connection in self.active_connections.items():
-            if user_id != exclude_user_id:
+    async def send_private(self, message: dict, receiver_id: int, message_ids: List[int]) -> bool:
+        """推送私聊消息，返回是否已交给接收者的连接（或其所在的 worker）
+
+        消息实际写进接收者的连接后才标记为已送达：连接在写出前关闭、队列被替换时消息保持未送达，
+        接收者下次上线时补发。接收者在其他 worker 上时由那个 worker 写出后标记。
+        """
+        if receiver_id in self.active_connections:
+            start = time.perf_counter()
+            if self.fanout.send(receiver_id, message, on_sent=lambda: self._queue_delivered(message_ids)):
+                FANOUT_SECONDS.labels("1").observe(time.perf_counter() - start)
+                return True
+            logger.warning("⚠️ Outbound queue for user %s is full, message dropped", receiver_id)
+            return False
+        if self.message_bus.is_remote_online(receiver_id):
+            return await self.message_bus.publish_personal(receiver_id, message, message_ids)
+        debug_sampled(logger, "⚠️ User %s is not online, message not delivered", receiver_id)
+        return False
+    
+    def _queue_delivered(self, message_ids: List[int]):
+        """消息已写进连接，合并到下一次 UPDATE 中标记为已送达"""
+        if not self.db_executor:
+            return
+        self._delivered_ids.extend(message_ids)
+        if self._delivered_task is None:
+            self._delivered_task = asyncio.create_task(self._mark_delivered())
+    
+    async def _mark_delivered(self):
+        """标记已送达：上一次 UPDATE 执行期间推送的消息合并到下一次"""
+        try:
+            while self._delivered_ids:
+                message_ids, self._delivered_ids = self._delivered_ids, []
                 try:
-                    await connection.send_json(message)
-                    print(f"✅ Broadcast to user {user_id}")
+                    await self.db_executor.run_in_session(
+                        lambda db: MessageService(db).mark_delivered_by_ids(message_ids)
+                    )
                 except Exception as e:
-                    print(f"❌ Error broadcasting to user {user_id}: {e}")
-                    disconnected.append(user_id)
-        
-        # 清理断开的连接
-        for user_id in disconnected:
-            if user_id in self.active_connections:
-                del self.active_connections[user_id]
-                print(f"🧹 Cleaned up disconnected user {user_id}")
+                    # 保持未送达，接收者下次上线时会重复收到这些消息，但不会丢失
+                    logger.error("❌ 标记 %d 条消息为已送达失败: %s", len(message_ids), e)
+        finally:
+            self._delivered_task = None
+    
+    async def broadcast_json(self, message: dict, exclude_user_id: int = None):
+        """广播JSON消息给所有用户"""
+        start = time.perf_counter()
+        # 只序列化一次，所有接收者共用同一份编码结果
+        frame = message if isinstance(message, EncodedFrame) else EncodedFrame(message)
+        queued = self.fanout.broadcast(frame, exclude_user_id=exclude_user_id)
+        await self.message_bus.publish_broadcast(frame, exclude_user_id=exclude_user_id)
+        FANOUT_SECONDS.labels(recipient_bucket(queued)).observe(time.perf_counter() - start)
+        debug_sampled(logger, "📢 Broadcast %s queued for %d users", frame.get("type"), queued)
+    
+    def _handle_send_failure(self, user_id: int, websocket: WebSocket):
+        """写协程发送失败时清理失效的连接"""
+        if self.active_connections.get(user_id) is websocket:
+            del self.active_connections[user_id]
+            self.message_bus.unregister_user(user_id)
+            logger.info("🧹 Cleaned up disconnected user %s", user_id)
     
     async def handle_message_send(self, message: WSMessage, sender, db: Session):
+        received_at = time.perf_counter()
         try:
-            print(f"🔄 [DEBUG] ====== 开始处理消息发送 ======")
-            print(f"🔄 [DEBUG] 发送者: {sender.username} (ID: {sender.id})")
-            print(f"🔄 [DEBUG] 消息类型: {message.type}")
-            print(f"🔄 [DEBUG] 消息数据: {message.data}")
-            print(f"🔄 [DEBUG] 当前活跃连接: {list(self.active_connections.keys())}")
-            print(f"🔄 [DEBUG] 接收者ID: {message.data.get('receiver_id')}")
+            debug_sampled(logger, "🔄 处理消息发送: 发送者 %s (ID: %s), 类型 %s, 数据 %s",
+                          sender.username, sender.id, message.type, message.data)
             
             # 检查消息数据
             if "content" not in message.data:
@@ -99,21 +280,32 @@ class ConnectionManager:
                 await self.send_personal_json(error_msg, sender.id)
                 return
             
-            # 保存消息到数据库
+            # 群聊消息只允许群成员发送
+            receiver_id = message.data.get("receiver_id")
+            group_id = message.data.get("group_id")
+            if group_id and not receiver_id and not self.group_index.is_member(group_id, sender.id):
+                error_msg = {
+                    "type": "error",
+                    "data": {"message": "群组不存在或你不是该群组成员"}
+                }
+                await self.send_personal_json(error_msg, sender.id)
+                return
+            
+            # 保存消息到数据库：私聊消息先记为未送达，推送成功后再标记，推送失败时上线补发
             db_message = Message(
                 content=message.data["content"],
                 message_type=message.data.get("message_type", "private"),
                 sender_id=sender.id,
-                receiver_id=message.data.get("receiver_id"),
-                group_id=message.data.get("group_id"),
-                timestamp=datetime.utcnow()
+                receiver_id=receiver_id,
+                group_id=group_id,
+                timestamp=datetime.utcnow(),
+                delivered=not receiver_id
             )
             
-            db.add(db_message)
-            db.commit()
-            db.refresh(db_message)
+            db_message = await self.save_message(db, db_message)
             
-            print(f"💾 消息保存到数据库: ID {db_message.id}")
+            debug_sampled(logger, "💾 消息保存到数据库: ID %s", db_message.id)
+            self.typing.message_sent(sender.id, self._typing_scope(sender.id, message.data))
             
             # 构建响应消息
             response_data = {
@@ -131,15 +323,13 @@ class ConnectionManager:
             if message.data.get("receiver_id"):
                 # 私聊消息
                 receiver_id = message.data["receiver_id"]
-                print(f"📨 Private message from {sender.username} (ID: {sender.id}) to user ID: {receiver_id}")
                 
                 # 发送给接收者
                 receiver_message = {
                     "type": "private_message",
                     "data": response_data
                 }
-                print(f"📨 Sending private message to receiver {receiver_id}")
-                sent_to_receiver = await self.send_personal_json(receiver_message, receiver_id)
+                sent_to_receiver = await self.send_private(receiver_message, receiver_id, [db_message.id])
                 
                 # 发送确认消息给发送者
                 sender_message = {
@@ -150,30 +340,34 @@ class ConnectionManager:
                         "receiver_online": sent_to_receiver
                     }
                 }
-                print(f"📨 Sending confirmation to sender {sender.id}")
                 await self.send_personal_json(sender_message, sender.id)
+                debug_sampled(logger, "📨 Private message %s from %s to user %s, delivered: %s",
+                              db_message.id, sender.id, receiver_id, sent_to_receiver)
                 
-                if sent_to_receiver:
-                    print(f"✅ Private message delivered successfully to user {receiver_id}")
-                else:
-                    print(f"⚠️ Private message NOT delivered to user {receiver_id} (user offline)")
+            elif group_id:
+                # 群聊消息（只投递给该群组的在线成员）
+                group_message = {
+                    "type": "group_message",
+                    "data": response_data
+                }
+                members = self.group_index.get_members(group_id)
+                delivered = await self.send_to_users(group_message, members)
+                debug_sampled(logger, "👥 Group message %s from %s delivered to %d/%d members of group %s",
+                              db_message.id, sender.id, delivered, len(members), group_id)
                 
             else:
-                # 群聊消息（广播给所有用户）
+                # 公共消息（广播给所有用户）
                 broadcast_message = {
                     "type": "group_message", 
                     "data": response_data
                 }
-                print(f"📢 Broadcasting group message from {sender.username}")
                 await self.broadcast_json(broadcast_message)
-                
-            print(f"✅ Message from {sender.username} processed successfully")
-            print(f"🔄 [DEBUG] ====== 消息处理完成 ======")
+            
+            kind = "private" if receiver_id else "group" if group_id else "public"
+            MESSAGE_SEND_SECONDS.labels(kind).observe(time.perf_counter() - received_at)
             
         except Exception as e:
-            print(f"❌ Error handling message: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("❌ Error handling message from user %s: %s", sender.id, e)
             
             # 发送错误消息给发送者
             error_msg = {
@@ -181,7 +375,25 @@ class ConnectionManager:
                 "data": {"message": f"消息发送失败: {str(e)}"}
             }
             await self.send_personal_json(error_msg, sender.id)
-            print(f"🔄 [DEBUG] ====== 消息处理失败 ======")
+    
+    async def save_message(self, db: Session, db_message: Message) -> Message:
+        """保存消息，优先使用批量写入器，返回带ID的消息"""
+        if self.message_writer:
+            db_message = await self.message_writer.submit(db_message)
+        elif self.db_executor:
+            db_message = await self.db_executor.run(self._save_message, db, db_message)
+        else:
+            db_message = self._save_message(db, db_message)
+        if self.stats_counters:
+            self.stats_counters.record_messages()
+        return db_message
+    
+    @staticmethod
+    def _save_message(db: Session, db_message: Message) -> Message:
+        db.add(db_message)
+        db.commit()
+        db.refresh(db_message)
+        return db_message
     
     async def broadcast_user_status(self, user, status: str):
         status_message = {
@@ -194,26 +406,113 @@ class ConnectionManager:
         }
         
         await self.broadcast_json(status_message)
-        print(f"🔄 User {user.username} (ID: {user.id}) status updated to {status}")
+        logger.debug("🔄 User %s (ID: %s) status updated to %s", user.username, user.id, status)
+    
+    def _typing_scope(self, user_id: int, data: dict):
+        """根据事件数据确定输入状态的会话范围，不是群成员时返回 None；未指定会话时发给所有在线用户"""
+        if data.get("receiver_id"):
+            return ("private", data["receiver_id"])
+        group_id = data.get("group_id")
+        if not group_id:
+            return PUBLIC_SCOPE
+        if self.group_index.is_member(group_id, user_id):
+            return ("group", group_id)
+        return None
     
-    async def broadcast_typing(self, user_id: int, is_typing: bool):
+    def _typing_recipients(self, scope):
+        kind, target = scope
+        if kind == "private":
+            return [target]
+        return self.group_index.get_members(target)
+    
+    async def _send_typing(self, user_id: int, scope, is_typing: bool, expired: bool = False):
+        kind, target = scope
+        data = {"user_id": user_id}
+        if kind != "public":
+            data["receiver_id" if kind == "private" else "group_id"] = target
+        if is_typing:
+            data["expires_in"] = self.typing.ttl
+        elif expired:
+            data["expired"] = True
         typing_message = {
             "type": "typing_start" if is_typing else "typing_stop",
-            "data": {"user_id": user_id}
+            "data": data
         }
-        
-        await self.broadcast_json(typing_message, exclude_user_id=user_id)
-        print(f"⌨️ User {user_id} typing: {is_typing}")
+        if kind == "public":
+            await self.broadcast_json(typing_message, exclude_user_id=user_id)
+        else:
+            await self.send_to_users(typing_message, self._typing_recipients(scope), exclude_user_id=user_id)
     
-    def disconnect_by_user_id(self, user_id: int):
-        """通过用户ID断开连接"""
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
-        if user_id in self.user_status:
-            self.user_status[user_id] = "offline"
-        print(f"🔌 User {user_id} disconnected by ID")
-        print(f"📊 Active connections: {list(self.active_connections.keys())}")
+    async def _expire_typing(self, user_id: int, scope):
+        await self._send_typing(user_id, scope, False, expired=True)
+    
+    async def handle_typing(self, user_id: int, is_typing: bool, data: dict):
+        """处理客户端的输入状态事件，指定了会话时只转发给会话参与者，被合并或限速的事件直接丢弃"""
+        scope = self._typing_scope(user_id, data or {})
+        if is_typing:
+            forward = self.typing.typing_started(user_id, scope)
+        else:
+            forward = self.typing.typing_stopped(user_id, scope)
+        if forward:
+            await self._send_typing(user_id, scope, is_typing)
+    
+    def disconnect_by_user_id(self, user_id: int, websocket: WebSocket = None) -> bool:
+        """通过用户ID断开连接；指定 websocket 时只断开这个连接"""
+        went_offline = self._remove_connection(user_id, websocket)
+        logger.info("🔌 User %s disconnected by ID. Total users: %d", user_id, len(self.active_connections))
+        return went_offline
+    
+    def online_count(self) -> int:
+        """在线用户数（本进程的连接加上其他 worker 上的用户）"""
+        return len(self.active_connections) + self.message_bus.remote_user_count()
+    
+    def is_online(self, user_id: int) -> bool:
+        """用户当前是否有活跃连接（包括连接在其他 worker 上的用户）"""
+        return user_id in self.active_connections or self.message_bus.is_remote_online(user_id)
+    
+    async def replay_offline_messages(self, user, batch_size: int = None):
+        """用户上线后分批补发离线期间收到的私聊消息
+
+        每次只加载一批，写出到连接后再标记为已送达并加载下一批
+        """
+        batch_size = batch_size or settings.OFFLINE_REPLAY_BATCH_SIZE
+        after_id = 0
+        replayed = 0
+        while user.id in self.active_connections:
+            messages = await self.db_executor.run_in_session(
+                lambda db: MessageService(db).get_undelivered_messages(user.id, after_id, batch_size)
+            )
+            if not messages:
+                break
+            
+            frame = {
+                "type": "offline_messages",
+                "data": {
+                    "messages": messages,
+                    "has_more": len(messages) == batch_size
+                }
+            }
+            if not self.fanout.send(user.id, frame):
+                break
+            # 等这一批真正写出后再标记，连接中断时下次上线会重新补发
+            if not await self.fanout.flush(user.id, timeout=settings.OFFLINE_REPLAY_FLUSH_TIMEOUT):
+                break
+            
+            message_ids = [m["id"] for m in messages]
+            await self.db_executor.run_in_session(
+                lambda db: MessageService(db).mark_delivered(user.id, message_ids)
+            )
+            replayed += len(messages)
+            after_id = message_ids[-1]
+        
+        if replayed:
+            logger.info("📬 Replayed %d offline messages to user %s", replayed, user.id)
+        return replayed
     
     def get_online_users(self):
         """获取在线用户列表"""
-        return list(self.active_connections.keys())
\ No newline at end of file
+        return list(set(self.active_connections) | self.message_bus.remote_users())
+    
+    def get_connection_stats(self):
+        """获取每个连接的发送队列深度和丢弃计数"""
+        return self.fanout.stats()
\ No newline at end of file
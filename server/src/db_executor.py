@@ -0,0 +1,36 @@
+# server/src/db_executor.py
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+
+class DatabaseExecutor:
+    """数据库执行器：同步ORM调用统一放到专用线程池中执行，避免阻塞事件循环"""
+
+    def __init__(self, session_factory: Callable, max_workers: int = 5):
+        self.session_factory = session_factory
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """在数据库线程池中执行同步函数并等待结果
+
+        传入的会话同一时间只能被一个调用使用，调用方需逐个 await
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def run_in_session(self, func: Callable, *args, **kwargs) -> Any:
+        """使用新的会话执行 func(db, ...)，执行结束后关闭会话"""
+        def task():
+            db = self.session_factory()
+            try:
+                return func(db, *args, **kwargs)
+            finally:
+                db.close()
+
+        return await self.run(task)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,290 @@
+# server/src/downloads.py
+import hashlib
+import os
+from email.utils import formatdate
+from typing import BinaryIO, Optional, Tuple
+from urllib.parse import quote
+
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from blob_store import BlobStore
+from cache import LRUCache
+from db_executor import DatabaseExecutor
+from file_io import FileIOExecutor
+from models.user import Message
+
+_HASH_BUFFER = 1024 * 1024
+
+
+class RangeNotSatisfiable(ValueError):
+    """Range 请求的起点超出文件大小"""
+
+
+class FileMetadata:
+    """下载所需的文件信息，按文件ID缓存，避免每次下载都查数据库"""
+
+    def __init__(self, path: str, size: int, mtime: float, etag: str,
+                 file_name: str, mime_type: str, immutable: bool):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.etag = etag
+        self.file_name = file_name
+        self.mime_type = mime_type
+        self.immutable = immutable
+        self.last_modified = formatdate(mtime, usegmt=True)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """解析单个字节范围，返回闭区间 (start, end)
+
+    格式不支持（多段范围、非 bytes 单位、语法错误）时返回 None，按完整文件响应。
+    """
+    if not header or not header.startswith("bytes="):
+        return None
+    spec = header[len("bytes="):].strip()
+    if "," in spec or "-" not in spec:
+        return None
+    first, last = (part.strip() for part in spec.split("-", 1))
+    if not (first or last) or not (first or "0").isdigit() or not (last or "0").isdigit():
+        return None
+    if not first:
+        # bytes=-N：最后 N 个字节
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise RangeNotSatisfiable(header)
+        return max(0, size - suffix), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """If-None-Match 比较（弱比较）"""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in header.split(","))
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def content_disposition(file_name: str) -> str:
+    quoted = quote(file_name)
+    if quoted != file_name:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{file_name}"'
+
+
+class FileRangeResponse(Response):
+    """发送文件的全部或一段
+
+    服务器支持 ASGI zerocopy 扩展时直接交给内核 sendfile；否则在文件线程池中分块读取，
+    不占用事件循环。
+    """
+
+    def __init__(self, file: BinaryIO, start: int, length: int, status_code: int,
+                 headers: dict, media_type: str, file_io: FileIOExecutor,
+                 chunk_size: int, send_body: bool = True, on_zerocopy=None):
+        self.file = file
+        self.start = start
+        self.length = length
+        self.status_code = status_code
+        self.media_type = media_type
+        self.file_io = file_io
+        self.chunk_size = chunk_size
+        self.send_body = send_body
+        self.on_zerocopy = on_zerocopy
+        self.background = None
+        self.init_headers(dict(headers, **{"content-length": str(length)}))
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers
+            })
+            if not self.send_body or self.length == 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+            elif "http.response.zerocopy" in scope.get("extensions", {}):
+                if self.on_zerocopy:
+                    self.on_zerocopy()
+                await send({
+                    "type": "http.response.zerocopy",
+                    "file": self.file.fileno(),
+                    "offset": self.start,
+                    "count": self.length,
+                    "more_body": False
+                })
+            else:
+                await self._send_chunks(send)
+        finally:
+            await self.file_io.run(self.file.close)
+
+    async def _send_chunks(self, send: Send):
+        remaining = self.length
+        position = self.start
+        while remaining > 0:
+            # os.pread 不依赖文件位置，读取在线程池中完成
+            chunk = await self.file_io.run(os.pread, self.file.fileno(), min(self.chunk_size, remaining), position)
+            if not chunk:
+                break
+            position += len(chunk)
+            remaining -= len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            # 文件在发送过程中被截断，结束响应体
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+class DownloadManager:
+    """附件下载：文件信息走 LRU 缓存，支持 Range、ETag/If-None-Match 和 304
+
+    下载URL中是消息的文件ID（messages.file_id），按它查出存储路径、文件名和类型。
+    内容寻址存储中的文件名就是 sha256，直接作为强 ETag；旧的按随机文件名保存的文件
+    在第一次下载时计算一次哈希后缓存。
+    """
+
+    def __init__(self, db_executor: DatabaseExecutor, file_io: FileIOExecutor,
+                 cache_size: int = 4096, chunk_size: int = 256 * 1024):
+        self.db_executor = db_executor
+        self.file_io = file_io
+        self.chunk_size = chunk_size
+        self.cache = LRUCache(cache_size)
+
+        # 统计信息
+        self.full_responses = 0
+        self.partial_responses = 0
+        self.not_modified = 0
+        self.zerocopy_responses = 0
+        self.bytes_sent = 0
+
+    async def open(self, file_id: str) -> Optional[Tuple[FileMetadata, BinaryIO]]:
+        """打开文件并返回 (文件信息, 文件对象)，文件ID不存在或文件已丢失时返回 None"""
+        if not file_id or len(file_id) > 64:
+            return None
+        metadata = self.cache.get(file_id)
+        row = None
+        if metadata is None:
+            row = await self.db_executor.run_in_session(lambda db: self._query_message(db, file_id))
+            if row is None or not row.file_path:
+                return None
+            path = row.file_path
+        else:
+            path = metadata.path
+        try:
+            file = await self.file_io.run(open, path, "rb")
+        except (FileNotFoundError, IsADirectoryError):
+            self.cache.invalidate(file_id)
+            return None
+        try:
+            stat = await self.file_io.run(os.fstat, file.fileno())
+            if metadata is None or metadata.size != stat.st_size or metadata.mtime != stat.st_mtime:
+                if row is None:
+                    row = await self.db_executor.run_in_session(lambda db: self._query_message(db, file_id))
+                metadata = await self._load_metadata(row, path, file, stat)
+                self.cache.set(file_id, metadata)
+        except BaseException:
+            await self.file_io.run(file.close)
+            raise
+        return metadata, file
+
+    async def _load_metadata(self, row, path: str, file: BinaryIO, stat: os.stat_result) -> FileMetadata:
+        stored_name = os.path.basename(path)
+        immutable = BlobStore.is_valid_hash(stored_name)
+        digest = stored_name if immutable else await self.file_io.run(self._hash_file, file.fileno())
+        return FileMetadata(
+            path=path,
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            etag=f'"{digest}"',
+            file_name=row.file_name if row and row.file_name else stored_name,
+            mime_type=row.mime_type if row and row.mime_type else "application/octet-stream",
+            immutable=immutable
+        )
+
+    @staticmethod
+    def _query_message(db, file_id: str):
+        return (
+            db.query(Message.file_path, Message.file_name, Message.mime_type)
+            .filter(Message.file_id == file_id)
+            .first()
+        )
+
+    @staticmethod
+    def _hash_file(fd: int) -> str:
+        hasher = hashlib.sha256()
+        position = 0
+        while True:
+            piece = os.pread(fd, _HASH_BUFFER, position)
+            if not piece:
+                return hasher.hexdigest()
+            hasher.update(piece)
+            position += len(piece)
+
+    def build_response(self, metadata: FileMetadata, file: BinaryIO, method: str,
+                       range_header: str = None, if_none_match: str = None,
+                       if_range: str = None) -> Response:
+        """根据条件请求头生成 200、206、304 或 416 响应"""
+        headers = {
+            "accept-ranges": "bytes",
+            "etag": metadata.etag,
+            "last-modified": metadata.last_modified,
+            # 内容寻址的文件内容永远不变；其他文件每次用 ETag 重新验证
+            "cache-control": "private, max-age=31536000, immutable" if metadata.immutable else "private, no-cache"
+        }
+
+        if etag_matches(if_none_match, metadata.etag):
+            self.not_modified += 1
+            return self._empty(file, 304, headers)
+
+        byte_range = None
+        # If-Range 与当前版本不一致时忽略 Range，返回完整文件
+        if range_header and (not if_range or if_range.strip() in (metadata.etag, metadata.last_modified)):
+            try:
+                byte_range = parse_range(range_header, metadata.size)
+            except RangeNotSatisfiable:
+                headers["content-range"] = f"bytes */{metadata.size}"
+                return self._empty(file, 416, headers)
+
+        headers["content-disposition"] = content_disposition(metadata.file_name)
+        if byte_range:
+            start, end = byte_range
+            headers["content-range"] = f"bytes {start}-{end}/{metadata.size}"
+            status_code = 206
+            self.partial_responses += 1
+        else:
+            start, end = 0, metadata.size - 1
+            status_code = 200
+            self.full_responses += 1
+
+        send_body = method != "HEAD"
+        length = end - start + 1
+        if send_body:
+            self.bytes_sent += length
+        return FileRangeResponse(file, start, length, status_code, headers, metadata.mime_type,
+                                 self.file_io, self.chunk_size, send_body=send_body,
+                                 on_zerocopy=self._count_zerocopy)
+
+    def _empty(self, file: BinaryIO, status_code: int, headers: dict) -> Response:
+        file.close()
+        return Response(status_code=status_code, headers=headers)
+
+    def _count_zerocopy(self):
+        self.zerocopy_responses += 1
+
+    def stats(self) -> dict:
+        return {
+            "metadata_cache": self.cache.stats(),
+            "full": self.full_responses,
+            "partial": self.partial_responses,
+            "not_modified": self.not_modified,
+            "zerocopy": self.zerocopy_responses,
+            "bytes_sent": self.bytes_sent
+        }
@@ -0,0 +1,305 @@
+# server/src/fanout.py
+import asyncio
+import json
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fastapi import WebSocket
+
+from app_logging import get_logger
+from metrics import WS_SEND_SECONDS, WS_BATCH_SIZE
+from shared import wire_format
+
+logger = get_logger("fanout")
+
+
+class EncodedFrame:
+    """预先序列化的消息帧，广播时所有接收者共用同一份编码结果
+
+    JSON 和 MessagePack 两种格式在第一次用到时各编码一次。
+    """
+
+    __slots__ = ("message", "_text", "_binary")
+
+    def __init__(self, message: dict):
+        self.message = message
+        self._text = None
+        self._binary = None
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            # 与 WebSocket.send_json 的编码方式保持一致
+            self._text = json.dumps(self.message, separators=(",", ":"))
+        return self._text
+
+    @property
+    def binary(self) -> bytes:
+        if self._binary is None:
+            self._binary = wire_format.encode_msgpack(self.message)
+        return self._binary
+
+    def get(self, key, default=None):
+        return self.message.get(key, default)
+
+
+class TrackedMessage:
+    """带写出回调的消息：写进连接后调用 on_sent；连接关闭、消息被丢弃时不调用"""
+
+    __slots__ = ("message", "on_sent")
+
+    def __init__(self, message: Any, on_sent: Callable[[], None]):
+        self.message = message
+        self.on_sent = on_sent
+
+
+def _payload(message: Any) -> Any:
+    return message.message if isinstance(message, TrackedMessage) else message
+
+
+class ConnectionSender:
+    """单个WebSocket连接的发送队列和写协程
+
+    设置了 batch_interval 时，写协程取到一条消息后等待一个周期，把期间入队的消息合成一帧发送。
+    """
+
+    def __init__(self, user_id: int, websocket: WebSocket, max_queue_size: int,
+                 on_failure: Optional[Callable[["ConnectionSender"], None]] = None,
+                 subprotocol: Optional[str] = None, batch_interval: Optional[float] = None,
+                 batch_max_messages: int = 256):
+        self.user_id = user_id
+        self.websocket = websocket
+        # 协商了 MessagePack 的连接发二进制帧
+        self.binary = wire_format.is_binary(subprotocol)
+        self.batch_interval = batch_interval
+        self.batch_max_messages = batch_max_messages
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self.on_failure = on_failure
+        self.sent_count = 0
+        self.frame_count = 0
+        self.dropped_count = 0
+        self.closed = False
+        # 已从队列取出、尚未 task_done 的消息数
+        self._in_flight = 0
+        self.task = asyncio.create_task(self._writer())
+
+    def enqueue(self, message: Any, on_sent: Optional[Callable[[], None]] = None) -> bool:
+        """把消息放入发送队列，不等待对端；队列满时丢弃并计数
+
+        on_sent 在消息实际写进连接后调用（例如标记私聊消息已送达）。
+        """
+        if self.closed:
+            return False
+        if on_sent is not None:
+            message = TrackedMessage(message, on_sent)
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped_count += 1
+            return False
+        return True
+
+    async def _writer(self):
+        """逐条（或按周期合并）发送队列中的消息，发送失败时关闭该连接"""
+        try:
+            while True:
+                message = await self.queue.get()
+                self._in_flight = 1
+                if self.batch_interval is None:
+                    await self._send(message)
+                    sent = [message]
+                else:
+                    sent = await self._send_batch(message)
+                self.sent_count += len(sent)
+                self.frame_count += 1
+                self._in_flight = 0
+                for _ in sent:
+                    self.queue.task_done()
+                self._notify_sent(sent)
+        except asyncio.CancelledError:
+            self.closed = True
+            self._abandon()
+            raise
+        except Exception as e:
+            logger.warning("❌ Error sending message to user %s: %s", self.user_id, e)
+            self.closed = True
+            self._abandon()
+            if self.on_failure:
+                self.on_failure(self)
+
+    def _notify_sent(self, sent: list):
+        for message in sent:
+            if isinstance(message, TrackedMessage):
+                try:
+                    message.on_sent()
+                except Exception as e:
+                    logger.warning("❌ on_sent callback failed for user %s: %s", self.user_id, e)
+
+    async def _send(self, message: Any):
+        message = _payload(message)
+        start = time.perf_counter()
+        if self.binary:
+            frame = message.binary if isinstance(message, EncodedFrame) else wire_format.encode_msgpack(message)
+            await self.websocket.send_bytes(frame)
+        elif isinstance(message, EncodedFrame):
+            await self.websocket.send_text(message.text)
+        else:
+            await self.websocket.send_json(message)
+        WS_SEND_SECONDS.observe(time.perf_counter() - start)
+
+    async def _send_batch(self, first: Any) -> list:
+        """把 first 和一个周期内入队的消息合成一帧发送，返回发送的消息"""
+        if self.queue.empty():
+            # 队列里已有积压时，这些消息在上一帧写出期间已经等过了，直接发送
+            await asyncio.sleep(self.batch_interval)
+        messages = [first]
+        while len(messages) < self.batch_max_messages and not self.queue.empty():
+            messages.append(self.queue.get_nowait())
+        self._in_flight = len(messages)
+        WS_BATCH_SIZE.observe(len(messages))
+        if len(messages) == 1:
+            await self._send(first)
+            return messages
+        payloads = [_payload(m) for m in messages]
+        start = time.perf_counter()
+        if self.binary:
+            await self.websocket.send_bytes(wire_format.encode_batch_msgpack([
+                m.binary if isinstance(m, EncodedFrame) else wire_format.encode_msgpack(m) for m in payloads
+            ]))
+        else:
+            await self.websocket.send_text(wire_format.encode_batch_json([
+                m.text if isinstance(m, EncodedFrame) else wire_format.encode_json(m) for m in payloads
+            ]))
+        WS_SEND_SECONDS.observe(time.perf_counter() - start)
+        return messages
+
+    def _abandon(self):
+        """连接关闭后，把取出未发完的和仍在队列中的消息都标记完成，等待 flush 的协程立即返回"""
+        for _ in range(self._in_flight):
+            self.queue.task_done()
+        self._in_flight = 0
+        while True:
+            try:
+                self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            self.queue.task_done()
+
+    async def flush(self, timeout: float = None) -> bool:
+        """等待队列中的消息全部写出，连接关闭或超时返回 False"""
+        if self.closed:
+            return False
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return not self.closed
+
+    def close(self):
+        """停止写协程，丢弃尚未发送的消息"""
+        self.closed = True
+        if not self.task.done():
+            self.task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue.qsize(),
+            "max_queue_size": self.queue.maxsize,
+            "sent": self.sent_count,
+            "frames": self.frame_count,
+            "batching": self.batch_interval is not None,
+            "dropped": self.dropped_count
+        }
+
+
+class FanoutEngine:
+    """消息扇出引擎：每个连接一个有界队列，广播只需每个接收者入队一次
+
+    batch_interval（秒）为请求了合并的连接的合并周期，None 或 0 时不合并。
+    """
+
+    def __init__(self, max_queue_size: int = 1000,
+                 on_failure: Optional[Callable[[int, WebSocket], None]] = None,
+                 batch_interval: Optional[float] = None, batch_max_messages: int = 256):
+        self.max_queue_size = max_queue_size
+        self.on_failure = on_failure
+        self.batch_interval = batch_interval or None
+        self.batch_max_messages = batch_max_messages
+        self.senders: Dict[int, ConnectionSender] = {}
+        self.total_dropped = 0
+
+    def register(self, user_id: int, websocket: WebSocket, subprotocol: Optional[str] = None,
+                 batch: bool = False) -> ConnectionSender:
+        """为连接创建发送队列，同一用户重复连接时替换旧的
+
+        subprotocol 为连接时协商的帧格式；batch 为客户端是否接受合并帧，服务端未开启合并时忽略。
+        """
+        old_sender = self.senders.get(user_id)
+        if old_sender:
+            self._close_sender(old_sender)
+        sender = ConnectionSender(user_id, websocket, self.max_queue_size, self._handle_failure, subprotocol,
+                                  self.batch_interval if batch else None, self.batch_max_messages)
+        self.senders[user_id] = sender
+        return sender
+
+    def unregister(self, user_id: int, websocket: WebSocket = None):
+        """移除连接的发送队列；指定websocket时只移除匹配的连接"""
+        sender = self.senders.get(user_id)
+        if sender is None or (websocket is not None and sender.websocket is not websocket):
+            return
+        del self.senders[user_id]
+        self._close_sender(sender)
+
+    def send(self, user_id: int, message: Any, on_sent: Optional[Callable[[], None]] = None) -> bool:
+        """发送给单个用户，返回是否成功入队；on_sent 在消息写进连接后调用"""
+        sender = self.senders.get(user_id)
+        if sender is None:
+            return False
+        return sender.enqueue(message, on_sent)
+
+    async def flush(self, user_id: int, timeout: float = None) -> bool:
+        """等待某个用户的发送队列写空"""
+        sender = self.senders.get(user_id)
+        if sender is None:
+            return False
+        return await sender.flush(timeout)
+
+    def broadcast(self, message: Any, exclude_user_id: int = None) -> int:
+        """广播给所有连接，返回成功入队的数量"""
+        queued = 0
+        for user_id, sender in self.senders.items():
+            if user_id != exclude_user_id and sender.enqueue(message):
+                queued += 1
+        return queued
+
+    def stats(self) -> dict:
+        """每个连接的队列深度和丢弃计数"""
+        return {
+            "connections": {user_id: sender.stats() for user_id, sender in self.senders.items()},
+            "total_dropped": self.total_dropped_count()
+        }
+
+    def queue_depths(self) -> Tuple[int, int]:
+        """所有连接队列中等待发送的总帧数和最深的队列，不构造每个连接的统计"""
+        total = 0
+        deepest = 0
+        for sender in self.senders.values():
+            depth = sender.queue.qsize()
+            total += depth
+            if depth > deepest:
+                deepest = depth
+        return total, deepest
+
+    def total_dropped_count(self) -> int:
+        return self.total_dropped + sum(s.dropped_count for s in self.senders.values())
+
+    def _close_sender(self, sender: ConnectionSender):
+        self.total_dropped += sender.dropped_count
+        sender.close()
+
+    def _handle_failure(self, sender: ConnectionSender):
+        if self.senders.get(sender.user_id) is sender:
+            del self.senders[sender.user_id]
+            self.total_dropped += sender.dropped_count
+        if self.on_failure:
+            self.on_failure(sender.user_id, sender.websocket)
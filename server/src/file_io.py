@@ -0,0 +1,68 @@
+# server/src/file_io.py
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Optional
+
+
+class FileIOExecutor:
+    """文件读写执行器：磁盘操作统一放到有界线程池中执行，并限制同时写盘的数量
+
+    上传风暴时写入者在信号量上排队，而不是把所有线程和磁盘带宽占满，
+    下载、缩略图等读操作始终能拿到线程。
+    """
+
+    def __init__(self, max_workers: int = 8, max_concurrent_writers: int = 4):
+        self.max_workers = max_workers
+        self.max_concurrent_writers = max_concurrent_writers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="file-io")
+        self._writers: Optional[asyncio.Semaphore] = None
+
+        # 统计信息
+        self.operations = 0
+        self.active_writers = 0
+        self.waiting_writers = 0
+        self.max_waiting_writers = 0
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """在文件线程池中执行同步函数并等待结果"""
+        self.operations += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    @asynccontextmanager
+    async def writer(self):
+        """占用一个写盘名额，多步写入（如流式接收一个分块）期间一直持有"""
+        if self._writers is None:
+            self._writers = asyncio.Semaphore(self.max_concurrent_writers)
+        self.waiting_writers += 1
+        self.max_waiting_writers = max(self.max_waiting_writers, self.waiting_writers)
+        try:
+            await self._writers.acquire()
+        finally:
+            self.waiting_writers -= 1
+        self.active_writers += 1
+        try:
+            yield self
+        finally:
+            self.active_writers -= 1
+            self._writers.release()
+
+    async def write(self, func: Callable, *args, **kwargs) -> Any:
+        """占用写盘名额执行一次写操作"""
+        async with self.writer():
+            return await self.run(func, *args, **kwargs)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "max_concurrent_writers": self.max_concurrent_writers,
+            "active_writers": self.active_writers,
+            "waiting_writers": self.waiting_writers,
+            "max_waiting_writers": self.max_waiting_writers,
+            "operations": self.operations
+        }
@@ -0,0 +1,50 @@
+# server/src/group_index.py
+from typing import Dict, Iterable, Set
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from models.user import Group, group_members
+
+
+class GroupMembershipIndex:
+    """群组成员内存索引：group_id -> 成员 user_id 集合
+
+    启动时从 group_members 表加载一次，之后随成员变化增量更新，
+    群消息投递只需遍历目标群组的成员，而不是所有在线用户。
+    """
+
+    def __init__(self):
+        self.members: Dict[int, Set[int]] = {}
+
+    def load(self, db: Session) -> int:
+        """从数据库加载全部群组和成员关系，返回群组数量"""
+        members: Dict[int, Set[int]] = {group_id: set() for group_id, in db.execute(select(Group.id))}
+        for group_id, user_id in db.execute(select(group_members.c.group_id, group_members.c.user_id)):
+            members.setdefault(group_id, set()).add(user_id)
+        self.members = members
+        return len(members)
+
+    def has_group(self, group_id: int) -> bool:
+        return group_id in self.members
+
+    def get_members(self, group_id: int) -> Set[int]:
+        return self.members.get(group_id, set())
+
+    def is_member(self, group_id: int, user_id: int) -> bool:
+        return user_id in self.members.get(group_id, ())
+
+    def add_group(self, group_id: int, member_ids: Iterable[int] = ()):
+        self.members.setdefault(group_id, set()).update(member_ids)
+
+    def add_member(self, group_id: int, user_id: int):
+        self.members.setdefault(group_id, set()).add(user_id)
+
+    def remove_member(self, group_id: int, user_id: int):
+        self.members.get(group_id, set()).discard(user_id)
+
+    def stats(self) -> dict:
+        return {
+            "groups": len(self.members),
+            "memberships": sum(len(m) for m in self.members.values())
+        }
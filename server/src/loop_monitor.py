@@ -0,0 +1,58 @@
+# server/src/loop_monitor.py
+import asyncio
+from collections import deque
+from typing import Callable, Optional
+
+
+class LoopLagMonitor:
+    """事件循环延迟监控：定时 sleep，记录实际唤醒时间比预期晚了多少"""
+
+    def __init__(self, interval: float = 0.1, window: int = 600,
+                 on_sample: Optional[Callable[[float], None]] = None):
+        self.interval = interval
+        self.on_sample = on_sample
+        self.samples: deque = deque(maxlen=window)
+        self.max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - start - self.interval)
+            self.samples.append(lag)
+            if self.on_sample:
+                self.on_sample(lag)
+            if lag > self.max_lag:
+                self.max_lag = lag
+
+    def reset(self):
+        self.samples.clear()
+        self.max_lag = 0.0
+
+    def stats(self) -> dict:
+        """最近窗口内的延迟统计（毫秒）"""
+        if not self.samples:
+            return {"samples": 0, "current_ms": 0.0, "avg_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+        ordered = sorted(self.samples)
+        return {
+            "samples": len(ordered),
+            "current_ms": round(self.samples[-1] * 1000, 3),
+            "avg_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+            "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 3),
+            "max_ms": round(self.max_lag * 1000, 3)
+        }
@@ -8,33 +8,54 @@ project_root = os.path.dirname(current_dir)
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
-from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect, UploadFile, File, Form
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect, UploadFile, File, Form, Request
+from fastapi.responses import JSONResponse, FileResponse, PlainTextResponse
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, Session
 from typing import List, Dict
 import uvicorn
 import asyncio
-import uuid
-import shutil
 import base64
 
 from config.config import settings
+from shared import wire_format
 from shared.protocols import LoginRequest, RegisterRequest, WSMessage, WSMessageTypes, MessageResponse, UserResponse
 from models.user import Base, User, Message, Group
-from services.auth_service import AuthService
+from services.auth_service import AuthService, token_verifier, user_directory
+from services.group_service import GroupService
+from services.message_service import MessageService
 from connection_manager import ConnectionManager
+from db_executor import DatabaseExecutor
+from loop_monitor import LoopLagMonitor
+from message_writer import MessageWriter
+from message_bus import create_message_bus
+from pagination import encode_cursor, decode_cursor
+from upload_manager import ChunkedUploadManager, UploadError
+from blob_store import BlobStore
+from file_io import FileIOExecutor
+from thumbnailer import ThumbnailGenerator
+from downloads import DownloadManager
+from password_hasher import PasswordHasher, PasswordHasherBusy
+from stats_counters import StatsCounters
+from app_logging import get_logger, setup_logging, shutdown_logging, debug_sampled, logging_stats
+import metrics
+from ws_compression import compression_stats, uvicorn_ws_options
+from services.blob_service import BlobService
 
-# 修复数据库配置 - 移除SQLite特有参数
+# MySQL 不需要额外参数；SQLite（本地测试）的会话会在数据库线程池中跨线程使用
 engine = create_engine(
     settings.DATABASE_URL,
-    # 移除 check_same_thread 参数，这是SQLite特有的
-    # connect_args={"check_same_thread": False}  # 删除这一行
+    connect_args={"check_same_thread": False} if settings.SQLITE_PATH else {}
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+logger = get_logger("server")
+
 def update_database_schema():
     """更新数据库表结构，添加缺失的字段"""
+    if engine.dialect.name != "mysql":
+        # 其他数据库（如本地测试用的SQLite）由 create_all 直接建表
+        return
     try:
         with engine.connect() as conn:
             # 检查 messages 表是否存在
@@ -48,9 +69,12 @@ def update_database_schema():
                     ("file_size", "INT"),
                     ("mime_type", "VARCHAR(100)"),
                     ("file_path", "VARCHAR(500)"),
+                    ("file_id", "VARCHAR(64)"),
                     ("thumbnail_path", "VARCHAR(500)"),
                     ("duration", "INT"),
-                    ("message_type", "VARCHAR(20)")
+                    ("message_type", "VARCHAR(20)"),
+                    # 已有的历史消息视为已送达，避免上线时全部补发
+                    ("delivered", "BOOLEAN DEFAULT TRUE")
                 ]
                 
                 for column_name, column_type in columns_to_check:
@@ -74,6 +98,48 @@ def update_database_schema():
                     except Exception as e:
                         print(f"❌ 添加列 {column_name} 时出错: {e}")
                 
+                # 检查并添加缺失的索引
+                indexes_to_check = [
+                    ("ix_messages_receiver_delivered_id", "receiver_id, delivered, id"),
+                    ("ix_messages_sender_receiver_ts_id", "sender_id, receiver_id, timestamp, id"),
+                    ("ix_messages_group_receiver_ts_id", "group_id, receiver_id, timestamp, id"),
+                    ("ix_messages_file_path", "file_path"),
+                    ("ix_messages_file_id", "file_id")
+                ]
+                
+                for index_name, index_columns in indexes_to_check:
+                    try:
+                        check_sql = text(f"""
+                            SELECT COUNT(*) FROM information_schema.STATISTICS 
+                            WHERE TABLE_SCHEMA = 'allen_chat' 
+                            AND TABLE_NAME = 'messages' 
+                            AND INDEX_NAME = '{index_name}'
+                        """)
+                        result = conn.execute(check_sql)
+                        if result.fetchone()[0] == 0:
+                            conn.execute(text(f"CREATE INDEX {index_name} ON messages ({index_columns})"))
+                            print(f"✅ 已添加索引: {index_name}")
+                        else:
+                            print(f"✅ 索引已存在: {index_name}")
+                    except Exception as e:
+                        print(f"❌ 添加索引 {index_name} 时出错: {e}")
+                
+                # 回填下载用的文件ID：内容寻址存储中的文件（以 sha256 命名）换成随机ID并改写下载URL，
+                # 更早按随机文件名保存的文件沿用原来的文件名，已发出的下载链接继续有效
+                try:
+                    conn.execute(text("""
+                        UPDATE messages SET file_id = REPLACE(UUID(), '-', ''),
+                            content = CONCAT('/download/', file_id)
+                        WHERE file_id IS NULL AND file_path IN (SELECT path FROM blobs)
+                    """))
+                    conn.execute(text("""
+                        UPDATE messages SET file_id = SUBSTRING_INDEX(file_path, '/', -1)
+                        WHERE file_id IS NULL AND file_path IS NOT NULL
+                    """))
+                    print("✅ 已回填文件ID")
+                except Exception as e:
+                    print(f"❌ 回填文件ID时出错: {e}")
+                
                 # 设置 message_type 的默认值
                 try:
                     update_sql = text("UPDATE messages SET message_type = 'text' WHERE message_type IS NULL")
@@ -134,13 +200,79 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 数据库执行器：所有同步ORM调用都通过它在线程池中运行
+db_executor = DatabaseExecutor(SessionLocal, max_workers=settings.DB_EXECUTOR_WORKERS)
+
+# 消息批量写入器
+message_writer = MessageWriter(
+    db_executor,
+    window_ms=settings.MESSAGE_BATCH_WINDOW_MS,
+    max_batch_size=settings.MESSAGE_BATCH_MAX_SIZE,
+    max_pending=settings.MESSAGE_WRITE_MAX_PENDING
+)
+
+# 事件循环延迟监控
+loop_monitor = LoopLagMonitor(on_sample=metrics.EVENT_LOOP_LAG_SECONDS.observe)
+
+# 统计计数器：/stats 读取内存中的计数，后台定期与数据库对账
+stats_counters = StatsCounters(db_executor, reconcile_interval=settings.STATS_RECONCILE_INTERVAL)
+
 # 连接管理器
-connection_manager = ConnectionManager()
+connection_manager = ConnectionManager(
+    db_executor,
+    message_writer,
+    create_message_bus(settings.MESSAGE_BUS_BACKEND, settings.MESSAGE_BUS_DIR),
+    stats_counters,
+    user_directory
+)
 
 # 文件上传配置
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# 文件读写线程池，限制同时写盘的数量，上传期间不阻塞事件循环
+file_io = FileIOExecutor(
+    max_workers=settings.FILE_IO_WORKERS,
+    max_concurrent_writers=settings.FILE_IO_MAX_WRITERS
+)
+
+# 附件按 sha256 存储，相同内容只保存一份
+blob_store = BlobStore(UPLOAD_DIR, db_executor, file_io)
+
+# 图片消息的缩略图在独立进程池中生成
+thumbnailer = ThumbnailGenerator(
+    os.path.join(UPLOAD_DIR, "thumbnails"),
+    db_executor,
+    file_io,
+    max_workers=settings.THUMBNAIL_WORKERS,
+    size=settings.THUMBNAIL_SIZE,
+    quality=settings.THUMBNAIL_QUALITY
+)
+
+# 附件下载：文件信息缓存，支持断点续传和协商缓存
+download_manager = DownloadManager(
+    db_executor,
+    file_io,
+    cache_size=settings.DOWNLOAD_CACHE_SIZE,
+    chunk_size=settings.DOWNLOAD_CHUNK_SIZE
+)
+
+# 分块上传：分块直接流式写入磁盘，支持断点续传
+upload_manager = ChunkedUploadManager(
+    UPLOAD_DIR,
+    blob_store,
+    file_io,
+    chunk_size=settings.UPLOAD_CHUNK_SIZE,
+    max_file_size=settings.UPLOAD_MAX_FILE_SIZE,
+    session_ttl=settings.UPLOAD_SESSION_TTL
+)
+
+# 密码哈希在独立进程池中计算，排队过长时拒绝新的登录/注册
+password_hasher = PasswordHasher(
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    max_queue=settings.PASSWORD_HASH_MAX_QUEUE
+)
+
 # 依赖注入
 def get_db():
     db = SessionLocal()
@@ -152,6 +284,10 @@ def get_db():
 def get_auth_service(db: Session = Depends(get_db)) -> AuthService:
     return AuthService(db)
 
+async def find_user(user_id: int):
+    """按ID查找用户，用户目录缓存命中时不访问数据库"""
+    return user_directory.get(user_id) or await db_executor.run_in_session(user_directory.load, user_id)
+
 # REST API 路由
 @app.post("/register", response_model=dict)
 async def register(user_data: RegisterRequest, auth_service: AuthService = Depends(get_auth_service)):
@@ -159,30 +295,45 @@ async def register(user_data: RegisterRequest, auth_service: AuthService = Depen
     用户注册
     """
     try:
-        user = auth_service.create_user(user_data)
+        hashed_password = await password_hasher.hash(user_data.password)
+        user = await db_executor.run(auth_service.create_user, user_data, hashed_password)
+        stats_counters.record_user_registered()
         return {
             "message": "User created successfully", 
             "user_id": user.id,
             "username": user.username
         }
+    except PasswordHasherBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Registration failed: {str(e)}")
 
 @app.post("/login", response_model=dict)
-async def login(login_data: LoginRequest, auth_service: AuthService = Depends(get_auth_service)):
+async def login(login_data: LoginRequest):
     """
     用户登录
     """
-    user = auth_service.authenticate_user(login_data.username, login_data.password)
-    if not user:
+    # 查询和更新各用一个短会话，等待密码校验期间不占用数据库连接；
+    # 密码哈希每次从数据库读取，其他 worker 上改过的密码立即生效
+    user = await db_executor.run_in_session(
+        lambda db: AuthService(db).get_login_credentials(login_data.username)
+    )
+    try:
+        valid = user is not None and await password_hasher.verify(login_data.password, user.hashed_password)
+    except PasswordHasherBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    # 更新用户状态为在线
-    auth_service.update_user_status(user.id, "online")
+    def mark_online(db: Session) -> str:
+        auth_service = AuthService(db)
+        # 更新用户状态为在线
+        auth_service.update_user_status(user.id, "online")
+        return auth_service.create_access_token(data={"sub": user.username, "uid": user.id})
     
-    access_token = auth_service.create_access_token(data={"sub": user.username})
+    access_token = await db_executor.run_in_session(mark_online)
     return {
         "access_token": access_token,
         "token_type": "bearer",
@@ -190,24 +341,39 @@ async def login(login_data: LoginRequest, auth_service: AuthService = Depends(ge
         "username": user.username
     }
 
+@app.post("/token/refresh", response_model=dict)
+async def refresh_token(request: Request):
+    """
+    用未过期的令牌（Authorization: Bearer）换一个新令牌；客户端在连接期间定期调用，
+    断线重连时总能带上有效的令牌
+    """
+    authorization = request.headers.get("authorization", "")
+    token = authorization[7:].strip() if authorization.lower().startswith("bearer ") else ""
+    new_token = await db_executor.run_in_session(
+        lambda db: AuthService(db).refresh_user_token(token)
+    ) if token_verifier.verify(token) else None
+    if not new_token:
+        raise HTTPException(status_code=401, detail="Invalid or expired token",
+                            headers={"WWW-Authenticate": "Bearer"})
+    return {"access_token": new_token, "token_type": "bearer"}
+
 @app.post("/send-message", response_model=dict)
 async def send_message(
     message_data: dict,
-    db: Session = Depends(get_db),
-    auth_service: AuthService = Depends(get_auth_service)
+    db: Session = Depends(get_db)
 ):
     """
     通过REST API发送消息
     """
     try:
-        print(f"📨 收到REST消息发送请求: {message_data}")
+        debug_sampled(logger, "📨 收到REST消息发送请求: %s", message_data)
         
         # 验证发送者
         sender_id = message_data.get("sender_id")
         if not sender_id:
             raise HTTPException(status_code=400, detail="sender_id is required")
         
-        sender = auth_service.get_user_by_id(sender_id)
+        sender = await find_user(sender_id)
         if not sender:
             raise HTTPException(status_code=404, detail="Sender not found")
         
@@ -220,17 +386,20 @@ async def send_message(
         receiver_id = message_data.get("receiver_id")
         message_type = message_data.get("message_type", "private")
         
-        print(f"🔍 消息类型: {message_type}, 接收者ID: {receiver_id}")
+        debug_sampled(logger, "🔍 消息类型: %s, 接收者ID: %s", message_type, receiver_id)
         
         if message_type == "private" and receiver_id:
             # 私聊消息需要验证接收者
-            receiver = auth_service.get_user_by_id(receiver_id)
+            receiver = await find_user(receiver_id)
             if not receiver:
                 raise HTTPException(status_code=404, detail="Receiver not found")
-            print(f"📨 私聊消息: {sender.username} -> {receiver.username}")
+            debug_sampled(logger, "📨 私聊消息: %s -> %s", sender.username, receiver.username)
         elif message_type == "public":
-            print(f"📢 公共消息: {sender.username}")
+            debug_sampled(logger, "📢 公共消息: %s", sender.username)
             receiver_id = None  # 公共消息没有特定接收者
+        elif message_type == "group" and message_data.get("group_id"):
+            debug_sampled(logger, "👥 群聊消息: %s -> 群组 %s", sender.username, message_data.get('group_id'))
+            receiver_id = None
         else:
             raise HTTPException(status_code=400, detail="Invalid message type or missing receiver_id for private message")
         
@@ -247,9 +416,6 @@ async def send_message(
             data=ws_message_data
         )
         
-        print(f"🔄 处理消息: 发送者 {sender.username} -> 接收者 {receiver_id}")
-        print(f"🔄 当前活跃连接数量: {len(connection_manager.active_connections)}")
-        print(f"🔄 当前活跃连接用户ID: {list(connection_manager.active_connections.keys())}")
         
         # 使用连接管理器处理消息
         await connection_manager.handle_message_send(ws_message, sender, db)
@@ -265,29 +431,27 @@ async def send_message(
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ 发送消息失败: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ 发送消息失败: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to send message: {str(e)}")
 
 @app.post("/send-message-with-files")
 async def send_message_with_files(
     message_data: dict,
-    db: Session = Depends(get_db),
-    auth_service: AuthService = Depends(get_auth_service)
+    db: Session = Depends(get_db)
 ):
     """
     发送包含文本和文件的消息
     """
     try:
-        print(f"📦 收到组合消息发送请求: {message_data}")
+        debug_sampled(logger, "📦 收到组合消息发送请求: 发送者 %s, 文件数量 %d",
+                      message_data.get("sender_id"), len(message_data.get("files", [])))
         
         # 验证发送者
         sender_id = message_data.get("sender_id")
         if not sender_id:
             raise HTTPException(status_code=400, detail="sender_id is required")
         
-        sender = auth_service.get_user_by_id(sender_id)
+        sender = await find_user(sender_id)
         if not sender:
             raise HTTPException(status_code=404, detail="Sender not found")
         
@@ -299,22 +463,24 @@ async def send_message_with_files(
         receiver_id = message_data.get("receiver_id")
         message_type = message_data.get("message_type", "private")
         
-        print(f"🔍 组合消息类型: {message_type}, 接收者ID: {receiver_id}, 文件数量: {len(files)}")
+        debug_sampled(logger, "🔍 组合消息类型: %s, 接收者ID: %s, 文件数量: %d",
+                      message_type, receiver_id, len(files))
         
         if message_type == "private" and receiver_id:
             # 私聊消息需要验证接收者
-            receiver = auth_service.get_user_by_id(receiver_id)
+            receiver = await find_user(receiver_id)
             if not receiver:
                 raise HTTPException(status_code=404, detail="Receiver not found")
-            print(f"📨 私聊组合消息: {sender.username} -> {receiver.username}")
+            debug_sampled(logger, "📨 私聊组合消息: %s -> %s", sender.username, receiver.username)
         elif message_type == "public":
-            print(f"📢 公共组合消息: {sender.username}")
+            debug_sampled(logger, "📢 公共组合消息: %s", sender.username)
             receiver_id = None  # 公共消息没有特定接收者
         else:
             raise HTTPException(status_code=400, detail="Invalid message type or missing receiver_id for private message")
         
         # 处理文件上传
         uploaded_files = []
+        saved_message_ids = []
         for file_info in files:
             try:
                 file_name = file_info.get("file_name")
@@ -323,45 +489,50 @@ async def send_message_with_files(
                 is_image = file_info.get("is_image", False)
                 mime_type = file_info.get("mime_type", "application/octet-stream")
                 
-                if not file_name or not file_data_base64:
-                    print(f"⚠️ 文件信息不完整: {file_name}")
+                if file_info.get("upload_id"):
+                    # 已通过分块上传完成的文件，直接引用
+                    upload = upload_manager.claim(file_info["upload_id"], sender_id)
+                    file_name, file_size, mime_type = upload.file_name, upload.file_size, upload.mime_type
+                    is_image = mime_type.startswith("image/")
+                    file_path, file_sha256 = upload.file_path, upload.sha256
+                elif not file_name or not file_data_base64:
+                    logger.warning("⚠️ 文件信息不完整: %s", file_name)
                     continue
-                
-                # 解码base64文件数据
-                file_data = base64.b64decode(file_data_base64)
-                
-                # 生成唯一文件名
-                file_extension = os.path.splitext(file_name)[1]
-                unique_filename = f"{uuid.uuid4().hex}{file_extension}"
-                file_path = os.path.join(UPLOAD_DIR, unique_filename)
-                
-                # 保存文件
-                with open(file_path, "wb") as buffer:
-                    buffer.write(file_data)
+                else:
+                    # 兼容旧客户端：解码base64文件数据，按内容存储
+                    file_data = await file_io.run(base64.b64decode, file_data_base64)
+                    metrics.UPLOAD_BYTES.labels("inline").inc(len(file_data))
+                    file_sha256, file_path, file_size = await blob_store.store_bytes(file_data)
                 
                 # 确定消息类型
                 file_message_type = "image" if is_image else "file"
+                file_id = blob_store.new_file_id()
                 
                 # 保存到数据库
                 db_message = Message(
-                    content=f"/download/{unique_filename}",
+                    content=f"/download/{file_id}",
                     message_type=file_message_type,
                     file_name=file_name,
                     file_size=file_size,
                     mime_type=mime_type,
                     file_path=file_path,
+                    file_id=file_id,
                     sender_id=sender_id,
-                    receiver_id=receiver_id
+                    receiver_id=receiver_id,
+                    timestamp=datetime.utcnow(),
+                    delivered=not receiver_id
                 )
                 
-                db.add(db_message)
-                db.commit()
-                db.refresh(db_message)
+                db_message = await connection_manager.save_message(db, db_message)
+                saved_message_ids.append(db_message.id)
+                await blob_store.register(file_sha256, file_path, file_size, mime_type)
+                if is_image:
+                    thumbnailer.schedule(db_message.id, file_path)
                 
                 # 构建文件响应数据
                 file_response = {
                     "id": db_message.id,
-                    "content": f"/download/{unique_filename}",
+                    "content": f"/download/{file_id}",
                     "message_type": file_message_type,
                     "file_name": file_name,
                     "file_size": file_size,
@@ -372,12 +543,14 @@ async def send_message_with_files(
                     "timestamp": db_message.timestamp.isoformat() if db_message.timestamp else None,
                     "is_image": is_image
                 }
+                if is_image and thumbnailer.available:
+                    file_response["thumbnail_url"] = f"/thumbnail/{db_message.id}"
                 
                 uploaded_files.append(file_response)
-                print(f"✅ 文件保存成功: {file_name} ({file_size} bytes)")
+                logger.info("✅ 文件保存成功: %s (%s bytes)", file_name, file_size)
                 
             except Exception as e:
-                print(f"❌ 处理文件 {file_info.get('file_name', 'unknown')} 时出错: {str(e)}")
+                logger.warning("❌ 处理文件 %s 时出错: %s", file_info.get('file_name', 'unknown'), e)
                 continue
         
         # 构建组合消息响应数据
@@ -398,8 +571,8 @@ async def send_message_with_files(
                 "type": "combined_message",
                 "data": combined_response
             }
-            await connection_manager.send_personal_json(ws_message, receiver_id)
-            print(f"📨 私聊组合消息发送给用户 {receiver_id}")
+            delivered = await connection_manager.send_private(ws_message, receiver_id, saved_message_ids)
+            debug_sampled(logger, "📨 私聊组合消息发送给用户 %s", receiver_id)
         else:
             # 群聊组合消息
             ws_message = {
@@ -407,13 +580,14 @@ async def send_message_with_files(
                 "data": combined_response
             }
             await connection_manager.broadcast_json(ws_message)
-            print(f"📢 群聊组合消息广播给所有用户")
+            delivered = True
+            debug_sampled(logger, "📢 群聊组合消息广播给所有用户")
         
         # 同时给发送者发送确认消息
         confirmation_message = {
             "type": "message_sent",
             "data": {
-                "delivered": True,
+                "delivered": delivered,
                 "receiver_id": receiver_id,
                 "content": text_content[:50] + "..." if text_content and len(text_content) > 50 else text_content,
                 "message_type": "combined",
@@ -431,9 +605,7 @@ async def send_message_with_files(
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ 发送组合消息失败: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ 发送组合消息失败: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to send combined message: {str(e)}")
 
 # 文件上传接口
@@ -443,23 +615,22 @@ async def upload_file(
     sender_id: int = Form(...),
     receiver_id: int = Form(None),
     message_type: str = Form("file"),
-    db: Session = Depends(get_db),
-    auth_service: AuthService = Depends(get_auth_service)
+    db: Session = Depends(get_db)
 ):
     """
     上传文件
     """
     try:
-        print(f"📤 收到文件上传请求: {file.filename}, 发送者: {sender_id}, 接收者: {receiver_id}")
+        logger.info("📤 收到文件上传请求: %s, 发送者: %s, 接收者: %s", file.filename, sender_id, receiver_id)
         
         # 验证发送者
-        sender = auth_service.get_user_by_id(sender_id)
+        sender = await find_user(sender_id)
         if not sender:
             raise HTTPException(status_code=404, detail="Sender not found")
         
         # 验证接收者（如果是私聊）
         if receiver_id:
-            receiver = auth_service.get_user_by_id(receiver_id)
+            receiver = await find_user(receiver_id)
             if not receiver:
                 raise HTTPException(status_code=404, detail="Receiver not found")
         
@@ -469,38 +640,35 @@ async def upload_file(
         else:
             file_message_type = "file"
         
-        # 生成唯一文件名
-        file_extension = os.path.splitext(file.filename)[1]
-        unique_filename = f"{uuid.uuid4().hex}{file_extension}"
-        file_path = os.path.join(UPLOAD_DIR, unique_filename)
-        
-        # 保存文件
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # 获取文件大小
-        file_size = os.path.getsize(file_path)
+        # 边读边计算哈希，按内容存储（相同文件只保存一份）
+        file_sha256, file_path, file_size = await blob_store.store_stream(file.file)
+        metrics.UPLOAD_BYTES.labels("form").inc(file_size)
+        file_id = blob_store.new_file_id()
         
         # 保存到数据库
         db_message = Message(
-            content=f"/download/{unique_filename}",  # 下载URL
+            content=f"/download/{file_id}",  # 下载URL
             message_type=file_message_type,
             file_name=file.filename,
             file_size=file_size,
             mime_type=file.content_type,
             file_path=file_path,
+            file_id=file_id,
             sender_id=sender_id,
-            receiver_id=receiver_id
+            receiver_id=receiver_id,
+            timestamp=datetime.utcnow(),
+            delivered=not receiver_id
         )
         
-        db.add(db_message)
-        db.commit()
-        db.refresh(db_message)
+        db_message = await connection_manager.save_message(db, db_message)
+        await blob_store.register(file_sha256, file_path, file_size, file.content_type)
+        if file_message_type == "image":
+            thumbnailer.schedule(db_message.id, file_path)
         
         # 构建响应数据
         response_data = {
             "id": db_message.id,
-            "content": f"/download/{unique_filename}",
+            "content": f"/download/{file_id}",
             "message_type": file_message_type,
             "file_name": file.filename,
             "file_size": file_size,
@@ -510,8 +678,10 @@ async def upload_file(
             "receiver_id": receiver_id,
             "timestamp": db_message.timestamp.isoformat() if db_message.timestamp else None
         }
+        if file_message_type == "image" and thumbnailer.available:
+            response_data["thumbnail_url"] = f"/thumbnail/{db_message.id}"
         
-        print(f"✅ 文件上传成功: {file.filename}, 大小: {file_size} 字节")
+        logger.info("✅ 文件上传成功: %s, 大小: %s 字节", file.filename, file_size)
         
         # 发送WebSocket消息
         if receiver_id:
@@ -520,8 +690,8 @@ async def upload_file(
                 "type": "file_message",
                 "data": response_data
             }
-            await connection_manager.send_personal_json(ws_message, receiver_id)
-            print(f"📨 私聊文件消息发送给用户 {receiver_id}")
+            await connection_manager.send_private(ws_message, receiver_id, [db_message.id])
+            debug_sampled(logger, "📨 私聊文件消息发送给用户 %s", receiver_id)
         else:
             # 群聊文件消息
             ws_message = {
@@ -529,7 +699,7 @@ async def upload_file(
                 "data": response_data
             }
             await connection_manager.broadcast_json(ws_message)
-            print(f"📢 群聊文件消息广播给所有用户")
+            debug_sampled(logger, "📢 群聊文件消息广播给所有用户")
         
         return {
             "success": True,
@@ -538,44 +708,214 @@ async def upload_file(
         }
         
     except Exception as e:
-        print(f"❌ 文件上传失败: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ 文件上传失败: %s", e)
         raise HTTPException(status_code=500, detail=f"File upload failed: {str(e)}")
 
+# 分块上传接口
+@app.post("/uploads", response_model=dict)
+async def create_upload(upload_data: dict):
+    """
+    开始分块上传，返回 upload_id、分块大小和 challenge；
+    响应与服务端是否已有相同内容无关，跳过上传需要在 complete 时用 challenge 证明持有内容
+    """
+    sender_id = upload_data.get("sender_id")
+    if not sender_id:
+        raise HTTPException(status_code=400, detail="sender_id is required")
+    if not await find_user(sender_id):
+        raise HTTPException(status_code=404, detail="Sender not found")
+    
+    try:
+        upload = await upload_manager.create(
+            sender_id,
+            upload_data.get("file_name"),
+            upload_data.get("file_size"),
+            upload_data.get("mime_type"),
+            upload_data.get("chunk_size")
+        )
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    
+    logger.info("📤 开始分块上传: %s (%s bytes, %s 块)",
+                upload.file_name, upload.file_size, upload.total_chunks)
+    return upload.to_dict()
+
+@app.put("/uploads/{upload_id}/chunks/{index}", response_model=dict)
+async def upload_chunk(upload_id: str, index: int, request: Request):
+    """
+    上传一个分块，请求体为分块的原始字节，边接收边写入磁盘
+    """
+    try:
+        upload = await upload_manager.write_chunk(upload_id, index, request.stream())
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return upload.to_dict()
+
+@app.get("/uploads/{upload_id}", response_model=dict)
+async def get_upload(upload_id: str):
+    """
+    查询上传进度，断线后从 next_chunk 继续上传
+    """
+    try:
+        return upload_manager.get(upload_id).to_dict()
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+@app.post("/uploads/{upload_id}/complete", response_model=dict)
+async def complete_upload(upload_id: str, complete_data: dict):
+    """
+    完成上传：校验大小和 sha256，之后可在 /send-file 或 /send-message-with-files 中引用 upload_id；
+    没有上传分块时可以提交 sha256 和 proof = sha256(challenge + 文件内容)，服务端已有该内容时直接完成
+    """
+    try:
+        upload = await upload_manager.complete(
+            upload_id, complete_data.get("sender_id"), complete_data.get("sha256"), complete_data.get("proof")
+        )
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    
+    logger.info("✅ 分块上传完成: %s (%s bytes)", upload.file_name, upload.file_size)
+    return upload.to_dict()
+
+@app.post("/send-file", response_model=dict)
+async def send_file(
+    file_data: dict,
+    db: Session = Depends(get_db)
+):
+    """
+    发送已通过分块上传完成的文件
+    """
+    sender_id = file_data.get("sender_id")
+    upload_id = file_data.get("upload_id")
+    receiver_id = file_data.get("receiver_id")
+    if not sender_id or not upload_id:
+        raise HTTPException(status_code=400, detail="sender_id and upload_id are required")
+    
+    sender = await find_user(sender_id)
+    if not sender:
+        raise HTTPException(status_code=404, detail="Sender not found")
+    if receiver_id and not await find_user(receiver_id):
+        raise HTTPException(status_code=404, detail="Receiver not found")
+    
+    try:
+        upload = upload_manager.claim(upload_id, sender_id)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    
+    file_message_type = "image" if upload.mime_type.startswith("image/") else "file"
+    file_id = blob_store.new_file_id()
+    download_url = f"/download/{file_id}"
+    db_message = Message(
+        content=download_url,
+        message_type=file_message_type,
+        file_name=upload.file_name,
+        file_size=upload.file_size,
+        mime_type=upload.mime_type,
+        file_path=upload.file_path,
+        file_id=file_id,
+        sender_id=sender_id,
+        receiver_id=receiver_id,
+        timestamp=datetime.utcnow(),
+        delivered=not receiver_id
+    )
+    db_message = await connection_manager.save_message(db, db_message)
+    await blob_store.register(upload.sha256, upload.file_path, upload.file_size, upload.mime_type)
+    if file_message_type == "image":
+        thumbnailer.schedule(db_message.id, upload.file_path)
+    
+    response_data = {
+        "id": db_message.id,
+        "content": download_url,
+        "message_type": file_message_type,
+        "file_name": upload.file_name,
+        "file_size": upload.file_size,
+        "mime_type": upload.mime_type,
+        "sender_id": sender_id,
+        "sender_username": sender.username,
+        "receiver_id": receiver_id,
+        "is_group_message": bool(file_data.get("is_group_message")),
+        "timestamp": db_message.timestamp.isoformat() if db_message.timestamp else None
+    }
+    if file_message_type == "image" and thumbnailer.available:
+        response_data["thumbnail_url"] = f"/thumbnail/{db_message.id}"
+    
+    ws_message = {
+        "type": "file_message",
+        "data": response_data
+    }
+    if receiver_id:
+        await connection_manager.send_private(ws_message, receiver_id, [db_message.id])
+    else:
+        await connection_manager.broadcast_json(ws_message)
+    
+    return {
+        "success": True,
+        "message": "File sent successfully",
+        "data": response_data
+    }
+
+@app.get("/thumbnail/{message_id}")
+async def get_thumbnail(message_id: int):
+    """
+    获取图片消息的缩略图（WebP），尚未生成时当场生成
+    """
+    message = await db_executor.run_in_session(
+        lambda db: db.query(Message.message_type, Message.file_path, Message.thumbnail_path)
+        .filter(Message.id == message_id).first()
+    )
+    if not message or message.message_type != "image" or not message.file_path:
+        raise HTTPException(status_code=404, detail="Image message not found")
+    
+    thumbnail_path = message.thumbnail_path
+    if not thumbnail_path or not await file_io.run(os.path.exists, thumbnail_path):
+        if not thumbnailer.available:
+            raise HTTPException(status_code=404, detail="Thumbnails are not available")
+        thumbnail_path = await thumbnailer.generate_for_message(message_id, message.file_path)
+        if not thumbnail_path:
+            raise HTTPException(status_code=422, detail="Thumbnail could not be generated")
+    
+    # 缩略图内容只由原图决定，可以长期缓存
+    return FileResponse(
+        path=thumbnail_path,
+        media_type="image/webp",
+        headers={"Cache-Control": "public, max-age=31536000, immutable"}
+    )
+
+@app.get("/storage/stats", response_model=dict)
+async def get_storage_stats():
+    """
+    附件存储统计：去重后的实际占用和节省的空间
+    """
+    stats = await db_executor.run_in_session(lambda db: BlobService(db).get_storage_stats())
+    stats["blob_store"] = blob_store.stats()
+    stats["uploads"] = upload_manager.stats()
+    return stats
+
 # 文件下载接口
-@app.get("/download/{filename}")
-async def download_file(filename: str):
+@app.api_route("/download/{filename}", methods=["GET", "HEAD"])
+async def download_file(filename: str, request: Request):
     """
-    下载文件
+    下载文件，支持 Range 断点续传/分段并行下载，以及 ETag 协商缓存（If-None-Match 命中时返回 304）；
+    filename 为文件消息的文件ID
     """
     try:
-        file_path = os.path.join(UPLOAD_DIR, filename)
-        
-        if not os.path.exists(file_path):
+        opened = await download_manager.open(filename)
+        if not opened:
             raise HTTPException(status_code=404, detail="File not found")
         
-        # 从数据库获取文件信息
-        db = SessionLocal()
-        try:
-            message = db.query(Message).filter(Message.file_path == file_path).first()
-            if message:
-                return FileResponse(
-                    path=file_path,
-                    filename=message.file_name,
-                    media_type=message.mime_type or "application/octet-stream"
-                )
-            else:
-                return FileResponse(
-                    path=file_path,
-                    filename=filename,
-                    media_type="application/octet-stream"
-                )
-        finally:
-            db.close()
+        metadata, file = opened
+        return download_manager.build_response(
+            metadata,
+            file,
+            request.method,
+            range_header=request.headers.get("range"),
+            if_none_match=request.headers.get("if-none-match"),
+            if_range=request.headers.get("if-range")
+        )
             
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"❌ 文件下载失败: {e}")
+        logger.exception("❌ 文件下载失败: %s", e)
         raise HTTPException(status_code=500, detail=f"File download failed: {str(e)}")
 
 @app.get("/")
@@ -589,121 +929,199 @@ async def root():
         "docs": "/docs"
     }
 
+def user_summary(user: User) -> dict:
+    """用户列表和用户详情接口返回的字段，在数据库线程中构造"""
+    return {
+        "id": user.id,
+        "username": user.username,
+        "email": user.email,
+        "status": user.status,
+        "created_at": user.created_at.isoformat() if user.created_at else None,
+        "last_seen": user.last_seen.isoformat() if user.last_seen else None
+    }
+
 @app.get("/users", response_model=dict)
-async def get_users(db: Session = Depends(get_db)):
+async def get_users():
     """
     获取所有用户列表
     """
-    users = db.query(User).all()
-    return {
-        "users": [
-            {
-                "id": u.id, 
-                "username": u.username, 
-                "email": u.email,
-                "status": u.status,
-                "created_at": u.created_at.isoformat() if u.created_at else None,
-                "last_seen": u.last_seen.isoformat() if u.last_seen else None
-            } for u in users
-        ]
-    }
+    users = await db_executor.run_in_session(
+        lambda db: [user_summary(u) for u in db.query(User).all()]
+    )
+    return {"users": users}
 
 @app.get("/users/{user_id}", response_model=dict)
-async def get_user(user_id: int, db: Session = Depends(get_db)):
+async def get_user(user_id: int):
     """
     获取特定用户信息
     """
-    user = db.query(User).filter(User.id == user_id).first()
+    def load(db: Session):
+        user = db.query(User).filter(User.id == user_id).first()
+        return user_summary(user) if user else None
+    
+    user = await db_executor.run_in_session(load)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    return {
-        "id": user.id,
-        "username": user.username,
-        "email": user.email,
-        "status": user.status,
-        "created_at": user.created_at.isoformat() if user.created_at else None,
-        "last_seen": user.last_seen.isoformat() if user.last_seen else None
-    }
+    return user
 
 @app.get("/messages", response_model=dict)
 async def get_messages(
-    db: Session = Depends(get_db), 
     limit: int = 50,
     user_id: int = None
 ):
     """
     获取消息列表
     """
-    query = db.query(Message)
+    messages = await db_executor.run_in_session(
+        lambda db: MessageService(db).get_recent_messages(user_id, limit)
+    )
+    return {"messages": messages}
+
+@app.get("/messages/history", response_model=dict)
+async def get_conversation_history(
+    user_id: int = None,
+    peer_id: int = None,
+    group_id: int = None,
+    before: str = None,
+    after: str = None,
+    limit: int = 50
+):
+    """
+    获取会话历史（键集分页）
+    
+    私聊传 user_id 和 peer_id，群聊传 group_id，都不传为公共消息。
+    默认返回最新一页；before 游标向更早翻页，after 游标获取更新的消息。
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Only one of before and after can be given")
+    if bool(user_id) != bool(peer_id):
+        raise HTTPException(status_code=400, detail="user_id and peer_id must be given together")
+    if user_id and group_id:
+        raise HTTPException(status_code=400, detail="Private and group conversations cannot be combined")
+    limit = max(1, min(limit, 200))
+    try:
+        before_key = decode_cursor(before) if before else None
+        after_key = decode_cursor(after) if after else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    # 如果指定了用户ID，只获取该用户发送或接收的消息
-    if user_id:
-        query = query.filter(
-            (Message.sender_id == user_id) | (Message.receiver_id == user_id)
+    messages, has_more = await db_executor.run_in_session(
+        lambda db: MessageService(db).get_conversation_page(
+            user_id, peer_id, group_id, before_key, after_key, limit
         )
+    )
     
-    messages = query.order_by(Message.timestamp.desc()).limit(limit).all()
+    def cursor_of(m):
+        return encode_cursor(datetime.fromisoformat(m["timestamp"]), m["id"])
     
     return {
-        "messages": [
-            {
-                "id": m.id,
-                "content": m.content,
-                "message_type": m.message_type,
-                "file_name": m.file_name,
-                "file_size": m.file_size,
-                "mime_type": m.mime_type,
-                "sender_id": m.sender_id,
-                "sender_username": m.sender.username if m.sender else "Unknown",
-                "receiver_id": m.receiver_id,
-                "receiver_username": m.receiver.username if m.receiver else None,
-                "group_id": m.group_id,
-                "timestamp": m.timestamp.isoformat() if m.timestamp else None,
-                "is_read": m.is_read
-            } for m in reversed(messages)
-        ]
+        "messages": messages,
+        "has_more": has_more,
+        "before": cursor_of(messages[0]) if messages else before,
+        "after": cursor_of(messages[-1]) if messages else after
     }
 
 @app.get("/messages/{message_id}", response_model=dict)
-async def get_message(message_id: int, db: Session = Depends(get_db)):
+async def get_message(message_id: int):
     """
     获取特定消息
     """
-    message = db.query(Message).filter(Message.id == message_id).first()
+    message = await db_executor.run_in_session(
+        lambda db: MessageService(db).get_message(message_id)
+    )
     if not message:
         raise HTTPException(status_code=404, detail="Message not found")
     
-    return {
-        "id": message.id,
-        "content": message.content,
-        "message_type": message.message_type,
-        "file_name": message.file_name,
-        "file_size": message.file_size,
-        "mime_type": message.mime_type,
-        "sender_id": message.sender_id,
-        "sender_username": message.sender.username if message.sender else "Unknown",
-        "receiver_id": message.receiver_id,
-        "receiver_username": message.receiver.username if message.receiver else None,
-        "group_id": message.group_id,
-        "timestamp": message.timestamp.isoformat() if message.timestamp else None,
-        "is_read": message.is_read
-    }
+    return message
 
 @app.post("/messages/{message_id}/read", response_model=dict)
-async def mark_message_as_read(message_id: int, db: Session = Depends(get_db)):
+async def mark_message_as_read(message_id: int):
     """
     标记消息为已读
     """
-    message = db.query(Message).filter(Message.id == message_id).first()
-    if not message:
-        raise HTTPException(status_code=404, detail="Message not found")
+    def mark_read(db: Session) -> bool:
+        updated = db.query(Message).filter(Message.id == message_id).update({Message.is_read: True})
+        db.commit()
+        return updated > 0
     
-    message.is_read = True
-    db.commit()
+    if not await db_executor.run_in_session(mark_read):
+        raise HTTPException(status_code=404, detail="Message not found")
     
     return {"message": "Message marked as read", "message_id": message_id}
 
+# 群组接口
+@app.post("/groups", response_model=dict)
+async def create_group(group_data: dict, db: Session = Depends(get_db)):
+    """
+    创建群组，创建者自动加入
+    """
+    name = group_data.get("name")
+    created_by = group_data.get("created_by")
+    if not name or not created_by:
+        raise HTTPException(status_code=400, detail="name and created_by are required")
+    
+    if not await find_user(created_by):
+        raise HTTPException(status_code=404, detail="Creator not found")
+    
+    group = await db_executor.run(
+        GroupService(db).create_group, name, created_by, group_data.get("description")
+    )
+    connection_manager.add_group(group.id, [created_by])
+    return {
+        "id": group.id,
+        "name": group.name,
+        "description": group.description,
+        "created_by": group.created_by,
+        "created_at": group.created_at.isoformat() if group.created_at else None
+    }
+
+@app.get("/groups/{group_id}/members", response_model=dict)
+async def get_group_members(group_id: int):
+    """
+    获取群组成员（来自内存索引）
+    """
+    if not connection_manager.group_index.has_group(group_id):
+        raise HTTPException(status_code=404, detail="Group not found")
+    
+    members = connection_manager.group_index.get_members(group_id)
+    return {
+        "group_id": group_id,
+        "members": sorted(members),
+        "online_members": sorted(m for m in members if connection_manager.is_online(m))
+    }
+
+@app.post("/groups/{group_id}/members", response_model=dict)
+async def add_group_member(group_id: int, member_data: dict, db: Session = Depends(get_db)):
+    """
+    添加群组成员
+    """
+    user_id = member_data.get("user_id")
+    if not user_id:
+        raise HTTPException(status_code=400, detail="user_id is required")
+    
+    group_service = GroupService(db)
+    if not await db_executor.run(group_service.get_group, group_id):
+        raise HTTPException(status_code=404, detail="Group not found")
+    if not await find_user(user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    added = await db_executor.run(group_service.add_member, group_id, user_id)
+    connection_manager.add_group_member(group_id, user_id)
+    return {"message": "Member added" if added else "Already a member", "group_id": group_id, "user_id": user_id}
+
+@app.delete("/groups/{group_id}/members/{user_id}", response_model=dict)
+async def remove_group_member(group_id: int, user_id: int, db: Session = Depends(get_db)):
+    """
+    移除群组成员
+    """
+    removed = await db_executor.run(GroupService(db).remove_member, group_id, user_id)
+    if not removed:
+        raise HTTPException(status_code=404, detail="Membership not found")
+    
+    connection_manager.remove_group_member(group_id, user_id)
+    return {"message": "Member removed", "group_id": group_id, "user_id": user_id}
+
 @app.get("/health")
 async def health_check():
     """
@@ -712,102 +1130,163 @@ async def health_check():
     return {
         "status": "healthy",
         "timestamp": asyncio.get_event_loop().time(),
-        "service": "Multi Instant Message System"
+        "service": "Multi Instant Message System",
+        "event_loop_lag": loop_monitor.stats(),
+        "message_writer": message_writer.stats(),
+        "uploads": upload_manager.stats(),
+        "thumbnails": thumbnailer.stats(),
+        "file_io": file_io.stats(),
+        "downloads": download_manager.stats(),
+        "password_hasher": password_hasher.stats(),
+        "tokens": token_verifier.stats(),
+        "user_directory": user_directory.stats(),
+        "logging": logging_stats(),
+        "ws_compression": compression_stats.stats()
     }
 
 @app.get("/stats")
-async def get_stats(db: Session = Depends(get_db)):
+async def get_stats():
     """
-    获取系统统计信息
+    获取系统统计信息（来自内存计数器，定期与数据库对账），包括每分钟消息速率
     """
-    total_users = db.query(User).count()
-    total_messages = db.query(Message).count()
-    online_users = db.query(User).filter(User.status == "online").count()
-    
-    return {
-        "total_users": total_users,
-        "total_messages": total_messages,
-        "online_users": online_users,
-        "offline_users": total_users - online_users
-    }
+    return stats_counters.snapshot(connection_manager.online_count())
+
+# 连接数、队列深度等已经由各组件维护，抓取时读取，不在热路径上额外记录
+metrics.ACTIVE_CONNECTIONS.set_function(lambda: len(connection_manager.active_connections))
+metrics.OUTBOUND_QUEUE_DEPTH.set_function(lambda: connection_manager.fanout.queue_depths()[0])
+metrics.OUTBOUND_QUEUE_DEPTH_MAX.set_function(lambda: connection_manager.fanout.queue_depths()[1])
+metrics.OUTBOUND_DROPPED.set_function(connection_manager.fanout.total_dropped_count)
+metrics.PASSWORD_HASH_IN_FLIGHT.set_function(lambda: password_hasher.in_flight)
+metrics.PASSWORD_HASH_QUEUE_DEPTH.set_function(lambda: password_hasher.queue_depth)
+metrics.PASSWORD_HASH_REJECTED.set_function(lambda: password_hasher.rejected_count)
+metrics.WS_DEFLATE_INPUT_BYTES.set_function(lambda: compression_stats.bytes_in)
+metrics.WS_DEFLATE_OUTPUT_BYTES.set_function(lambda: compression_stats.bytes_out)
+metrics.WS_DEFLATE_SKIPPED.set_function(lambda: compression_stats.skipped_messages)
+metrics.WS_DEFLATE_SECONDS.set_function(lambda: compression_stats.compress_seconds)
+metrics.WS_INFLATE_SECONDS.set_function(lambda: compression_stats.decompress_seconds)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Prometheus 文本格式的指标
+    """
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 # WebSocket 路由
+async def receive_frame(websocket: WebSocket) -> dict:
+    """接收一帧并解码：二进制帧为 MessagePack，文本帧为 JSON"""
+    frame = await websocket.receive()
+    if frame["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(frame.get("code", 1000))
+    if frame.get("bytes") is not None:
+        return wire_format.decode(frame["bytes"])
+    return wire_format.decode(frame["text"])
+
+def get_websocket_token(websocket: WebSocket) -> str:
+    """从查询参数 ?token= 或 Authorization: Bearer 头中取出登录令牌"""
+    token = websocket.query_params.get("token")
+    if token:
+        return token
+    authorization = websocket.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        return authorization[7:].strip()
+    return ""
+
+async def handle_disconnect(websocket: WebSocket, user, online_task: asyncio.Task):
+    """连接关闭后的清理；同一用户已经用新连接重新登录时不广播下线、不写离线状态"""
+    went_offline = connection_manager.disconnect(user, websocket)
+    await asyncio.gather(online_task, return_exceptions=True)
+    if not went_offline:
+        return
+    await connection_manager.broadcast_user_status(user, "offline")
+    # 更新用户状态为离线
+    await db_executor.run_in_session(lambda db: AuthService(db).update_user_status(user.id, "offline"))
+
 @app.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: int):
     """
-    WebSocket 连接端点
+    WebSocket 连接端点，使用 /login 返回的令牌认证：ws://host/ws/{user_id}?token=...
+
+    带上 batch=1 时，推送按 WS_BATCH_TICK_MS 周期合并成 {"type": "batch", "data": [...]} 帧
     """
     db = SessionLocal()
     try:
-        # 首先接受WebSocket连接
-        await websocket.accept()
-        print(f"🔗 WebSocket连接已接受，用户ID: {user_id}")
-        
-        auth_service = AuthService(db)
-        user = auth_service.get_user_by_id(user_id)
+        # 首先接受WebSocket连接，客户端提供了支持的子协议时改用 MessagePack 二进制帧
+        subprotocol = wire_format.negotiate(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=subprotocol)
+        logger.debug("🔗 WebSocket连接已接受，用户ID: %s, 子协议: %s", user_id, subprotocol)
         
-        if not user:
-            print(f"❌ 用户 {user_id} 不存在，拒绝连接")
-            await websocket.close(code=1008, reason="User not found")
+        token = get_websocket_token(websocket)
+        if token:
+            # 身份取自令牌声明，已校验过的令牌直接命中缓存，连接过程不访问数据库
+            user = token_verifier.user_from_token(token)
+            if not user or user.id != user_id:
+                logger.warning("❌ 用户 %s 令牌无效，拒绝连接", user_id)
+                await websocket.close(code=1008, reason="Invalid token")
+                return
+        elif settings.WS_REQUIRE_TOKEN:
+            logger.warning("❌ 用户 %s 未提供令牌，拒绝连接", user_id)
+            await websocket.close(code=1008, reason="Token required")
             return
+        else:
+            user = await find_user(user_id)
+            if not user:
+                logger.warning("❌ 用户 %s 不存在，拒绝连接", user_id)
+                await websocket.close(code=1008, reason="User not found")
+                return
         
-        # 更新用户状态为在线
-        if not auth_service.update_user_status(user.id, "online"):
-            print(f"❌ 无法更新用户 {user.username} 状态")
-            await websocket.close(code=1008, reason="User status update failed")
-            return
+        # 在后台更新用户状态为在线，断开时先等它完成再写离线，保证顺序
+        online_task = asyncio.create_task(
+            db_executor.run_in_session(lambda db: AuthService(db).update_user_status(user.id, "online"))
+        )
         
-        print(f"✅ 用户 {user.username} (ID: {user.id}) 验证成功")
+        logger.debug("✅ 用户 %s (ID: %s) 验证成功", user.username, user.id)
         
         # 连接到连接管理器
-        await connection_manager.connect(websocket, user)
-        print(f"🔗 用户 {user.username} WebSocket 连接成功，当前活跃连接: {len(connection_manager.active_connections)}")
-        print(f"🔗 当前所有活跃连接用户ID: {list(connection_manager.active_connections.keys())}")
+        batch = websocket.query_params.get("batch") in ("1", "true")
+        await connection_manager.connect(websocket, user, subprotocol, batch)
+        logger.info("🔗 用户 %s WebSocket 连接成功，当前活跃连接: %d",
+                    user.username, len(connection_manager.active_connections))
+        
+        # 后台补发离线期间收到的消息，不阻塞接收循环
+        replay_task = asyncio.create_task(connection_manager.replay_offline_messages(user))
         
         # 添加心跳检测
         try:
             while True:
-                data = await websocket.receive_json()
-                print(f"📨 收到WebSocket消息: {data}")
+                data = await receive_frame(websocket)
+                debug_sampled(logger, "📨 收到WebSocket消息: %s", data)
                 message = WSMessage(**data)
                 
                 # 处理不同类型的消息
                 if message.type == WSMessageTypes.MESSAGE_SEND:
                     await connection_manager.handle_message_send(message, user, db)
                 elif message.type == WSMessageTypes.TYPING_START:
-                    await connection_manager.broadcast_typing(user.id, True)
+                    await connection_manager.handle_typing(user.id, True, message.data)
                 elif message.type == WSMessageTypes.TYPING_STOP:
-                    await connection_manager.broadcast_typing(user.id, False)
+                    await connection_manager.handle_typing(user.id, False, message.data)
                 elif message.type == "ping":
-                    # 响应心跳包
-                    await websocket.send_json({
+                    # 响应心跳包（经发送队列，避免与写协程并发写同一连接）
+                    connection_manager.fanout.send(user.id, {
                         "type": "pong",
                         "data": {"timestamp": asyncio.get_event_loop().time()}
                     })
-                    print(f"💓 心跳响应发送给用户 {user.username}")
+                    debug_sampled(logger, "💓 心跳响应发送给用户 %s", user.username)
                 else:
-                    print(f"⚠️  未知消息类型: {message.type}")
+                    logger.warning("⚠️  未知消息类型: %s", message.type)
                     
         except WebSocketDisconnect:
-            print(f"🔌 用户 {user.username} WebSocket 断开连接")
-            connection_manager.disconnect(user)
-            await connection_manager.broadcast_user_status(user, "offline")
-            
-            # 更新用户状态为离线
-            auth_service.update_user_status(user.id, "offline")
+            replay_task.cancel()
+            logger.info("🔌 用户 %s WebSocket 断开连接", user.username)
+            await handle_disconnect(websocket, user, online_task)
             
         except Exception as e:
-            print(f"❌ WebSocket 处理错误: {e}")
-            import traceback
-            traceback.print_exc()
-            connection_manager.disconnect(user)
-            await connection_manager.broadcast_user_status(user, "offline")
-            auth_service.update_user_status(user.id, "offline")
+            logger.exception("❌ WebSocket 处理错误: %s", e)
+            replay_task.cancel()
+            await handle_disconnect(websocket, user, online_task)
                 
     except Exception as e:
-        print(f"❌ WebSocket 连接错误: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ WebSocket 连接错误: %s", e)
         try:
             await websocket.close(code=1011, reason=f"Server error: {str(e)}")
         except:
@@ -817,38 +1296,35 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int):
 
 # 新增API端点：获取在线用户
 @app.get("/online-users", response_model=dict)
-async def get_online_users(db: Session = Depends(get_db)):
+async def get_online_users():
     """
     获取在线用户列表
     """
-    auth_service = AuthService(db)
-    online_users = auth_service.get_online_users()
-    
-    return {
-        "online_users": [
+    def load(db: Session) -> list:
+        return [
             {
                 "id": user.id,
                 "username": user.username,
                 "status": user.status,
                 "last_seen": user.last_seen.isoformat() if user.last_seen else None
             }
-            for user in online_users
+            for user in AuthService(db).get_online_users()
         ]
-    }
+    
+    return {"online_users": await db_executor.run_in_session(load)}
 
 # 新增API端点：用户登出
 @app.post("/logout/{user_id}", response_model=dict)
-async def logout(user_id: int, db: Session = Depends(get_db)):
+async def logout(user_id: int):
     """
     用户登出
     """
-    auth_service = AuthService(db)
-    user = auth_service.get_user_by_id(user_id)
+    user = await find_user(user_id)
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    if auth_service.update_user_status(user.id, "offline"):
+    if await db_executor.run_in_session(lambda db: AuthService(db).update_user_status(user.id, "offline")):
         return {
             "message": "Logout successful",
             "user_id": user_id,
@@ -859,21 +1335,28 @@ async def logout(user_id: int, db: Session = Depends(get_db)):
 
 # 新增API端点：检查用户状态
 @app.get("/user-status/{user_id}", response_model=dict)
-async def get_user_status(user_id: int, db: Session = Depends(get_db)):
+async def get_user_status(user_id: int):
     """
-    获取用户状态
+    获取用户状态：在线状态来自连接管理器，只有离线用户才查询最后在线时间
     """
-    auth_service = AuthService(db)
-    user = auth_service.get_user_by_id(user_id)
+    user = await find_user(user_id)
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
+    if connection_manager.is_online(user.id):
+        status, last_seen = "online", datetime.utcnow()
+    else:
+        status = "offline"
+        last_seen = await db_executor.run_in_session(
+            lambda db: db.query(User.last_seen).filter(User.id == user.id).scalar()
+        )
+    
     return {
         "user_id": user.id,
         "username": user.username,
-        "status": user.status,
-        "last_seen": user.last_seen.isoformat() if user.last_seen else None
+        "status": status,
+        "last_seen": last_seen.isoformat() if last_seen else None
     }
 
 # 新增API端点：获取WebSocket连接状态
@@ -885,65 +1368,101 @@ async def get_websocket_status():
     return {
         "active_connections": len(connection_manager.active_connections),
         "connected_users": list(connection_manager.active_connections.keys()),
-        "user_status": connection_manager.user_status
+        "user_status": connection_manager.user_status,
+        "outbound_queues": connection_manager.get_connection_stats(),
+        "message_bus": connection_manager.message_bus.stats(),
+        "group_index": connection_manager.group_index.stats(),
+        "typing": connection_manager.typing.stats()
     }
 
+def set_users_offline(db: Session, user_ids=None) -> int:
+    """把在线用户标记为离线，user_ids 为 None 时处理全部在线用户，返回更新的行数"""
+    query = db.query(User).filter(User.status == "online")
+    if user_ids is not None:
+        query = query.filter(User.id.in_(list(user_ids)))
+    updated = query.update({User.status: "offline"}, synchronize_session=False)
+    db.commit()
+    return updated
+
 # 启动事件
 @app.on_event("startup")
 async def startup_event():
     """
     应用启动时执行
     """
-    print("🚀 Multi Instant Message System 服务器启动中...")
-    print(f"🌐 服务器地址: http://{settings.SERVER_HOST}:{settings.SERVER_PORT}")
-    print(f"📊 数据库: {settings.DATABASE_URL}")
+    setup_logging(settings.LOG_LEVEL, settings.LOG_QUEUE_SIZE, settings.LOG_DEBUG_SAMPLE_EVERY)
+    logger.info("🚀 Multi Instant Message System 服务器启动中...")
+    logger.info("🌐 服务器地址: http://%s:%s", settings.SERVER_HOST, settings.SERVER_PORT)
+    logger.info("📊 数据库: %s", settings.DATABASE_URL)
     
-    # 检查数据库连接和表
-    db = SessionLocal()
+    # 先加入消息总线，确认是否有其他 worker 正在运行
+    await connection_manager.start_bus()
+    
+    # 加载群组成员索引
     try:
-        users_count = db.query(User).count()
-        messages_count = db.query(Message).count()
-        print(f"📈 数据库状态: {users_count} 用户, {messages_count} 消息")
-        
-        # 重置所有用户状态为离线
-        online_users = db.query(User).filter(User.status == "online").all()
-        for user in online_users:
-            user.status = "offline"
-        db.commit()
-        print(f"🔄 重置 {len(online_users)} 个在线用户状态为离线")
+        await connection_manager.load_group_index()
+    except Exception as e:
+        logger.warning("⚠️  群组索引加载失败: %s", e)
+    
+    # 检查数据库连接和表，同时作为统计计数器的初始值
+    try:
+        await stats_counters.reconcile()
+        logger.info("📈 数据库状态: %s 用户, %s 消息", stats_counters.total_users, stats_counters.total_messages)
+    except Exception as e:
+        logger.warning("⚠️  数据库检查警告: %s", e)
+    
+    try:
+        # 重置所有用户状态为离线（其他 worker 还在运行时，它们的在线用户不能重置）
+        if connection_manager.message_bus.peer_count() == 0:
+            reset_count = await db_executor.run_in_session(set_users_offline, None)
+            logger.info("🔄 重置 %d 个在线用户状态为离线", reset_count)
         
         # 确保上传目录存在
         os.makedirs(UPLOAD_DIR, exist_ok=True)
-        print(f"📁 上传目录已创建: {UPLOAD_DIR}")
+        logger.info("📁 上传目录已创建: %s", UPLOAD_DIR)
+        
+        # 清理上次运行遗留的分块上传临时文件；其他 worker 仍在运行时只清理超过会话 TTL 的
+        only_stale = connection_manager.message_bus.peer_count() > 0
+        removed = await upload_manager.sweep_orphans(settings.UPLOAD_SESSION_TTL if only_stale else 0)
+        if removed:
+            logger.info("🧹 清理 %d 个遗留的上传临时文件", removed)
         
     except Exception as e:
-        print(f"⚠️  数据库检查警告: {e}")
-    finally:
-        db.close()
+        logger.warning("⚠️  数据库检查警告: %s", e)
     
-    print("✅ 服务器启动完成！")
+    loop_monitor.start()
+    message_writer.start()
+    connection_manager.typing.start()
+    stats_counters.start()
+    logger.info("✅ 服务器启动完成！")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """
     应用关闭时执行
     """
-    print("🛑 服务器正在关闭...")
+    logger.info("🛑 服务器正在关闭...")
+    await loop_monitor.stop()
+    await message_writer.stop()
+    await thumbnailer.stop()
+    await connection_manager.typing.stop()
+    await stats_counters.stop()
     
-    # 将所有在线用户状态设置为离线
-    db = SessionLocal()
+    # 将本进程的在线用户状态设置为离线（最后一个 worker 退出时处理全部用户）
+    is_last_worker = connection_manager.message_bus.peer_count() == 0
+    await connection_manager.stop_bus()
     try:
-        online_users = db.query(User).filter(User.status == "online").all()
-        for user in online_users:
-            user.status = "offline"
-        db.commit()
-        print(f"✅ 已更新 {len(online_users)} 个在线用户状态为离线")
+        user_ids = None if is_last_worker else list(connection_manager.active_connections)
+        offline_count = await db_executor.run_in_session(set_users_offline, user_ids)
+        logger.info("✅ 已更新 %d 个在线用户状态为离线", offline_count)
     except Exception as e:
-        print(f"❌ 关闭时更新用户状态失败: {e}")
-    finally:
-        db.close()
+        logger.error("❌ 关闭时更新用户状态失败: %s", e)
     
-    print("👋 服务器已关闭")
+    password_hasher.shutdown()
+    file_io.shutdown()
+    db_executor.shutdown()
+    logger.info("👋 服务器已关闭")
+    shutdown_logging()
 
 # 错误处理
 @app.exception_handler(404)
@@ -964,7 +1483,8 @@ async def internal_error_handler(request, exc):
 async def http_exception_handler(request, exc):
     return JSONResponse(
         status_code=exc.status_code,
-        content={"message": exc.detail}
+        content={"message": exc.detail},
+        headers=exc.headers
     )
 
 # 主程序入口
@@ -978,5 +1498,6 @@ if __name__ == "__main__":
         host=settings.SERVER_HOST,
         port=settings.SERVER_PORT,
         reload=True,
-        log_level="info"
+        log_level="info",
+        **uvicorn_ws_options()
     )
\ No newline at end of file
@@ -0,0 +1,315 @@
+# server/src/message_bus.py
+import asyncio
+import json
+import os
+import struct
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from fanout import EncodedFrame
+from app_logging import get_logger
+
+logger = get_logger("message_bus")
+
+_LENGTH = struct.Struct("!I")
+
+
+class MessageBus:
+    """消息总线：把本进程之外的用户的消息转发到对应的 worker 进程
+
+    本地连接仍由 FanoutEngine 直接投递，总线只负责跨进程的部分。
+    deliver_local(op, target, message) 由总线在收到其他 worker 转发的消息时调用，
+    target 对 personal 是用户ID，对 multicast 是用户ID列表，对 broadcast 是排除的用户ID；
+    带消息ID的私聊转发为 private，target 是 (用户ID, 消息ID列表)，由接收方在写出后标记已送达。
+    """
+
+    async def start(self, deliver_local: Callable[[str, Any, dict], None]):
+        pass
+
+    async def stop(self):
+        pass
+
+    def register_user(self, user_id: int):
+        """本进程有用户上线，通知其他 worker 更新路由表"""
+
+    def unregister_user(self, user_id: int):
+        """本进程有用户下线"""
+
+    def is_remote_online(self, user_id: int) -> bool:
+        return False
+
+    def remote_users(self) -> Set[int]:
+        return set()
+
+    def remote_user_count(self) -> int:
+        return 0
+
+    def peer_count(self) -> int:
+        return 0
+
+    async def publish_personal(self, user_id: int, message: Any, message_ids: List[int] = None) -> bool:
+        """转发给在其他 worker 上的用户，返回是否找到了路由
+
+        message_ids 为要标记已送达的私聊消息，由用户所在的 worker 在写出到连接后标记。
+        """
+        return False
+
+    async def publish_broadcast(self, message: Any, exclude_user_id: int = None):
+        """广播给其他所有 worker，每个 worker 只发送一次，由它在本地扇出"""
+
+    async def publish_multicast(self, user_ids: Iterable[int], message: Any) -> int:
+        """发给其他 worker 上的一组用户，按 worker 合并，每个 worker 只发送一次；返回路由到的用户数"""
+        return 0
+
+    def publish_control(self, event: dict):
+        """通知其他 worker 更新本地状态（如群组成员变化）"""
+
+    def stats(self) -> dict:
+        return {"backend": "local", "peers": 0, "remote_users": 0}
+
+
+class InProcessBus(MessageBus):
+    """单进程部署：所有连接都在本进程，不需要转发"""
+
+
+class _Peer:
+    """到另一个 worker 的发送连接"""
+
+    def __init__(self, worker_id: str, writer: asyncio.StreamWriter):
+        self.worker_id = worker_id
+        self.writer = writer
+        self.sent_frames = 0
+
+    def send(self, data: bytes):
+        # 只写入缓冲区不等待 drain，保证同一个 peer 上的事件严格按顺序发出
+        if self.writer.is_closing():
+            raise ConnectionError(f"Connection to worker {self.worker_id} is closed")
+        self.writer.write(_LENGTH.pack(len(data)) + data)
+        self.sent_frames += 1
+
+    def buffered_bytes(self) -> int:
+        return self.writer.transport.get_write_buffer_size()
+
+    def close(self):
+        self.writer.close()
+
+
+class UnixSocketBus(MessageBus):
+    """本机多进程部署（uvicorn workers>1）：worker 之间通过 Unix domain socket 互相转发
+
+    每个 worker 在 bus_dir 下监听 worker-<pid>.sock，启动时连接目录中已有的其他 worker。
+    路由表记录 user_id → worker，私聊只发给目标用户所在的 worker，广播每个 worker 只发一次。
+    """
+
+    def __init__(self, bus_dir: str):
+        self.bus_dir = bus_dir
+        self.worker_id = str(os.getpid())
+        self.socket_path = os.path.join(bus_dir, f"worker-{self.worker_id}.sock")
+        self.local_users: Set[int] = set()
+        self.routes: Dict[int, str] = {}  # user_id -> worker_id
+        self.peers: Dict[str, _Peer] = {}
+        self.deliver_local = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._reader_tasks: Set[asyncio.Task] = set()
+        self.received_frames = 0
+
+    async def start(self, deliver_local):
+        self.deliver_local = deliver_local
+        os.makedirs(self.bus_dir, exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = await asyncio.start_unix_server(self._handle_inbound, path=self.socket_path)
+
+        # 连接目录中已存在的其他 worker
+        for name in os.listdir(self.bus_dir):
+            if name.startswith("worker-") and name.endswith(".sock"):
+                worker_id = name[len("worker-"):-len(".sock")]
+                if worker_id != self.worker_id:
+                    await self._connect_peer(worker_id)
+        logger.info("🚌 Message bus started: worker %s, peers: %s", self.worker_id, list(self.peers))
+
+    async def stop(self):
+        self._send_all({"op": "bye", "worker": self.worker_id})
+        for peer in self.peers.values():
+            peer.close()
+        self.peers.clear()
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        for task in list(self._reader_tasks):
+            task.cancel()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    async def _connect_peer(self, worker_id: str) -> Optional[_Peer]:
+        path = os.path.join(self.bus_dir, f"worker-{worker_id}.sock")
+        try:
+            _, writer = await asyncio.open_unix_connection(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # 进程已退出但留下了 socket 文件
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            return None
+        peer = _Peer(worker_id, writer)
+        self.peers[worker_id] = peer
+        peer.send(self._encode({
+            "op": "hello",
+            "worker": self.worker_id,
+            "users": list(self.local_users)
+        }))
+        return peer
+
+    async def _handle_inbound(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._reader_tasks.add(task)
+        worker_id = None
+        try:
+            while True:
+                header = await reader.readexactly(_LENGTH.size)
+                data = await reader.readexactly(_LENGTH.unpack(header)[0])
+                self.received_frames += 1
+                event = json.loads(data)
+                worker_id = event.get("worker", worker_id)
+                await self._handle_event(event, worker_id)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # 对端退出或本进程关闭总线
+            pass
+        finally:
+            self._reader_tasks.discard(task)
+            writer.close()
+            if worker_id:
+                self._drop_peer(worker_id)
+
+    async def _handle_event(self, event: dict, worker_id: str):
+        op = event["op"]
+        if op == "hello":
+            for user_id in event["users"]:
+                self.routes[user_id] = worker_id
+            # 新 worker 连进来了，反向建立发送连接并告知本进程的用户
+            if worker_id not in self.peers:
+                await self._connect_peer(worker_id)
+        elif op == "route":
+            if event["online"]:
+                self.routes[event["user"]] = worker_id
+            elif self.routes.get(event["user"]) == worker_id:
+                del self.routes[event["user"]]
+        elif op == "personal":
+            if event.get("ids"):
+                self.deliver_local("private", (event["user"], event["ids"]), event["message"])
+            else:
+                self.deliver_local("personal", event["user"], event["message"])
+        elif op == "broadcast":
+            self.deliver_local("broadcast", event.get("exclude"), event["message"])
+        elif op == "multicast":
+            self.deliver_local("multicast", event["users"], event["message"])
+        elif op == "control":
+            self.deliver_local("control", None, event["event"])
+        elif op == "bye":
+            self._drop_peer(worker_id)
+
+    def _drop_peer(self, worker_id: str):
+        peer = self.peers.pop(worker_id, None)
+        if peer:
+            peer.close()
+        for user_id in [u for u, w in self.routes.items() if w == worker_id]:
+            del self.routes[user_id]
+
+    def _encode(self, event: dict) -> bytes:
+        return json.dumps(event, separators=(",", ":")).encode("utf-8")
+
+    def _encode_with_message(self, event: dict, message: Any) -> bytes:
+        """把消息嵌入转发事件；已预编码的帧直接拼接，不再重复序列化"""
+        if isinstance(message, EncodedFrame):
+            head = json.dumps(event, separators=(",", ":"))[:-1]
+            return f'{head},"message":{message.text}}}'.encode("utf-8")
+        return self._encode({**event, "message": message})
+
+    def _send_all(self, event: dict, data: bytes = None):
+        data = data or self._encode(event)
+        for worker_id, peer in list(self.peers.items()):
+            try:
+                peer.send(data)
+            except (ConnectionError, OSError):
+                self._drop_peer(worker_id)
+
+    def register_user(self, user_id: int):
+        self.local_users.add(user_id)
+        self.routes.pop(user_id, None)
+        self._send_all({"op": "route", "worker": self.worker_id, "user": user_id, "online": True})
+
+    def unregister_user(self, user_id: int):
+        self.local_users.discard(user_id)
+        self._send_all({"op": "route", "worker": self.worker_id, "user": user_id, "online": False})
+
+    def is_remote_online(self, user_id: int) -> bool:
+        return user_id in self.routes
+
+    def remote_users(self) -> Set[int]:
+        return set(self.routes)
+
+    def remote_user_count(self) -> int:
+        return len(self.routes)
+
+    def peer_count(self) -> int:
+        return len(self.peers)
+
+    async def publish_personal(self, user_id: int, message: Any, message_ids: List[int] = None) -> bool:
+        peer = self.peers.get(self.routes.get(user_id))
+        if peer is None:
+            return False
+        event = {"op": "personal", "worker": self.worker_id, "user": user_id}
+        if message_ids:
+            event["ids"] = list(message_ids)
+        try:
+            peer.send(self._encode_with_message(event, message))
+        except (ConnectionError, OSError):
+            self._drop_peer(peer.worker_id)
+            return False
+        return True
+
+    async def publish_broadcast(self, message: Any, exclude_user_id: int = None):
+        if not self.peers:
+            return
+        data = self._encode_with_message(
+            {"op": "broadcast", "worker": self.worker_id, "exclude": exclude_user_id}, message)
+        self._send_all(None, data)
+
+    async def publish_multicast(self, user_ids: Iterable[int], message: Any) -> int:
+        by_worker: Dict[str, List[int]] = {}
+        for user_id in user_ids:
+            worker_id = self.routes.get(user_id)
+            if worker_id in self.peers:
+                by_worker.setdefault(worker_id, []).append(user_id)
+        routed = 0
+        for worker_id, users in by_worker.items():
+            try:
+                self.peers[worker_id].send(self._encode_with_message(
+                    {"op": "multicast", "worker": self.worker_id, "users": users}, message))
+                routed += len(users)
+            except (ConnectionError, OSError):
+                self._drop_peer(worker_id)
+        return routed
+
+    def publish_control(self, event: dict):
+        self._send_all({"op": "control", "worker": self.worker_id, "event": event})
+
+    def stats(self) -> dict:
+        return {
+            "backend": "unix",
+            "worker_id": self.worker_id,
+            "peers": len(self.peers),
+            "remote_users": len(self.routes),
+            "sent_frames": {worker_id: peer.sent_frames for worker_id, peer in self.peers.items()},
+            "buffered_bytes": {worker_id: peer.buffered_bytes() for worker_id, peer in self.peers.items()},
+            "received_frames": self.received_frames
+        }
+
+
+def create_message_bus(backend: str, bus_dir: str) -> MessageBus:
+    """根据配置创建消息总线"""
+    if backend == "local":
+        return InProcessBus()
+    if backend == "unix":
+        return UnixSocketBus(bus_dir)
+    raise ValueError(f"Unknown message bus backend: {backend}")
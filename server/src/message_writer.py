@@ -0,0 +1,183 @@
+# server/src/message_writer.py
+import asyncio
+import time
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import insert, select
+
+from app_logging import get_logger
+from db_executor import DatabaseExecutor
+from models.user import Message
+from metrics import DB_COMMIT_SECONDS, DB_BATCH_SIZE
+
+logger = get_logger("message_writer")
+
+# 放入队列通知写入协程：写完手上的一批后退出
+_STOP = object()
+
+
+class MessageWriter:
+    """消息批量写入器：把一个时间窗口内到达的消息合并为一次事务（group commit）
+
+    提交方的 future 在事务提交成功后才完成，提交失败时收到异常。
+    """
+
+    def __init__(self, db_executor: DatabaseExecutor, window_ms: float = 2.0,
+                 max_batch_size: int = 256, max_pending: int = 10000):
+        self.db_executor = db_executor
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._task: Optional[asyncio.Task] = None
+
+        # 统计信息
+        self.batch_count = 0
+        self.message_count = 0
+        self.failed_count = 0
+        self.last_flush_ms = 0.0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止写入协程：已取出的一批照常写完，再把队列中剩余的消息写完"""
+        if self._task:
+            if not self._task.done():
+                await self.queue.put(_STOP)
+                await self._task
+            self._task = None
+        while not self.queue.empty():
+            await self._flush(self._drain([]))
+
+    async def submit(self, db_message: Message) -> Message:
+        """提交一条待保存的消息，返回写入后带有ID的消息对象"""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((db_message, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            item = await self.queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            # 等待一个窗口期，让并发到达的消息进入同一批
+            if self.window > 0 and self.queue.qsize() < self.max_batch_size - 1:
+                await asyncio.sleep(self.window)
+            batch = self._drain(batch)
+            stopping = batch and batch[-1] is _STOP
+            if stopping:
+                batch.pop()
+            await self._flush(batch)
+            if stopping:
+                return
+
+    def _drain(self, batch: list) -> list:
+        """从队列中取消息补满一批；取到停止标记时放在末尾并停止"""
+        while len(batch) < self.max_batch_size:
+            try:
+                item = self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            batch.append(item)
+            if item is _STOP:
+                break
+        return batch
+
+    async def _flush(self, batch: List[Tuple[Message, asyncio.Future]]):
+        if not batch:
+            return
+        messages = [db_message for db_message, _ in batch]
+        futures = [future for _, future in batch]
+
+        start = time.perf_counter()
+        try:
+            await self.db_executor.run_in_session(self._write_batch, messages)
+        except Exception as e:
+            self.failed_count += len(batch)
+            logger.error("❌ 批量写入 %d 条消息失败: %s", len(batch), e)
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.last_flush_ms = (time.perf_counter() - start) * 1000
+        self.batch_count += 1
+        self.message_count += len(batch)
+        DB_BATCH_SIZE.observe(len(batch))
+        # 提交成功后才通知提交方
+        for db_message, future in batch:
+            if not future.done():
+                future.set_result(db_message)
+
+    @staticmethod
+    def _write_batch(db, messages: List[Message]):
+        """在数据库线程中执行：一次写入整批消息，一次 commit"""
+        try:
+            if db.get_bind().dialect.insert_executemany_returning:
+                # SQLite / MariaDB：ORM flush 用 INSERT ... RETURNING 批量写入并取回ID
+                db.add_all(messages)
+                db.flush()
+                # 先脱离会话，提交后对象上的ID等字段不会被过期
+                db.expunge_all()
+            else:
+                ids = MessageWriter._insert_rows(db, [MessageWriter._row(m) for m in messages])
+                for db_message, message_id in zip(messages, ids):
+                    db_message.id = message_id
+            start = time.perf_counter()
+            db.commit()
+            DB_COMMIT_SECONDS.observe(time.perf_counter() - start)
+        except Exception:
+            db.rollback()
+            raise
+
+    @staticmethod
+    def _insert_rows(db, rows: List[dict]) -> List[int]:
+        """MySQL 没有 RETURNING，ORM flush 会逐行 INSERT；这里用 executemany，
+        PyMySQL 会把它改写成一条多行 INSERT，LAST_INSERT_ID() 是第一行的ID
+
+        同一条语句的自增ID一般连续，但 innodb_autoinc_lock_mode=2 时可能与并发语句交错，
+        语句过长时 PyMySQL 也会拆成几条，所以按推算的ID读回核对，对不上时回滚并逐行插入。
+        """
+        first_id = db.connection().execute(insert(Message.__table__), rows).lastrowid
+        ids = list(range(first_id, first_id + len(rows))) if first_id else []
+        stored = db.execute(
+            select(Message.sender_id, Message.content).where(Message.id.in_(ids)).order_by(Message.id)
+        ).all()
+        if [tuple(row) for row in stored] == [(row["sender_id"], row["content"]) for row in rows]:
+            return ids
+        logger.warning("⚠️ 批量插入的消息ID不连续，改为逐行插入 %d 条消息", len(rows))
+        db.rollback()
+        return [db.execute(insert(Message).values(row)).inserted_primary_key[0] for row in rows]
+
+    @staticmethod
+    def _row(db_message: Message) -> dict:
+        """消息对象转为 INSERT 参数；executemany 要求每行的列相同，未设置的列取模型上的默认值"""
+        row = {}
+        for column in Message.__table__.columns:
+            if column.primary_key:
+                continue
+            value = getattr(db_message, column.key)
+            if value is None and column.default is not None and column.default.is_scalar:
+                value = column.default.arg
+                setattr(db_message, column.key, value)
+            row[column.key] = value
+        if row["timestamp"] is None:
+            # 与其他创建消息的地方一致使用 UTC
+            row["timestamp"] = db_message.timestamp = datetime.utcnow()
+        return row
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.queue.qsize(),
+            "batches": self.batch_count,
+            "messages": self.message_count,
+            "failed": self.failed_count,
+            "avg_batch_size": round(self.message_count / self.batch_count, 2) if self.batch_count else 0,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "window_ms": self.window * 1000,
+            "max_batch_size": self.max_batch_size
+        }
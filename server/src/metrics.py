@@ -0,0 +1,275 @@
+# server/src/metrics.py
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# 延迟直方图的默认分桶（秒），覆盖 0.1ms 到 10s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+    """指标注册表，render 输出 Prometheus 文本格式（text/plain; version=0.0.4）"""
+
+    def __init__(self):
+        self.metrics: List["Metric"] = []
+
+    def register(self, metric: "Metric"):
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in labels)
+    return f"{{{pairs}}}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    """指标基类：按标签值缓存子指标，记录时只做字典查找和加法，不加锁
+
+    记录都发生在事件循环线程或持有 GIL 的数据库线程中，偶尔丢失一次并发自增可以接受。
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 registry: Optional[Registry] = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[tuple, object] = {}
+        self._function: Optional[Callable[[], float]] = None
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def set_function(self, function: Callable[[], float]):
+        """抓取时调用 function 取值，用于连接数、队列深度这类已经由其他组件维护的数值"""
+        self._function = function
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _label_pairs(self, values: tuple) -> List[Tuple[str, str]]:
+        return [(name, str(value)) for name, value in zip(self.labelnames, values)]
+
+    def samples(self):
+        if self._function is not None:
+            yield "", [], float(self._function())
+            return
+        for values, child in list(self._children.items()):
+            yield from child.samples(self._label_pairs(values))
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+    def samples(self, labels):
+        yield "", labels, self.value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self.labels().dec(amount)
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # 最后一个是 +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def samples(self, labels):
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            cumulative += count
+            yield "_bucket", labels + [("le", _format_value(float(bound)))], cumulative
+        yield "_sum", labels, self.sum
+        yield "_count", labels, cumulative
+
+
+class Histogram(Metric):
+    """固定分桶直方图，observe 是一次二分查找加两次加法"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = LATENCY_BUCKETS, registry: Optional[Registry] = REGISTRY):
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+
+def recipient_bucket(count: int) -> str:
+    """扇出接收者数量分档，作为标签值，避免每个不同的人数产生一组时间序列"""
+    if count <= 1:
+        return "1"
+    if count <= 10:
+        return "2-10"
+    if count <= 100:
+        return "11-100"
+    if count <= 1000:
+        return "101-1000"
+    return "1000+"
+
+
+# 聊天服务的指标
+MESSAGE_SEND_SECONDS = Histogram(
+    "chat_message_send_seconds",
+    "Time from receiving a message to queueing it for all recipients, including persistence",
+    ["kind"]
+)
+DB_COMMIT_SECONDS = Histogram(
+    "chat_db_commit_seconds",
+    "Time spent in COMMIT for a batch of messages"
+)
+DB_BATCH_SIZE = Histogram(
+    "chat_db_batch_size",
+    "Messages written per group-commit batch",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+FANOUT_SECONDS = Histogram(
+    "chat_fanout_seconds",
+    "Time to queue one message for its recipients, by recipient count",
+    ["recipients"]
+)
+WS_SEND_SECONDS = Histogram(
+    "chat_ws_send_seconds",
+    "Time to write one frame to a WebSocket connection"
+)
+UPLOAD_BYTES = Counter(
+    "chat_upload_bytes_total",
+    "Bytes received by file uploads",
+    ["kind"]
+)
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "chat_event_loop_lag_seconds",
+    "How late the event loop woke up from a timer",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+ACTIVE_CONNECTIONS = Gauge(
+    "chat_active_connections",
+    "WebSocket connections held by this process"
+)
+WS_BATCH_SIZE = Histogram(
+    "chat_ws_batch_size",
+    "Messages coalesced into one WebSocket frame on connections that accept batches",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250)
+)
+OUTBOUND_QUEUE_DEPTH = Gauge(
+    "chat_outbound_queue_depth",
+    "Frames waiting in all outbound connection queues"
+)
+OUTBOUND_QUEUE_DEPTH_MAX = Gauge(
+    "chat_outbound_queue_depth_max",
+    "Deepest outbound connection queue"
+)
+OUTBOUND_DROPPED = Counter(
+    "chat_outbound_dropped_total",
+    "Frames dropped because an outbound queue was full"
+)
+PASSWORD_HASH_IN_FLIGHT = Gauge(
+    "chat_password_hash_in_flight",
+    "bcrypt hashes and checks running in the password process pool"
+)
+PASSWORD_HASH_QUEUE_DEPTH = Gauge(
+    "chat_password_hash_queue_depth",
+    "Logins and registrations waiting for a password pool slot"
+)
+PASSWORD_HASH_REJECTED = Counter(
+    "chat_password_hash_rejected_total",
+    "Logins and registrations rejected with 503 because the password queue was full"
+)
+WS_DEFLATE_INPUT_BYTES = Counter(
+    "chat_ws_deflate_input_bytes_total",
+    "Outbound WebSocket payload bytes before permessage-deflate"
+)
+WS_DEFLATE_OUTPUT_BYTES = Counter(
+    "chat_ws_deflate_output_bytes_total",
+    "Outbound WebSocket payload bytes after permessage-deflate"
+)
+WS_DEFLATE_SKIPPED = Counter(
+    "chat_ws_deflate_skipped_total",
+    "Outbound messages sent uncompressed because they were below the size threshold"
+)
+WS_DEFLATE_SECONDS = Counter(
+    "chat_ws_deflate_seconds_total",
+    "Time spent compressing outbound WebSocket messages"
+)
+WS_INFLATE_SECONDS = Counter(
+    "chat_ws_inflate_seconds_total",
+    "Time spent decompressing inbound WebSocket messages"
+)
@@ -1,6 +1,6 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey, Table
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Boolean, Text, ForeignKey, Table, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, joinedload
 from sqlalchemy.sql import func
 from datetime import datetime
 
@@ -53,6 +53,17 @@ class User(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # 离线消息补发：按接收者查找未送达的消息
+        Index("ix_messages_receiver_delivered_id", "receiver_id", "delivered", "id"),
+        # 会话历史键集分页：私聊按 (发送者, 接收者)，群聊/公共消息按 (群组, 接收者)，再按 (timestamp, id) 排序
+        Index("ix_messages_sender_receiver_ts_id", "sender_id", "receiver_id", "timestamp", "id"),
+        Index("ix_messages_group_receiver_ts_id", "group_id", "receiver_id", "timestamp", "id"),
+        # 按存储路径统计附件引用
+        Index("ix_messages_file_path", "file_path"),
+        # 下载时按公开的文件ID查找存储路径、原始文件名和类型
+        Index("ix_messages_file_id", "file_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     content = Column(Text, nullable=False)
@@ -61,6 +72,7 @@ class Message(Base):
     file_size = Column(Integer, nullable=True)  # 文件大小（字节）
     mime_type = Column(String(100), nullable=True)  # 文件MIME类型
     file_path = Column(String(500), nullable=True)  # 文件存储路径
+    file_id = Column(String(64), nullable=True)  # 下载URL中的文件ID，每条文件消息随机生成，不暴露内容哈希
     thumbnail_path = Column(String(500), nullable=True)  # 缩略图路径（用于图片/视频）
     duration = Column(Integer, nullable=True)  # 音频/视频时长（秒）
     sender_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -68,12 +80,22 @@ class Message(Base):
     group_id = Column(Integer, ForeignKey("groups.id"), nullable=True)
     timestamp = Column(DateTime, default=func.now())
     is_read = Column(Boolean, default=False)
+    delivered = Column(Boolean, default=False)  # 是否已推送给接收者，离线私聊消息在其上线后补发
     
     # 关系
     sender = relationship("User", back_populates="sent_messages", foreign_keys=[sender_id])
     receiver = relationship("User", back_populates="received_messages", foreign_keys=[receiver_id])
     group = relationship("Group", back_populates="messages")
 
+    @staticmethod
+    def serialization_options():
+        """序列化时会访问的关联对象，随消息一起用 JOIN 加载，避免每行再懒加载一次（N+1）"""
+        return (
+            joinedload(Message.sender).load_only(User.id, User.username),
+            joinedload(Message.receiver).load_only(User.id, User.username),
+            joinedload(Message.group).load_only(Group.id, Group.name)
+        )
+
     def to_dict(self):
         """将消息对象转换为字典"""
         return {
@@ -195,4 +217,14 @@ class Group(Base):
             "created_by": self.created_by,
             "owner_username": self.owner.username if self.owner else None,
             "member_count": len(self.members) if self.members else 0
-        }
\ No newline at end of file
+        }
+
+class Blob(Base):
+    """内容寻址的附件存储：相同内容（sha256 相同）只在磁盘上保存一份，引用它的消息通过 file_path 关联"""
+    __tablename__ = "blobs"
+    
+    sha256 = Column(String(64), primary_key=True)
+    path = Column(String(500), nullable=False)  # 与 messages.file_path 一致
+    size = Column(BigInteger, nullable=False)
+    mime_type = Column(String(100), nullable=True)
+    created_at = Column(DateTime, default=func.now())
@@ -0,0 +1,116 @@
+# server/src/password_hasher.py
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from passlib.context import CryptContext
+
+# 密码加密上下文
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def hash_password(password: str) -> str:
+    """在进程池中执行：生成密码哈希"""
+    return pwd_context.hash(password)
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """在进程池中执行：验证密码，哈希格式无法识别时视为不匹配"""
+    try:
+        return pwd_context.verify(plain_password, hashed_password)
+    except (ValueError, TypeError):
+        return False
+
+
+class PasswordHasherBusy(Exception):
+    """等待哈希的请求已达上限，调用方应返回 503 让客户端稍后重试"""
+
+
+class PasswordHasher:
+    """bcrypt 哈希与校验放到独立进程池中执行，避免登录风暴时冻结事件循环
+
+    同时执行的任务数等于进程数，其余请求在事件循环中排队；排队数超过 max_queue 时
+    直接拒绝，不让积压无限增长。
+    """
+
+    def __init__(self, max_workers: int = 2, max_queue: int = 64, latency_window: int = 1024):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+        # 统计信息
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.in_flight = 0
+        self.hashed_count = 0
+        self.verified_count = 0
+        self.rejected_count = 0
+        self.wait_ms = deque(maxlen=latency_window)
+        self.hash_ms = deque(maxlen=latency_window)
+
+    async def hash(self, password: str) -> str:
+        result = await self._submit(hash_password, password)
+        self.hashed_count += 1
+        return result
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        result = await self._submit(verify_password, plain_password, hashed_password)
+        self.verified_count += 1
+        return result
+
+    async def _submit(self, func, *args):
+        if self.queue_depth >= self.max_queue:
+            self.rejected_count += 1
+            raise PasswordHasherBusy("Too many pending password checks")
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+
+        queued_at = time.perf_counter()
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queue_depth -= 1
+        started_at = time.perf_counter()
+        self.wait_ms.append((started_at - queued_at) * 1000)
+        self.in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, func, *args)
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+            self.hash_ms.append((time.perf_counter() - started_at) * 1000)
+
+    def shutdown(self):
+        if self._pool:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    @staticmethod
+    def _percentile(samples, q: float) -> float:
+        if not samples:
+            return 0
+        ordered = sorted(samples)
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * q))], 3)
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "in_flight": self.in_flight,
+            "hashed": self.hashed_count,
+            "verified": self.verified_count,
+            "rejected": self.rejected_count,
+            "wait_ms_p50": self._percentile(self.wait_ms, 0.5),
+            "wait_ms_p99": self._percentile(self.wait_ms, 0.99),
+            "hash_ms_p50": self._percentile(self.hash_ms, 0.5),
+            "hash_ms_p99": self._percentile(self.hash_ms, 0.99)
+        }
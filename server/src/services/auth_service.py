@@ -4,15 +4,28 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(
 
 from datetime import datetime, timedelta
 from typing import Optional, List
-from jose import JWTError, jwt
-from passlib.context import CryptContext
+from jose import jwt
 from sqlalchemy.orm import Session
 
 from config.config import settings
-from server.models.user import User
+from models.user import User
+from password_hasher import pwd_context
+from token_verifier import TokenVerifier
+from user_directory import DirectoryUser, UserDirectory
+from app_logging import get_logger
 
-# 密码加密上下文
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+logger = get_logger("auth")
+
+# 进程内共享的令牌校验缓存
+token_verifier = TokenVerifier(
+    settings.SECRET_KEY,
+    settings.ALGORITHM,
+    max_size=settings.TOKEN_CACHE_SIZE,
+    ttl=settings.TOKEN_CACHE_TTL
+)
+
+# 进程内共享的用户目录缓存，注册、改密码、删除用户时失效（多 worker 时经消息总线通知其他 worker）
+user_directory = UserDirectory(max_size=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL)
 
 class AuthService:
     def __init__(self, db: Session):
@@ -26,6 +39,14 @@ class AuthService:
         """生成密码哈希"""
         return pwd_context.hash(password)
     
+    def get_login_credentials(self, username: str):
+        """登录校验所需的 (id, username, hashed_password)，只查这三列，密码哈希不进缓存"""
+        return (
+            self.db.query(User.id, User.username, User.hashed_password)
+            .filter(User.username == username)
+            .first()
+        )
+    
     def authenticate_user(self, username: str, password: str) -> Optional[User]:
         """验证用户凭据"""
         user = self.db.query(User).filter(User.username == username).first()
@@ -33,9 +54,9 @@ class AuthService:
             return None
         return user
     
-    def create_user(self, user_data) -> User:
-        """创建新用户"""
-        from src.shared.protocols import RegisterRequest
+    def create_user(self, user_data, hashed_password: str = None) -> User:
+        """创建新用户，hashed_password 为调用方预先计算好的密码哈希"""
+        from shared.protocols import RegisterRequest
         
         if isinstance(user_data, RegisterRequest):
             username = user_data.username
@@ -54,7 +75,8 @@ class AuthService:
         if self.db.query(User).filter(User.email == email).first():
             raise ValueError(f"Email {email} already exists")
             
-        hashed_password = self.get_password_hash(password)
+        if hashed_password is None:
+            hashed_password = self.get_password_hash(password)
         user = User(
             username=username,
             email=email,
@@ -64,6 +86,7 @@ class AuthService:
         self.db.add(user)
         self.db.commit()
         self.db.refresh(user)
+        user_directory.invalidate(user.id, user.username)
         return user
     
     def create_access_token(self, data: dict, expires_delta: Optional[timedelta] = None):
@@ -79,36 +102,36 @@ class AuthService:
         return encoded_jwt
     
     def verify_token(self, token: str) -> Optional[dict]:
-        """验证JWT令牌"""
-        try:
-            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-            return payload
-        except JWTError:
-            return None
+        """验证JWT令牌（结果在 token_verifier 中缓存）"""
+        return token_verifier.verify(token)
+    
+    def get_user_by_username(self, username: str) -> Optional[DirectoryUser]:
+        """根据用户名获取用户（经用户目录缓存，返回只读快照）"""
+        return user_directory.lookup_by_username(self.db, username)
     
-    def get_user_by_username(self, username: str) -> Optional[User]:
-        """根据用户名获取用户"""
-        return self.db.query(User).filter(User.username == username).first()
+    def get_user_by_id(self, user_id: int) -> Optional[DirectoryUser]:
+        """根据用户ID获取用户（经用户目录缓存，返回只读快照）"""
+        return user_directory.lookup(self.db, user_id)
     
-    def get_user_by_id(self, user_id: int) -> Optional[User]:
-        """根据用户ID获取用户"""
+    def _get_user_row(self, user_id: int) -> Optional[User]:
+        """修改用户或读取在线状态等易变字段时，直接查询 ORM 对象"""
         return self.db.query(User).filter(User.id == user_id).first()
     
     def update_user_status(self, user_id: int, status: str) -> bool:
         """更新用户状态"""
         try:
-            user = self.get_user_by_id(user_id)
+            user = self._get_user_row(user_id)
             if user:
                 user.status = status
                 user.last_seen = datetime.utcnow()
                 self.db.commit()
-                print(f"✅ 用户 {user.username} 状态更新为: {status}")
+                logger.debug("✅ 用户 %s 状态更新为: %s", user.username, status)
                 return True
             else:
-                print(f"❌ 用户ID {user_id} 不存在")
+                logger.warning("❌ 用户ID %s 不存在", user_id)
                 return False
         except Exception as e:
-            print(f"❌ 更新用户状态失败: {e}")
+            logger.error("❌ 更新用户状态失败: %s", e)
             self.db.rollback()
             return False
     
@@ -126,7 +149,7 @@ class AuthService:
     
     def create_or_get_user(self, user_id: int, username: str) -> User:
         """创建或获取用户（用于测试）"""
-        user = self.get_user_by_id(user_id)
+        user = self._get_user_row(user_id)
         if user:
             return user
         
@@ -141,36 +164,39 @@ class AuthService:
         self.db.add(user)
         self.db.commit()
         self.db.refresh(user)
-        print(f"✅ 创建测试用户: {user.username} (ID: {user.id})")
+        user_directory.invalidate(user.id, user.username)
+        logger.info("✅ 创建测试用户: %s (ID: %s)", user.username, user.id)
         return user
     
     def delete_user(self, user_id: int) -> bool:
         """删除用户"""
         try:
-            user = self.get_user_by_id(user_id)
+            user = self._get_user_row(user_id)
             if user:
                 self.db.delete(user)
                 self.db.commit()
-                print(f"✅ 删除用户: {user.username} (ID: {user.id})")
+                user_directory.invalidate(user.id, user.username)
+                logger.info("✅ 删除用户: %s (ID: %s)", user.username, user.id)
                 return True
             return False
         except Exception as e:
-            print(f"❌ 删除用户失败: {e}")
+            logger.error("❌ 删除用户失败: %s", e)
             self.db.rollback()
             return False
     
     def update_user_password(self, user_id: int, new_password: str) -> bool:
         """更新用户密码"""
         try:
-            user = self.get_user_by_id(user_id)
+            user = self._get_user_row(user_id)
             if user:
                 user.hashed_password = self.get_password_hash(new_password)
                 self.db.commit()
-                print(f"✅ 用户 {user.username} 密码已更新")
+                user_directory.invalidate(user.id, user.username)
+                logger.info("✅ 用户 %s 密码已更新", user.username)
                 return True
             return False
         except Exception as e:
-            print(f"❌ 更新用户密码失败: {e}")
+            logger.error("❌ 更新用户密码失败: %s", e)
             self.db.rollback()
             return False
     
@@ -221,12 +247,12 @@ class AuthService:
             return None
         
         # 创建新的访问令牌
-        new_token = self.create_access_token(data={"sub": username})
+        new_token = self.create_access_token(data={"sub": username, "uid": user.id})
         return new_token
     
     def get_user_session_info(self, user_id: int) -> Optional[dict]:
         """获取用户会话信息"""
-        user = self.get_user_by_id(user_id)
+        user = self._get_user_row(user_id)
         if user:
             return {
                 "user_id": user.id,
@@ -247,10 +273,10 @@ class AuthService:
                 user.last_seen = datetime.utcnow()
             
             self.db.commit()
-            print(f"✅ 批量更新 {len(users)} 个用户状态为: {status}")
+            logger.info("✅ 批量更新 %d 个用户状态为: %s", len(users), status)
             return True
         except Exception as e:
-            print(f"❌ 批量更新用户状态失败: {e}")
+            logger.error("❌ 批量更新用户状态失败: %s", e)
             self.db.rollback()
             return False
     
@@ -258,17 +284,17 @@ class AuthService:
         """清理长期不活跃的用户（模拟功能）"""
         # 注意：实际项目中应该谨慎使用此功能
         # 这里只是模拟，实际应该标记为不活跃而不是删除
-        print(f"⚠️  清理不活跃用户功能已禁用（安全考虑）")
+        logger.warning("⚠️  清理不活跃用户功能已禁用（安全考虑）")
         return 0
     
     def is_user_online(self, user_id: int) -> bool:
         """检查用户是否在线"""
-        user = self.get_user_by_id(user_id)
+        user = self._get_user_row(user_id)
         return user is not None and user.status == "online"
     
     def get_user_activity(self, user_id: int) -> Optional[dict]:
         """获取用户活动信息"""
-        user = self.get_user_by_id(user_id)
+        user = self._get_user_row(user_id)
         if user:
             return {
                 "user_id": user.id,
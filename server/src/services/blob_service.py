@@ -0,0 +1,50 @@
+from typing import Optional
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models.user import Blob, Message
+
+
+class BlobService:
+    def __init__(self, db: Session):
+        self.db = db
+    
+    def get_blob(self, sha256: str) -> Optional[Blob]:
+        return self.db.query(Blob).filter(Blob.sha256 == sha256).first()
+    
+    def register(self, sha256: str, path: str, size: int, mime_type: str = None) -> Blob:
+        """记录一份新内容；已有记录时原样返回（重复上传、并发上传相同内容）"""
+        blob = self.get_blob(sha256)
+        if blob is not None:
+            return blob
+        blob = Blob(sha256=sha256, path=path, size=size, mime_type=mime_type)
+        self.db.add(blob)
+        try:
+            self.db.commit()
+            return blob
+        except IntegrityError:
+            # 并发的另一条消息刚刚创建了记录
+            self.db.rollback()
+            return self.get_blob(sha256)
+    
+    def get_storage_stats(self) -> dict:
+        """磁盘实际占用与按引用计算的逻辑大小；引用数直接按 messages.file_path 统计"""
+        blob_count, physical_bytes = self.db.query(
+            func.count(Blob.sha256),
+            func.coalesce(func.sum(Blob.size), 0)
+        ).one()
+        references, logical_bytes = (
+            self.db.query(func.count(Message.id), func.coalesce(func.sum(Blob.size), 0))
+            .join(Blob, Blob.path == Message.file_path)
+            .one()
+        )
+        return {
+            "blobs": blob_count,
+            "references": int(references),
+            "physical_bytes": int(physical_bytes),
+            "logical_bytes": int(logical_bytes),
+            "saved_bytes": int(logical_bytes - physical_bytes),
+            "dedup_ratio": round(logical_bytes / physical_bytes, 3) if physical_bytes else 1.0
+        }
@@ -0,0 +1,51 @@
+from typing import Optional
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from models.user import Group, group_members
+
+
+class GroupService:
+    def __init__(self, db: Session):
+        self.db = db
+    
+    def create_group(self, name: str, created_by: int, description: Optional[str] = None) -> Group:
+        """创建群组，创建者自动成为成员"""
+        group = Group(name=name, description=description, created_by=created_by)
+        self.db.add(group)
+        self.db.flush()
+        self.db.execute(insert(group_members).values(group_id=group.id, user_id=created_by))
+        self.db.commit()
+        self.db.refresh(group)
+        return group
+    
+    def get_group(self, group_id: int) -> Optional[Group]:
+        return self.db.query(Group).filter(Group.id == group_id).first()
+    
+    def is_member(self, group_id: int, user_id: int) -> bool:
+        row = self.db.execute(
+            select(group_members.c.user_id).where(
+                group_members.c.group_id == group_id,
+                group_members.c.user_id == user_id
+            )
+        ).first()
+        return row is not None
+    
+    def add_member(self, group_id: int, user_id: int) -> bool:
+        """添加成员，已是成员时返回 False"""
+        if self.is_member(group_id, user_id):
+            return False
+        self.db.execute(insert(group_members).values(group_id=group_id, user_id=user_id))
+        self.db.commit()
+        return True
+    
+    def remove_member(self, group_id: int, user_id: int) -> bool:
+        result = self.db.execute(
+            delete(group_members).where(
+                group_members.c.group_id == group_id,
+                group_members.c.user_id == user_id
+            )
+        )
+        self.db.commit()
+        return result.rowcount > 0
@@ -0,0 +1,141 @@
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, tuple_
+from sqlalchemy.orm import Session
+
+from models.user import Message
+
+
+class MessageService:
+    def __init__(self, db: Session):
+        self.db = db
+    
+    def get_recent_messages(self, user_id: Optional[int] = None, limit: int = 50) -> List[dict]:
+        """获取最近的消息（按时间正序），发送者/接收者用户名随消息一起加载"""
+        query = self.db.query(Message).options(*Message.serialization_options())
+        
+        # 如果指定了用户ID，只获取该用户发送或接收的消息
+        if user_id:
+            query = query.filter(
+                (Message.sender_id == user_id) | (Message.receiver_id == user_id)
+            )
+        
+        messages = query.order_by(Message.timestamp.desc()).limit(limit).all()
+        return [self.to_response(m) for m in reversed(messages)]
+    
+    def get_message(self, message_id: int) -> Optional[dict]:
+        message = (
+            self.db.query(Message)
+            .options(*Message.serialization_options())
+            .filter(Message.id == message_id)
+            .first()
+        )
+        return self.to_response(message) if message else None
+    
+    @staticmethod
+    def to_response(m: Message) -> dict:
+        """消息的返回格式（列表、历史分页、离线补发共用），需用 Message.serialization_options() 加载关联对象"""
+        return {
+            "id": m.id,
+            "content": m.content,
+            "message_type": m.message_type,
+            "file_name": m.file_name,
+            "file_size": m.file_size,
+            "mime_type": m.mime_type,
+            "sender_id": m.sender_id,
+            "sender_username": m.sender.username if m.sender else "Unknown",
+            "receiver_id": m.receiver_id,
+            "receiver_username": m.receiver.username if m.receiver else None,
+            "group_id": m.group_id,
+            "timestamp": m.timestamp.isoformat() if m.timestamp else None,
+            "is_read": m.is_read
+        }
+    
+    def get_undelivered_messages(self, receiver_id: int, after_id: int = 0, limit: int = 100) -> List[dict]:
+        """按ID顺序获取一批未送达给接收者的消息（键集分页，不会一次加载全部）"""
+        messages = (
+            self.db.query(Message)
+            .options(*Message.serialization_options())
+            .filter(
+                Message.receiver_id == receiver_id,
+                Message.delivered == False,  # noqa: E712
+                Message.id > after_id
+            )
+            .order_by(Message.id)
+            .limit(limit)
+            .all()
+        )
+        return [self.to_response(m) for m in messages]
+    
+    def mark_delivered(self, receiver_id: int, message_ids: List[int]) -> int:
+        """把已补发给接收者的消息标记为已送达"""
+        updated = (
+            self.db.query(Message)
+            .filter(
+                Message.receiver_id == receiver_id,
+                Message.id.in_(message_ids)
+            )
+            .update({Message.delivered: True}, synchronize_session=False)
+        )
+        self.db.commit()
+        return updated
+    
+    def mark_delivered_by_ids(self, message_ids: List[int]) -> int:
+        """把已实时推送的消息标记为已送达"""
+        updated = (
+            self.db.query(Message)
+            .filter(Message.id.in_(message_ids))
+            .update({Message.delivered: True}, synchronize_session=False)
+        )
+        self.db.commit()
+        return updated
+    
+    def get_conversation_page(self, user_id: Optional[int] = None, peer_id: Optional[int] = None,
+                              group_id: Optional[int] = None,
+                              before: Optional[Tuple[datetime, int]] = None,
+                              after: Optional[Tuple[datetime, int]] = None,
+                              limit: int = 50) -> Tuple[List[dict], bool]:
+        """按 (timestamp, id) 键集分页获取一个会话的消息，返回按时间正序的一页消息和是否还有更多
+
+        私聊会话由 user_id 和 peer_id 确定，群聊由 group_id 确定，都不指定时为公共消息。
+        先在复合索引上只取 (timestamp, id) 定位这一页，再按主键取出整行。
+        """
+        if user_id and peer_id:
+            # 私聊两个方向各是一段连续的索引范围，分别取一页后合并
+            scopes = [
+                and_(Message.sender_id == user_id, Message.receiver_id == peer_id),
+                and_(Message.sender_id == peer_id, Message.receiver_id == user_id)
+            ]
+        else:
+            scopes = [and_(Message.group_id == group_id, Message.receiver_id.is_(None))]
+        
+        key = tuple_(Message.timestamp, Message.id)
+        descending = after is None
+        keys = []
+        for scope in scopes:
+            query = self.db.query(Message.timestamp, Message.id).filter(scope)
+            if before:
+                query = query.filter(key < before)
+            if after:
+                query = query.filter(key > after)
+            if descending:
+                query = query.order_by(Message.timestamp.desc(), Message.id.desc())
+            else:
+                query = query.order_by(Message.timestamp, Message.id)
+            keys.extend(query.limit(limit + 1).all())
+        
+        keys.sort(reverse=descending)
+        has_more = len(keys) > limit
+        page_ids = [message_id for _, message_id in keys[:limit]]
+        if not page_ids:
+            return [], False
+        
+        messages = (
+            self.db.query(Message)
+            .options(*Message.serialization_options())
+            .filter(Message.id.in_(page_ids))
+            .order_by(Message.timestamp, Message.id)
+            .all()
+        )
+        return [self.to_response(m) for m in messages], has_more
@@ -0,0 +1,132 @@
+# server/src/shared/wire_format.py
+#
+# WebSocket 帧格式：连接时通过子协议协商，默认 JSON 文本帧
+#
+# 客户端在 Sec-WebSocket-Protocol 中提供 chat.msgpack.v1，服务端安装了 msgpack 时选中它，
+# 之后双方都用 MessagePack 二进制帧：[类型码, data] 或 [类型码, data, 其他顶层字段]，
+# 常见消息类型用整数代替字符串。未协商或对方不支持时回退到 JSON。
+# 解码按帧类型区分：二进制帧是 MessagePack，文本帧是 JSON，两种格式都能随时收。
+#
+# 连接时带上 ?batch=1 的客户端可能收到合并帧：{"type": "batch", "data": [消息, ...]}，
+# MessagePack 下为 [类型码, [信封, ...]]，decode 会把其中的信封还原成消息，用 unpack 拆开。
+#
+# 客户端（client/src）也直接导入本模块，两端只有这一份实现。
+import json
+from datetime import date, datetime
+from typing import Any, List, Optional, Union
+
+try:
+    import msgpack
+except ImportError:  # 未安装 msgpack 时只支持 JSON
+    msgpack = None
+
+SUBPROTOCOL_MSGPACK = "chat.msgpack.v1"
+
+# 类型码只能追加，不能修改已有的编号
+TYPE_CODES = {
+    "ping": 1,
+    "pong": 2,
+    "message_send": 3,
+    "private_message": 4,
+    "group_message": 5,
+    "message_sent": 6,
+    "user_status_update": 7,
+    "typing_start": 8,
+    "typing_stop": 9,
+    "offline_messages": 10,
+    "file_message": 11,
+    "combined_message": 12,
+    "error": 13,
+    "user_list": 14,
+    "message_receive": 15,
+    "user_join": 16,
+    "user_leave": 17,
+    "batch": 18,
+}
+TYPE_NAMES = {code: name for name, code in TYPE_CODES.items()}
+
+BATCH_TYPE = "batch"
+
+
+def supported_subprotocols() -> List[str]:
+    """本端支持的子协议，按优先顺序"""
+    return [SUBPROTOCOL_MSGPACK] if msgpack is not None else []
+
+
+def negotiate(offered: List[str]) -> Optional[str]:
+    """服务端：从客户端提供的子协议中选择一个，都不支持时返回 None（使用 JSON）"""
+    supported = supported_subprotocols()
+    for subprotocol in offered or ():
+        if subprotocol in supported:
+            return subprotocol
+    return None
+
+
+def is_binary(subprotocol: Optional[str]) -> bool:
+    return subprotocol == SUBPROTOCOL_MSGPACK
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+
+def encode_json(message: dict) -> str:
+    return json.dumps(message, separators=(",", ":"), default=_default)
+
+
+def encode_msgpack(message: dict) -> bytes:
+    message_type = message.get("type")
+    envelope = [TYPE_CODES.get(message_type, message_type), message.get("data")]
+    if len(message) > 2 or "data" not in message:
+        extra = {key: value for key, value in message.items() if key not in ("type", "data")}
+        if extra:
+            envelope.append(extra)
+    return msgpack.packb(envelope, use_bin_type=True, default=_default)
+
+
+def encode_batch_json(texts: List[str]) -> str:
+    """把已编码的 JSON 消息拼成一个合并帧，不重新序列化"""
+    return '{"type":"batch","data":[' + ",".join(texts) + "]}"
+
+
+def encode_batch_msgpack(envelopes: List[bytes]) -> bytes:
+    """把已编码的 MessagePack 信封拼成一个合并帧，不重新序列化"""
+    packer = msgpack.Packer()
+    return (packer.pack_array_header(2) + packer.pack(TYPE_CODES[BATCH_TYPE])
+            + packer.pack_array_header(len(envelopes)) + b"".join(envelopes))
+
+
+def encode(message: dict, subprotocol: Optional[str] = None) -> Union[str, bytes]:
+    """按协商结果编码：MessagePack 返回 bytes（二进制帧），JSON 返回 str（文本帧）"""
+    if is_binary(subprotocol):
+        return encode_msgpack(message)
+    return encode_json(message)
+
+
+def decode(frame: Union[str, bytes]) -> Any:
+    """解码收到的帧：bytes 按 MessagePack，str 按 JSON"""
+    if isinstance(frame, str):
+        return json.loads(frame)
+    if msgpack is None:
+        raise ValueError("Received a binary frame but msgpack is not installed")
+    message = _from_envelope(msgpack.unpackb(frame, raw=False))
+    if message["type"] == BATCH_TYPE:
+        message["data"] = [_from_envelope(envelope) for envelope in message["data"]]
+    return message
+
+
+def _from_envelope(envelope: list) -> dict:
+    message_type = envelope[0]
+    message = {"type": TYPE_NAMES.get(message_type, message_type), "data": envelope[1]}
+    if len(envelope) > 2:
+        message.update(envelope[2])
+    return message
+
+
+def unpack(message: dict) -> List[dict]:
+    """合并帧返回其中的消息列表，普通消息返回只含它自己的列表"""
+    if message.get("type") == BATCH_TYPE:
+        return message.get("data") or []
+    return [message]
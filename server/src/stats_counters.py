@@ -0,0 +1,115 @@
+# server/src/stats_counters.py
+import asyncio
+import time
+from collections import deque
+from typing import Optional
+
+from sqlalchemy import func
+
+from app_logging import get_logger
+from db_executor import DatabaseExecutor
+from models.user import User, Message
+
+logger = get_logger("stats")
+
+RATE_WINDOWS = (1, 5, 15, 60)
+
+
+class StatsCounters:
+    """系统统计计数器：消息落库、注册时增量更新，/stats 直接读取，不再扫描表
+
+    计数只覆盖本进程的写入，后台任务定期用 COUNT(*) 对账，修正其他 worker 的写入、
+    删除以及对账期间正在提交的消息带来的误差。消息速率按分钟分桶统计本进程的写入。
+    """
+
+    def __init__(self, db_executor: DatabaseExecutor, reconcile_interval: float = 300.0):
+        self.db_executor = db_executor
+        self.reconcile_interval = reconcile_interval
+        self.total_users = 0
+        self.total_messages = 0
+        self.connections = 0
+        self._minutes = deque(maxlen=max(RATE_WINDOWS) + 1)  # [分钟序号, 消息数]
+        self._task: Optional[asyncio.Task] = None
+
+        # 对账信息
+        self.reconciled_at: Optional[float] = None
+        self.reconcile_count = 0
+        self.last_drift = {"users": 0, "messages": 0}
+
+    def record_messages(self, count: int = 1):
+        self.total_messages += count
+        minute = int(time.time() // 60)
+        if self._minutes and self._minutes[-1][0] == minute:
+            self._minutes[-1][1] += count
+        else:
+            self._minutes.append([minute, count])
+
+    def record_user_registered(self):
+        self.total_users += 1
+
+    def record_connection(self):
+        self.connections += 1
+
+    def message_rates(self) -> dict:
+        """最近 N 个完整分钟的平均每分钟消息数，以及当前分钟已写入的消息数"""
+        current = int(time.time() // 60)
+        rates = {}
+        for window in RATE_WINDOWS:
+            total = sum(count for minute, count in self._minutes if current - window <= minute < current)
+            rates[f"{window}m"] = round(total / window, 2)
+        rates["current_minute"] = self._minutes[-1][1] if self._minutes and self._minutes[-1][0] == current else 0
+        return rates
+
+    @staticmethod
+    def _count_rows(db) -> tuple:
+        return db.query(func.count(User.id)).scalar(), db.query(func.count(Message.id)).scalar()
+
+    async def reconcile(self):
+        """用数据库中的实际行数校准计数器"""
+        users_before, messages_before = self.total_users, self.total_messages
+        total_users, total_messages = await self.db_executor.run_in_session(self._count_rows)
+        # 查询期间本进程新增的部分保留下来
+        users_delta = self.total_users - users_before
+        messages_delta = self.total_messages - messages_before
+        if self.reconciled_at is not None:
+            self.last_drift = {
+                "users": total_users - users_before,
+                "messages": total_messages - messages_before
+            }
+        self.total_users = total_users + users_delta
+        self.total_messages = total_messages + messages_delta
+        self.reconciled_at = time.time()
+        self.reconcile_count += 1
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.error("❌ 统计计数对账失败: %s", e)
+
+    def snapshot(self, online_users: int) -> dict:
+        return {
+            "total_users": self.total_users,
+            "total_messages": self.total_messages,
+            "online_users": online_users,
+            "offline_users": max(0, self.total_users - online_users),
+            "connections": self.connections,
+            "messages_per_minute": self.message_rates(),
+            "reconciled_at": self.reconciled_at,
+            "last_drift": self.last_drift
+        }
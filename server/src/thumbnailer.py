@@ -0,0 +1,134 @@
+# server/src/thumbnailer.py
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Set
+
+from sqlalchemy.orm import Session
+
+from app_logging import get_logger
+from db_executor import DatabaseExecutor
+from file_io import FileIOExecutor
+from models.user import Message
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow 未安装时不生成缩略图，客户端回退到原图
+    Image = None
+
+logger = get_logger("thumbnailer")
+
+
+def render_thumbnail(source_path: str, target_path: str, size: int, quality: int) -> str:
+    """在进程池中执行：把图片缩小到 size×size 以内并保存为 WebP"""
+    with Image.open(source_path) as image:
+        # JPEG 可以直接按接近目标的比例解码，省去大部分解码开销
+        image.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        tmp_path = f"{target_path}.{os.getpid()}.tmp"
+        image.save(tmp_path, "WEBP", quality=quality, method=4)
+    os.replace(tmp_path, target_path)
+    return target_path
+
+
+class ThumbnailGenerator:
+    """图片缩略图流水线：在独立进程池中生成 WebP 预览图，不占用事件循环和数据库线程
+
+    缩略图按原图的存储文件名（sha256）命名，相同图片只生成一次。
+    生成后回写到所有引用该图片的消息的 thumbnail_path。
+    """
+
+    def __init__(self, thumbnail_dir: str, db_executor: DatabaseExecutor, file_io: FileIOExecutor,
+                 max_workers: int = 2, size: int = 256, quality: int = 75):
+        self.thumbnail_dir = thumbnail_dir
+        self.db_executor = db_executor
+        self.file_io = file_io
+        self.max_workers = max_workers
+        self.size = size
+        self.quality = quality
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._tasks: Set[asyncio.Task] = set()
+        os.makedirs(thumbnail_dir, exist_ok=True)
+
+        # 统计信息
+        self.generated_count = 0
+        self.reused_count = 0
+        self.failed_count = 0
+        self.total_ms = 0.0
+
+    @property
+    def available(self) -> bool:
+        return Image is not None
+
+    def path_for(self, file_path: str) -> str:
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        return os.path.join(self.thumbnail_dir, f"{name}_{self.size}.webp")
+
+    def schedule(self, message_id: int, file_path: str):
+        """在后台为图片消息生成缩略图，不等待结果"""
+        if not self.available:
+            return
+        task = asyncio.create_task(self.generate_for_message(message_id, file_path))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def generate_for_message(self, message_id: int, file_path: str) -> Optional[str]:
+        thumbnail_path = await self.generate(file_path)
+        if thumbnail_path:
+            await self.db_executor.run_in_session(self._record, message_id, file_path, thumbnail_path)
+        return thumbnail_path
+
+    async def generate(self, file_path: str) -> Optional[str]:
+        """生成（或复用已有的）缩略图，失败时返回 None"""
+        if not self.available:
+            return None
+        target_path = self.path_for(file_path)
+        if await self.file_io.run(os.path.exists, target_path):
+            self.reused_count += 1
+            return target_path
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        start = time.perf_counter()
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                self._pool, render_thumbnail, file_path, target_path, self.size, self.quality
+            )
+        except Exception as e:
+            self.failed_count += 1
+            logger.warning("❌ 生成缩略图失败 %s: %s", file_path, e)
+            return None
+        self.generated_count += 1
+        self.total_ms += (time.perf_counter() - start) * 1000
+        return target_path
+
+    @staticmethod
+    def _record(db: Session, message_id: int, file_path: str, thumbnail_path: str):
+        db.query(Message).filter(
+            (Message.id == message_id) |
+            ((Message.file_path == file_path) & (Message.thumbnail_path.is_(None)))
+        ).update({Message.thumbnail_path: thumbnail_path}, synchronize_session=False)
+        db.commit()
+
+    async def stop(self):
+        """等待进行中的缩略图任务结束并关闭进程池"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._pool:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        return {
+            "available": self.available,
+            "pending": len(self._tasks),
+            "generated": self.generated_count,
+            "reused": self.reused_count,
+            "failed": self.failed_count,
+            "avg_ms": round(self.total_ms / self.generated_count, 3) if self.generated_count else 0,
+            "size": self.size,
+            "format": "webp"
+        }
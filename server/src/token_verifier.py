@@ -0,0 +1,75 @@
+# server/src/token_verifier.py
+import time
+from typing import Optional
+
+from jose import JWTError, jwt
+
+from cache import LRUCache
+
+
+class TokenUser:
+    """由令牌声明构造的用户，只包含连接期间需要的字段，不查询数据库"""
+
+    def __init__(self, id: int, username: str):
+        self.id = id
+        self.username = username
+
+
+class TokenVerifier:
+    """JWT 校验结果缓存：同一个令牌只做一次签名校验和解码
+
+    缓存条目在 ttl 秒后或令牌过期时（取较早者）失效，条目数有上限，超过后按 LRU 淘汰。
+    校验失败的令牌不缓存。
+    """
+
+    def __init__(self, secret_key: str, algorithm: str, max_size: int = 10000, ttl: float = 300):
+        self.secret_key = secret_key
+        self.algorithm = algorithm
+        self.ttl = ttl
+        self.cache = LRUCache(max_size)
+
+        # 统计信息
+        self.decoded_count = 0
+        self.rejected_count = 0
+        self.expired_count = 0
+
+    def verify(self, token: str) -> Optional[dict]:
+        """返回令牌声明，签名无效或已过期时返回 None"""
+        if not token:
+            return None
+        now = time.time()
+        entry = self.cache.get(token)
+        if entry is not None:
+            claims, expires_at = entry
+            if now < expires_at:
+                return claims
+            self.cache.invalidate(token)
+            self.expired_count += 1
+
+        try:
+            claims = jwt.decode(token, self.secret_key, algorithms=[self.algorithm])
+        except JWTError:
+            self.rejected_count += 1
+            return None
+        self.decoded_count += 1
+        expires_at = now + self.ttl
+        if "exp" in claims:
+            expires_at = min(expires_at, float(claims["exp"]))
+        self.cache.set(token, (claims, expires_at))
+        return claims
+
+    def user_from_token(self, token: str) -> Optional[TokenUser]:
+        """从令牌中取出用户身份（uid 和 sub 声明）"""
+        claims = self.verify(token)
+        if not claims or not isinstance(claims.get("uid"), int) or not claims.get("sub"):
+            return None
+        return TokenUser(claims["uid"], claims["sub"])
+
+    def stats(self) -> dict:
+        return {
+            "cache": self.cache.stats(),
+            "decoded": self.decoded_count,
+            "rejected": self.rejected_count,
+            "expired": self.expired_count,
+            "ttl": self.ttl
+        }
@@ -0,0 +1,124 @@
+# server/src/typing_indicator.py
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from app_logging import get_logger
+
+logger = get_logger("typing")
+
+# 会话范围：("private", 对方用户ID)、("group", 群组ID)，或未指定会话时的 PUBLIC_SCOPE（发给所有在线用户）
+Scope = Tuple[str, int]
+PUBLIC_SCOPE: Scope = ("public", 0)
+
+
+class TypingTracker:
+    """输入状态跟踪：合并重复的 typing 事件，由服务端负责过期
+
+    同一发送者在同一会话内持续输入时只转发第一次 typing_start，之后的事件只刷新过期时间；
+    超过 ttl 没有新的事件时由服务端发出 typing_stop，客户端不必发送停止消息。
+    每个发送者两次转发 typing_start 之间至少间隔 min_interval 秒。
+    """
+
+    def __init__(self, ttl: float = 5.0, min_interval: float = 1.0,
+                 on_expire: Optional[Callable[[int, Scope], Awaitable[None]]] = None):
+        self.ttl = ttl
+        self.min_interval = min_interval
+        self.on_expire = on_expire
+        self.deadlines: Dict[Tuple[int, Scope], float] = {}  # (user_id, scope) -> 过期时间
+        self.last_emitted: Dict[int, float] = {}  # user_id -> 上次转发 typing_start 的时间
+        self._task: Optional[asyncio.Task] = None
+
+        # 统计信息
+        self.received = 0
+        self.emitted = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+        self.forbidden = 0
+        self.expired = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def typing_started(self, user_id: int, scope: Optional[Scope]) -> bool:
+        """记录一次输入事件，返回是否需要转发 typing_start；scope 为 None 表示无权在该会话发送"""
+        self.received += 1
+        if scope is None:
+            self.forbidden += 1
+            return False
+        now = time.monotonic()
+        key = (user_id, scope)
+        if key in self.deadlines:
+            # 已经在输入中，只延长过期时间
+            self.deadlines[key] = now + self.ttl
+            self.coalesced += 1
+            return False
+        if now - self.last_emitted.get(user_id, float("-inf")) < self.min_interval:
+            self.rate_limited += 1
+            return False
+        self.deadlines[key] = now + self.ttl
+        self.last_emitted[user_id] = now
+        self.emitted += 1
+        return True
+
+    def typing_stopped(self, user_id: int, scope: Optional[Scope]) -> bool:
+        """显式停止或发送了消息，返回是否需要转发 typing_stop"""
+        self.received += 1
+        if scope is None:
+            self.forbidden += 1
+            return False
+        if self.deadlines.pop((user_id, scope), None) is None:
+            self.coalesced += 1
+            return False
+        self.emitted += 1
+        return True
+
+    def message_sent(self, user_id: int, scope: Optional[Scope]):
+        """发送者在该会话发出了消息，结束输入状态；接收方收到消息即可清除提示，不再单独发 typing_stop"""
+        if scope is not None:
+            self.deadlines.pop((user_id, scope), None)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(min(self.ttl / 4, 1.0))
+            now = time.monotonic()
+            expired = [key for key, deadline in self.deadlines.items() if deadline <= now]
+            for user_id, scope in expired:
+                # 等待发送期间可能又收到了输入事件或停止事件
+                if self.deadlines.get((user_id, scope), now + 1) > now:
+                    continue
+                del self.deadlines[(user_id, scope)]
+                self.expired += 1
+                if self.on_expire:
+                    try:
+                        await self.on_expire(user_id, scope)
+                    except Exception as e:
+                        logger.warning("❌ 发送输入过期通知失败: %s", e)
+            # 超过限速间隔的记录已无作用，清理掉避免随用户数增长
+            for user_id in [u for u, t in self.last_emitted.items() if now - t >= self.min_interval]:
+                del self.last_emitted[user_id]
+
+    def stats(self) -> dict:
+        return {
+            "active": len(self.deadlines),
+            "received": self.received,
+            "emitted": self.emitted,
+            "suppressed": {
+                "coalesced": self.coalesced,
+                "rate_limited": self.rate_limited,
+                "forbidden": self.forbidden
+            },
+            "expired": self.expired,
+            "ttl": self.ttl,
+            "min_interval": self.min_interval
+        }
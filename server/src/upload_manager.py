@@ -0,0 +1,303 @@
+# server/src/upload_manager.py
+import hashlib
+import os
+import secrets
+import time
+import uuid
+from typing import AsyncIterator, Dict, Optional
+
+from blob_store import BlobStore
+from file_io import FileIOExecutor
+from metrics import UPLOAD_BYTES
+
+UPLOAD_STATUS_UPLOADING = "uploading"
+UPLOAD_STATUS_COMPLETE = "complete"
+
+
+def _is_int(value) -> bool:
+    # JSON 中的 true/false 解析为 bool，bool 是 int 的子类，需要排除
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _unlink_quietly(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+class UploadError(ValueError):
+    """分块上传请求不合法，status_code 为返回给客户端的 HTTP 状态码"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class UploadSession:
+    """一次分块上传的状态：已按顺序写入的分块数、字节数和增量计算中的 sha256"""
+
+    def __init__(self, upload_id: str, sender_id: int, file_name: str, file_size: int,
+                 mime_type: str, chunk_size: int, part_path: str):
+        self.upload_id = upload_id
+        self.sender_id = sender_id
+        self.file_name = file_name
+        self.file_size = file_size
+        self.mime_type = mime_type
+        self.chunk_size = chunk_size
+        self.part_path = part_path
+        self.total_chunks = max(1, -(-file_size // chunk_size))
+        self.next_chunk = 0
+        self.received_bytes = 0
+        self.hasher = hashlib.sha256()
+        self.sha256: Optional[str] = None
+        self.status = UPLOAD_STATUS_UPLOADING
+        self.file_path: Optional[str] = None
+        # 跳过上传时证明持有内容用的随机串，见 BlobStore.prove_possession
+        self.challenge = secrets.token_hex(16)
+        self.writing = False
+        self.updated_at = time.monotonic()
+
+    def expected_chunk_size(self, index: int) -> int:
+        if index == self.total_chunks - 1:
+            return self.file_size - self.chunk_size * index
+        return self.chunk_size
+
+    def to_dict(self) -> dict:
+        return {
+            "upload_id": self.upload_id,
+            "file_name": self.file_name,
+            "file_size": self.file_size,
+            "mime_type": self.mime_type,
+            "chunk_size": self.chunk_size,
+            "total_chunks": self.total_chunks,
+            "next_chunk": self.next_chunk,
+            "received_bytes": self.received_bytes,
+            "status": self.status,
+            "sha256": self.sha256,
+            "challenge": self.challenge
+        }
+
+
+class ChunkedUploadManager:
+    """分块上传：分块按顺序直接流式写入磁盘，同时增量计算 sha256，内存占用与文件大小无关
+
+    连接中断时未写完的分块会被截断丢弃，客户端通过查询状态得到 next_chunk 后从该分块继续上传；
+    重复发送已经写入的分块直接返回成功，不会重复写入。
+
+    上传会话只保存在创建它的进程内存中：多 worker 部署时，同一 upload_id 的请求必须由同一个
+    worker 处理（负载均衡按 upload_id 做会话保持），否则其他 worker 返回 404；进程重启后
+    进行中的上传全部失效，客户端需要重新开始，遗留的临时文件在启动时由 sweep_orphans 清理。
+    """
+
+    def __init__(self, upload_dir: str, blob_store: BlobStore, file_io: FileIOExecutor,
+                 chunk_size: int = 1024 * 1024, max_file_size: int = 2 * 1024 * 1024 * 1024,
+                 session_ttl: float = 24 * 3600):
+        self.upload_dir = upload_dir
+        self.blob_store = blob_store
+        self.file_io = file_io
+        self.partial_dir = os.path.join(upload_dir, ".partial")
+        self.chunk_size = chunk_size
+        self.max_file_size = max_file_size
+        self.session_ttl = session_ttl
+        self.sessions: Dict[str, UploadSession] = {}
+        os.makedirs(self.partial_dir, exist_ok=True)
+
+        # 统计信息
+        self.completed_count = 0
+        self.received_bytes = 0
+
+    async def create(self, sender_id: int, file_name: str, file_size: int, mime_type: str = None,
+                     chunk_size: int = None) -> UploadSession:
+        """开始一次上传，返回上传会话
+
+        不论服务端是否已有相同内容，返回的会话都一样，不能用来探测别人上传过的文件。
+        """
+        await self.cleanup_expired()
+        if not file_name or not isinstance(file_name, str):
+            raise UploadError(400, "file_name is required")
+        if not _is_int(file_size) or file_size < 0:
+            raise UploadError(400, "file_size must be a non-negative integer")
+        if file_size > self.max_file_size:
+            raise UploadError(413, f"File too large, limit is {self.max_file_size} bytes")
+        if chunk_size is not None and not _is_int(chunk_size):
+            raise UploadError(400, "chunk_size must be an integer")
+        chunk_size = min(chunk_size or self.chunk_size, self.chunk_size)
+        if chunk_size <= 0:
+            raise UploadError(400, "chunk_size must be positive")
+
+        upload_id = uuid.uuid4().hex
+        part_path = os.path.join(self.partial_dir, f"{upload_id}.part")
+        session = UploadSession(upload_id, sender_id, os.path.basename(file_name), file_size,
+                                mime_type or "application/octet-stream", chunk_size, part_path)
+        await self.file_io.run(self._create_empty, part_path)
+        self.sessions[upload_id] = session
+        return session
+
+    @staticmethod
+    def _create_empty(path: str):
+        open(path, "wb").close()
+
+    def get(self, upload_id: str) -> UploadSession:
+        session = self.sessions.get(upload_id)
+        if session is None:
+            raise UploadError(404, "Upload not found")
+        return session
+
+    async def write_chunk(self, upload_id: str, index: int, stream: AsyncIterator[bytes]) -> UploadSession:
+        """把一个分块的请求体流式追加到临时文件"""
+        session = self.get(upload_id)
+        if session.status != UPLOAD_STATUS_UPLOADING:
+            raise UploadError(409, "Upload already completed")
+        if index < 0 or index >= session.total_chunks:
+            raise UploadError(400, f"Chunk index out of range (0-{session.total_chunks - 1})")
+        if index < session.next_chunk:
+            # 客户端没收到上次的响应而重发，分块已经写入
+            return session
+        if index > session.next_chunk:
+            raise UploadError(409, f"Chunks must be uploaded in order, expected chunk {session.next_chunk}")
+        if session.writing:
+            raise UploadError(409, f"Chunk {index} is already being uploaded")
+
+        expected = session.expected_chunk_size(index)
+        # 在副本上计算哈希，分块写入失败时丢弃，不影响已确认的部分
+        hasher = session.hasher.copy()
+        written = 0
+        file_io = self.file_io
+        session.writing = True
+        try:
+            f = await file_io.run(open, session.part_path, "r+b")
+            try:
+                await file_io.run(f.seek, session.received_bytes)
+                async for piece in stream:
+                    if not piece:
+                        continue
+                    written += len(piece)
+                    if written > expected:
+                        raise UploadError(413, f"Chunk {index} exceeds expected size {expected}")
+                    # 每次写入单独占用写盘名额，慢客户端不会长期占着名额；哈希计算也在线程中完成
+                    await file_io.write(self._write_piece, f, hasher, piece)
+                if written != expected:
+                    raise UploadError(400, f"Chunk {index} has {written} bytes, expected {expected}")
+                await file_io.write(f.flush)
+            except BaseException:
+                # 丢弃写了一半的分块，下次从同一位置重新写
+                await file_io.run(f.truncate, session.received_bytes)
+                raise
+            finally:
+                await file_io.run(f.close)
+        finally:
+            session.writing = False
+
+        session.hasher = hasher
+        session.received_bytes += written
+        session.next_chunk += 1
+        session.updated_at = time.monotonic()
+        self.received_bytes += written
+        UPLOAD_BYTES.labels("chunked").inc(written)
+        return session
+
+    @staticmethod
+    def _write_piece(f, hasher, piece: bytes):
+        hasher.update(piece)
+        f.write(piece)
+
+    async def complete(self, upload_id: str, sender_id: int, sha256: str = None,
+                       proof: str = None) -> UploadSession:
+        """所有分块写完后校验并把临时文件放入内容寻址存储
+
+        还没有上传任何分块时，客户端可以提交 sha256 和 proof 证明持有内容，服务端已有该内容时
+        直接完成；否则与未上传完一样返回 409。
+        """
+        session = self.get(upload_id)
+        if session.sender_id != sender_id:
+            raise UploadError(403, "Upload belongs to another user")
+        if session.status == UPLOAD_STATUS_COMPLETE:
+            return session
+        if proof and isinstance(sha256, str) and session.received_bytes == 0 and not session.writing:
+            existing_path = await self.blob_store.prove_possession(
+                sha256.lower(), session.file_size, session.challenge, proof
+            )
+            if session.status == UPLOAD_STATUS_COMPLETE:
+                return session
+            # 校验期间客户端可能已经开始上传分块，这时按正常上传处理
+            if existing_path and session.received_bytes == 0 and not session.writing:
+                return await self._complete_existing(session, existing_path, sha256.lower())
+        if session.writing or session.received_bytes != session.file_size:
+            raise UploadError(409, f"Upload incomplete, expected chunk {session.next_chunk}")
+        digest = session.hasher.hexdigest()
+        if sha256 and sha256.lower() != digest:
+            raise UploadError(422, "sha256 mismatch")
+
+        # 按内容存储，相同文件只保留一份
+        session.file_path = await self.blob_store.store_file(session.part_path, digest)
+        session.sha256 = digest
+        session.status = UPLOAD_STATUS_COMPLETE
+        session.updated_at = time.monotonic()
+        self.completed_count += 1
+        return session
+
+    async def _complete_existing(self, session: UploadSession, existing_path: str, sha256: str) -> UploadSession:
+        await self.file_io.run(_unlink_quietly, session.part_path)
+        session.next_chunk = session.total_chunks
+        session.received_bytes = session.file_size
+        session.file_path = existing_path
+        session.sha256 = sha256
+        session.status = UPLOAD_STATUS_COMPLETE
+        session.updated_at = time.monotonic()
+        self.completed_count += 1
+        self.blob_store.record_skipped_upload(session.file_size)
+        return session
+
+    def claim(self, upload_id: str, sender_id: int) -> UploadSession:
+        """消息引用已完成的上传，一次上传只能被一条消息使用"""
+        session = self.get(upload_id)
+        if session.sender_id != sender_id:
+            raise UploadError(403, "Upload belongs to another user")
+        if session.status != UPLOAD_STATUS_COMPLETE:
+            raise UploadError(409, "Upload is not completed")
+        del self.sessions[upload_id]
+        return session
+
+    async def cleanup_expired(self):
+        """清理长时间没有进展的上传会话及其临时文件"""
+        now = time.monotonic()
+        for upload_id, session in list(self.sessions.items()):
+            if session.writing or now - session.updated_at < self.session_ttl:
+                continue
+            del self.sessions[upload_id]
+            # 已完成的文件在存储中可能被其他消息共享，只清理未完成的临时文件
+            if session.status == UPLOAD_STATUS_UPLOADING:
+                await self.file_io.run(_unlink_quietly, session.part_path)
+
+    async def sweep_orphans(self, min_age: float = 0.0) -> int:
+        """删除不属于本进程任何会话的临时文件（上次运行遗留），返回删除的文件数
+
+        min_age 为文件至少多久没有修改（秒）才删除；其他 worker 仍在运行时应传入会话 TTL，
+        避免删掉它们正在写入的文件。
+        """
+        own = {session.part_path for session in self.sessions.values()}
+        return await self.file_io.run(self._sweep, own, min_age)
+
+    def _sweep(self, own: set, min_age: float) -> int:
+        removed = 0
+        cutoff = time.time() - min_age
+        for entry in os.scandir(self.partial_dir):
+            if not entry.name.endswith(".part") or entry.path in own:
+                continue
+            try:
+                if entry.stat().st_mtime <= cutoff:
+                    os.unlink(entry.path)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def stats(self) -> dict:
+        return {
+            "active_uploads": sum(1 for s in self.sessions.values() if s.status == UPLOAD_STATUS_UPLOADING),
+            "completed_unclaimed": sum(1 for s in self.sessions.values() if s.status == UPLOAD_STATUS_COMPLETE),
+            "completed": self.completed_count,
+            "received_bytes": self.received_bytes
+        }
@@ -0,0 +1,130 @@
+# server/src/user_directory.py
+import threading
+import time
+from typing import Callable, Optional
+
+from sqlalchemy.orm import Session
+
+from cache import LRUCache
+from models.user import User
+
+
+class DirectoryUser:
+    """用户目录中的只读快照，只包含很少变化的字段，在线状态由连接管理器维护
+
+    不包含密码哈希：登录每次从数据库读取，改密码后旧密码不会因为某个 worker 的缓存仍然有效。
+    """
+
+    __slots__ = ("id", "username", "email", "created_at", "expires_at")
+
+    def __init__(self, user: User, expires_at: float):
+        self.id = user.id
+        self.username = user.username
+        self.email = user.email
+        self.created_at = user.created_at
+        self.expires_at = expires_at
+
+
+class UserDirectory:
+    """进程内的用户目录缓存：按 ID 和用户名查找用户，命中时不访问数据库
+
+    注册、修改用户、删除用户时必须调用 invalidate。失效时递增版本号，
+    失效前开始、失效后才完成的加载结果不会写入缓存。
+    多 worker 部署时 on_invalidate 把失效通知转发给其他 worker（见 ConnectionManager），
+    对方调用 invalidate_local；条目最多保留 ttl 秒，通知丢失时旧数据也不会一直留在缓存中。
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300):
+        self.ttl = ttl
+        self._by_id = LRUCache(max_size)
+        self._ids = LRUCache(max_size)  # 用户名 -> 用户ID
+        self._generation = 0
+        self._lock = threading.Lock()
+        # 本进程发生失效后调用 on_invalidate(user_id, username)，可能在线程池中调用
+        self.on_invalidate: Optional[Callable[[Optional[int], Optional[str]], None]] = None
+
+        # 统计信息
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.remote_invalidations = 0
+        self.expired = 0
+
+    def get(self, user_id: int) -> Optional[DirectoryUser]:
+        """只查缓存，未命中或已过期返回 None"""
+        user = self._by_id.get(user_id)
+        if user is None:
+            return None
+        if time.monotonic() >= user.expires_at:
+            self._by_id.invalidate(user_id)
+            self.expired += 1
+            return None
+        self.hits += 1
+        return user
+
+    def get_by_username(self, username: str) -> Optional[DirectoryUser]:
+        user_id = self._ids.get(username)
+        user = self.get(user_id) if user_id is not None else None
+        if user is None or user.username != username:
+            return None
+        return user
+
+    def load(self, db: Session, user_id: int) -> Optional[DirectoryUser]:
+        """从数据库加载并放入缓存"""
+        return self._load(db, User.id == user_id)
+
+    def load_by_username(self, db: Session, username: str) -> Optional[DirectoryUser]:
+        return self._load(db, User.username == username)
+
+    def lookup(self, db: Session, user_id: int) -> Optional[DirectoryUser]:
+        return self.get(user_id) or self.load(db, user_id)
+
+    def lookup_by_username(self, db: Session, username: str) -> Optional[DirectoryUser]:
+        return self.get_by_username(username) or self.load_by_username(db, username)
+
+    def _load(self, db: Session, condition) -> Optional[DirectoryUser]:
+        self.misses += 1
+        generation = self._generation
+        user = db.query(User).filter(condition).first()
+        if user is None:
+            return None
+        entry = DirectoryUser(user, time.monotonic() + self.ttl)
+        with self._lock:
+            if generation == self._generation:
+                self._by_id.set(entry.id, entry)
+                self._ids.set(entry.username, entry.id)
+        return entry
+
+    def invalidate(self, user_id: int = None, username: str = None):
+        """用户信息变更后移除缓存条目，并通知其他 worker"""
+        self.invalidate_local(user_id, username)
+        if self.on_invalidate is not None:
+            self.on_invalidate(user_id, username)
+
+    def invalidate_local(self, user_id: int = None, username: str = None, remote: bool = False):
+        """只移除本进程的缓存条目；remote 表示来自其他 worker 的通知"""
+        if remote:
+            self.remote_invalidations += 1
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            entry = self._by_id.invalidate(user_id) if user_id is not None else None
+            if entry is not None:
+                self._ids.invalidate(entry.username)
+            if username is not None:
+                self._ids.invalidate(username)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._by_id),
+            "max_size": self._by_id.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0,
+            "evictions": self._by_id.evictions,
+            "invalidations": self.invalidations,
+            "remote_invalidations": self.remote_invalidations,
+            "expired": self.expired,
+            "ttl": self.ttl
+        }
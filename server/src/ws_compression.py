@@ -0,0 +1,152 @@
+# server/src/ws_compression.py
+#
+# WebSocket permessage-deflate（RFC 7692）：替换 uvicorn 默认的压缩扩展
+#
+# uvicorn 的 ws_per_message_deflate 只能开关，窗口和内存级别都是 zlib 默认值（15 / 8），
+# 每个连接的压缩器约占 256KB。这里：
+# - 窗口和内存级别可配置，12 / 5 时每个连接的压缩器约 45KB
+# - 小于 WS_COMPRESSION_MIN_SIZE 的单帧消息不压缩、不设置 RSV1，RFC 7692 允许逐条选择，
+#   对端照常接收。默认 0，全部压缩：同一连接保留压缩上下文，输入状态、心跳响应这类小帧
+#   和前面的帧高度重复，压缩后只剩十几个字节；基准中阈值 128 让线上字节从原始大小的 7% 涨到 17%，
+#   省下的只是每帧几微秒的压缩时间。只在 CPU 比带宽更紧张时调大
+# - 统计压缩前后字节数和压缩、解压耗时，在 /health 和 /metrics 中输出
+#
+# 不支持预置字典：RFC 7692 没有协商字典的参数，标准客户端（浏览器、websockets）无法使用。
+import os
+import sys
+import time
+from typing import List, Optional, Sequence, Tuple
+
+from uvicorn.protocols.websockets.websockets_impl import WebSocketProtocol
+from websockets import frames
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+
+# 添加项目根目录到Python路径
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from config.config import settings
+
+
+class CompressionStats:
+    """压缩计数，只在事件循环线程中更新"""
+
+    def __init__(self):
+        self.connections = 0
+        self.compressed_messages = 0
+        self.skipped_messages = 0
+        self.skipped_bytes = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.compress_seconds = 0.0
+        self.decompressed_messages = 0
+        self.decompressed_bytes_in = 0
+        self.decompressed_bytes_out = 0
+        self.decompress_seconds = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "enabled": settings.WS_COMPRESSION,
+            "min_size": settings.WS_COMPRESSION_MIN_SIZE,
+            "window_bits": settings.WS_COMPRESSION_WINDOW_BITS,
+            "mem_level": settings.WS_COMPRESSION_MEM_LEVEL,
+            "connections": self.connections,
+            "compressed_messages": self.compressed_messages,
+            "skipped_messages": self.skipped_messages,
+            "skipped_bytes": self.skipped_bytes,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "ratio": round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else None,
+            "compress_seconds": round(self.compress_seconds, 3),
+            "decompressed_messages": self.decompressed_messages,
+            "decompressed_bytes_in": self.decompressed_bytes_in,
+            "decompressed_bytes_out": self.decompressed_bytes_out,
+            "decompress_seconds": round(self.decompress_seconds, 3)
+        }
+
+
+compression_stats = CompressionStats()
+
+
+class ThresholdPerMessageDeflate(PerMessageDeflate):
+    """小于 min_size 的单帧消息原样发送，其余照常压缩，并记录字节数和耗时"""
+
+    def __init__(self, *args, min_size: int = 0, stats: CompressionStats = compression_stats, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+        self.stats = stats
+
+    def encode(self, frame: frames.Frame) -> frames.Frame:
+        if frame.opcode in frames.CTRL_OPCODES:
+            return frame
+        # 分片消息的第一帧已经决定压缩，后续帧必须一起压缩，所以只跳过不分片的小消息
+        if frame.opcode is not frames.OP_CONT and frame.fin and len(frame.data) < self.min_size:
+            self.stats.skipped_messages += 1
+            self.stats.skipped_bytes += len(frame.data)
+            return frame
+        start = time.perf_counter()
+        encoded = super().encode(frame)
+        self.stats.compress_seconds += time.perf_counter() - start
+        if frame.opcode is not frames.OP_CONT:
+            self.stats.compressed_messages += 1
+        self.stats.bytes_in += len(frame.data)
+        self.stats.bytes_out += len(encoded.data)
+        return encoded
+
+    def decode(self, frame: frames.Frame, *, max_size: Optional[int] = None) -> frames.Frame:
+        compressed = frame.rsv1 or (frame.opcode is frames.OP_CONT and self.decode_cont_data)
+        if frame.opcode in frames.CTRL_OPCODES or not compressed:
+            return super().decode(frame, max_size=max_size)
+        start = time.perf_counter()
+        decoded = super().decode(frame, max_size=max_size)
+        self.stats.decompress_seconds += time.perf_counter() - start
+        if frame.opcode is not frames.OP_CONT:
+            self.stats.decompressed_messages += 1
+        self.stats.decompressed_bytes_in += len(frame.data)
+        self.stats.decompressed_bytes_out += len(decoded.data)
+        return decoded
+
+
+class ThresholdDeflateFactory(ServerPerMessageDeflateFactory):
+    """协商过程与 websockets 相同，协商结果换成 ThresholdPerMessageDeflate"""
+
+    def __init__(self, min_size: int = 0, **kwargs):
+        super().__init__(**kwargs)
+        self.min_size = min_size
+
+    def process_request_params(self, params, accepted_extensions) -> Tuple[List, PerMessageDeflate]:
+        response_params, extension = super().process_request_params(params, accepted_extensions)
+        compression_stats.connections += 1
+        return response_params, ThresholdPerMessageDeflate(
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings,
+            min_size=self.min_size
+        )
+
+
+def compression_factory() -> ThresholdDeflateFactory:
+    """按配置创建压缩扩展：服务端压缩窗口和要求客户端使用的窗口相同"""
+    return ThresholdDeflateFactory(
+        min_size=settings.WS_COMPRESSION_MIN_SIZE,
+        server_max_window_bits=settings.WS_COMPRESSION_WINDOW_BITS,
+        client_max_window_bits=settings.WS_COMPRESSION_WINDOW_BITS,
+        compress_settings={"memLevel": settings.WS_COMPRESSION_MEM_LEVEL}
+    )
+
+
+class CompressedWebSocketProtocol(WebSocketProtocol):
+    """uvicorn 的 websockets 协议实现，压缩扩展换成 compression_factory()"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.available_extensions: Sequence = [compression_factory()] if settings.WS_COMPRESSION else []
+
+
+def uvicorn_ws_options() -> dict:
+    """传给 uvicorn.run 的 WebSocket 参数"""
+    return {"ws": CompressedWebSocketProtocol, "ws_per_message_deflate": settings.WS_COMPRESSION}
@@ -0,0 +1,108 @@
+# tests/conftest.py
+#
+# 服务端模块按 server/src 为根导入（与 run_server.py 相同）；数据库换成临时 SQLite，
+# 必须在导入 config 之前设置。main 在导入时按相对路径创建上传目录，用到它的测试在
+# 测试函数内导入，这时工作目录已经切换到临时目录
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "server", "src"), os.path.join(ROOT, "server")]
+
+_WORKDIR = tempfile.mkdtemp(prefix="chat-tests-")
+os.environ.setdefault("SQLITE_PATH", os.path.join(_WORKDIR, "test.db"))
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from starlette.testclient import TestClient
+
+from db_executor import DatabaseExecutor
+from models.user import Base, User
+from shared import wire_format
+
+
+class FakeWebSocket:
+    """记录写出的帧；fail=True 时发送抛出异常，模拟已断开的连接"""
+
+    def __init__(self, fail: bool = False):
+        self.frames = []
+        self.fail = fail
+
+    async def send_text(self, text: str):
+        self._record(text)
+
+    async def send_bytes(self, data: bytes):
+        self._record(data)
+
+    async def send_json(self, data: dict):
+        self._record(wire_format.encode_json(data))
+
+    def _record(self, frame):
+        if self.fail:
+            raise ConnectionError("socket closed")
+        self.frames.append(frame)
+
+    def messages(self) -> list:
+        """解码后的消息，合并帧拆成单条"""
+        decoded = []
+        for frame in self.frames:
+            decoded.extend(wire_format.unpack(wire_format.decode(frame)))
+        return decoded
+
+
+@pytest.fixture(scope="session", autouse=True)
+def workdir():
+    previous = os.getcwd()
+    os.chdir(_WORKDIR)
+    yield _WORKDIR
+    os.chdir(previous)
+
+
+@pytest.fixture
+def fake_websocket():
+    return FakeWebSocket
+
+
+@pytest.fixture
+def session_factory():
+    """内存 SQLite，所有线程共用一个连接；预置 alice(1) 和 bob(2)"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine, autoflush=False)
+    db = factory()
+    db.add_all([User(username=name, email=f"{name}@test.com", hashed_password="x") for name in ("alice", "bob")])
+    db.commit()
+    db.close()
+    yield factory
+    engine.dispose()
+
+
+@pytest.fixture
+def db_executor(session_factory):
+    executor = DatabaseExecutor(session_factory, max_workers=1)
+    yield executor
+    executor.shutdown()
+
+
+@pytest.fixture(scope="session")
+def app_client(workdir):
+    """main 的应用，预置 alice 和 bob；返回 (client, main, 用户ID, 登录令牌)
+
+    应用关闭时会关掉全局的线程池，所以整个测试会话只启动一次。
+    """
+    import main
+    from services.auth_service import AuthService
+
+    db = main.SessionLocal()
+    for name in ("alice", "bob"):
+        if not db.query(main.User).filter(main.User.username == name).first():
+            db.add(main.User(username=name, email=f"{name}@test.com", hashed_password="x"))
+    db.commit()
+    users = {name: db.query(main.User).filter(main.User.username == name).one().id for name in ("alice", "bob")}
+    tokens = {name: AuthService(db).create_access_token({"sub": name, "uid": uid}) for name, uid in users.items()}
+    db.close()
+    with TestClient(main.app) as client:
+        yield client, main, users, tokens
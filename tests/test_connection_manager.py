@@ -0,0 +1,75 @@
+import asyncio
+
+from connection_manager import ConnectionManager
+from token_verifier import TokenUser
+
+
+def test_old_socket_close_keeps_newer_connection(fake_websocket):
+    async def scenario():
+        manager = ConnectionManager()
+        user = TokenUser(1, "alice")
+        old, new = fake_websocket(), fake_websocket()
+        await manager.connect(old, user)
+        await manager.connect(new, user)
+
+        # 重新登录后旧连接才关闭
+        assert manager.disconnect(user, old) is False
+        assert manager.active_connections[1] is new
+        assert manager.fanout.senders[1].websocket is new
+        assert manager.user_status[1] == "online"
+
+        assert await manager.send_personal_json({"type": "ping", "data": {}}, 1)
+        assert await manager.fanout.flush(1, timeout=1)
+        assert any(m["type"] == "ping" for m in new.messages())
+
+        assert manager.disconnect(user, new) is True
+        assert 1 not in manager.active_connections
+        assert 1 not in manager.fanout.senders
+
+    asyncio.run(scenario())
+
+
+def test_group_created_reaches_other_workers(monkeypatch):
+    manager, other = ConnectionManager(), ConnectionManager()
+    published = []
+    monkeypatch.setattr(manager.message_bus, "publish_control", published.append)
+
+    manager.add_group(5, [1])
+    assert manager.group_index.get_members(5) == {1}
+
+    # 其他 worker 收到总线上的控制事件后，新群组出现在它的索引中
+    assert not other.group_index.has_group(5)
+    for event in published:
+        other._apply_control_event(event)
+    assert other.group_index.has_group(5)
+    assert other.group_index.is_member(5, 1)
+
+
+def test_public_typing_broadcast_and_rate_limited(fake_websocket):
+    async def scenario():
+        manager = ConnectionManager()
+        alice, bob = fake_websocket(), fake_websocket()
+        await manager.connect(alice, TokenUser(1, "alice"))
+        await manager.connect(bob, TokenUser(2, "bob"))
+
+        # 未指定会话的输入事件发给所有在线用户，同样受合并和限速约束
+        await manager.handle_typing(1, True, {})
+        await manager.handle_typing(1, True, {})
+        await manager.handle_typing(1, True, {"receiver_id": 2})
+        # 不是群成员的群聊输入事件不转发
+        await manager.handle_typing(1, True, {"group_id": 9})
+        await manager.handle_typing(1, False, {})
+        assert await manager.fanout.flush(2, timeout=1)
+        await manager.fanout.flush(1, timeout=1)
+
+        typing = [m for m in bob.messages() if m["type"].startswith("typing")]
+        assert [m["type"] for m in typing] == ["typing_start", "typing_stop"]
+        assert typing[0]["data"] == {"user_id": 1, "expires_in": manager.typing.ttl}
+        assert not any(m["type"].startswith("typing") for m in alice.messages())
+
+        suppressed = manager.typing.stats()["suppressed"]
+        assert suppressed == {"coalesced": 1, "rate_limited": 1, "forbidden": 1}
+        manager.disconnect(TokenUser(1, "alice"), alice)
+        manager.disconnect(TokenUser(2, "bob"), bob)
+
+    asyncio.run(scenario())
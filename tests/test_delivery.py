@@ -0,0 +1,103 @@
+import asyncio
+
+from connection_manager import ConnectionManager
+from models.user import Message
+from token_verifier import TokenUser
+
+ALICE = TokenUser(1, "alice")
+BOB = TokenUser(2, "bob")
+
+
+def save_private(session_factory, content="hi") -> int:
+    db = session_factory()
+    message = Message(content=content, message_type="private", sender_id=1, receiver_id=2, delivered=False)
+    db.add(message)
+    db.commit()
+    message_id = message.id
+    db.close()
+    return message_id
+
+
+def is_delivered(session_factory, message_id: int) -> bool:
+    db = session_factory()
+    try:
+        return db.get(Message, message_id).delivered
+    finally:
+        db.close()
+
+
+async def settle(manager: ConnectionManager, user_id: int):
+    """等发送队列写空、已送达标记写入数据库"""
+    await manager.fanout.flush(user_id, timeout=1)
+    await asyncio.sleep(0)
+    if manager._delivered_task is not None:
+        await manager._delivered_task
+
+
+def test_marked_delivered_after_write(session_factory, db_executor, fake_websocket):
+    message_id = save_private(session_factory)
+
+    async def scenario():
+        manager = ConnectionManager(db_executor)
+        websocket = fake_websocket()
+        await manager.connect(websocket, BOB)
+        assert await manager.send_private({"type": "private_message", "data": {"id": message_id}}, 2, [message_id])
+        await settle(manager, 2)
+        return websocket
+
+    websocket = asyncio.run(scenario())
+    assert any(m["type"] == "private_message" for m in websocket.messages())
+    assert is_delivered(session_factory, message_id)
+
+
+def test_failed_write_stays_undelivered(session_factory, db_executor, fake_websocket):
+    message_id = save_private(session_factory)
+
+    async def scenario():
+        manager = ConnectionManager(db_executor)
+        await manager.connect(fake_websocket(fail=True), BOB)
+        # 入队成功，但写出失败
+        assert await manager.send_private({"type": "private_message", "data": {"id": message_id}}, 2, [message_id])
+        await settle(manager, 2)
+
+    asyncio.run(scenario())
+    assert not is_delivered(session_factory, message_id)
+
+
+def test_message_dropped_by_reconnect_is_replayed(session_factory, db_executor, fake_websocket):
+    message_id = save_private(session_factory)
+
+    async def scenario():
+        manager = ConnectionManager(db_executor)
+        old, new = fake_websocket(), fake_websocket()
+        await manager.connect(old, BOB)
+        await manager.send_private({"type": "private_message", "data": {"id": message_id}}, 2, [message_id])
+        # 写协程还没运行，新连接替换了发送队列，队列中的消息被丢弃
+        await manager.connect(new, BOB)
+        manager.disconnect(BOB, old)
+        await settle(manager, 2)
+        assert not old.frames
+        assert not is_delivered(session_factory, message_id)
+
+        assert await manager.replay_offline_messages(BOB) == 1
+        return new
+
+    new = asyncio.run(scenario())
+    replayed = [m for m in new.messages() if m["type"] == "offline_messages"]
+    assert [m["id"] for m in replayed[0]["data"]["messages"]] == [message_id]
+    assert is_delivered(session_factory, message_id)
+
+
+def test_remote_worker_marks_delivered_after_write(session_factory, db_executor, fake_websocket):
+    message_id = save_private(session_factory)
+
+    async def scenario():
+        # 接收者所在的 worker 收到带消息ID的转发
+        manager = ConnectionManager(db_executor)
+        websocket = fake_websocket()
+        await manager.connect(websocket, BOB)
+        manager._deliver_from_bus("private", (2, [message_id]), {"type": "private_message", "data": {}})
+        await settle(manager, 2)
+
+    asyncio.run(scenario())
+    assert is_delivered(session_factory, message_id)
@@ -0,0 +1,116 @@
+import asyncio
+
+from fanout import EncodedFrame, FanoutEngine
+
+
+class BlockedWebSocket:
+    """写操作一直挂起，直到 release；模拟读得很慢的客户端"""
+
+    def __init__(self):
+        self.released = asyncio.Event()
+        self.frames = []
+
+    async def send_text(self, text: str):
+        await self.released.wait()
+        self.frames.append(text)
+
+    send_bytes = send_text
+
+    async def send_json(self, data: dict):
+        await self.send_text(data)
+
+
+def test_full_queue_drops_and_counts():
+    async def scenario():
+        engine = FanoutEngine(max_queue_size=2)
+        websocket = BlockedWebSocket()
+        engine.register(1, websocket)
+        assert engine.send(1, {"n": 0})
+        await asyncio.sleep(0)
+        # 第一条已被写协程取出并挂起，队列还能放两条
+        assert engine.send(1, {"n": 1})
+        assert engine.send(1, {"n": 2})
+        assert not engine.send(1, {"n": 3})
+        assert engine.total_dropped_count() == 1
+
+        websocket.released.set()
+        assert await engine.flush(1, timeout=1)
+        assert [frame["n"] for frame in websocket.frames] == [0, 1, 2]
+        engine.unregister(1)
+        assert engine.total_dropped_count() == 1
+
+    asyncio.run(scenario())
+
+
+def test_batching_merges_queued_messages(fake_websocket):
+    async def scenario():
+        engine = FanoutEngine(batch_interval=0.01)
+        websocket = fake_websocket()
+        engine.register(1, websocket, batch=True)
+        for n in range(3):
+            engine.send(1, {"n": n})
+        engine.send(1, EncodedFrame({"n": 3}))
+        assert await engine.flush(1, timeout=1)
+
+        assert len(websocket.frames) == 1
+        assert [m["n"] for m in websocket.messages()] == [0, 1, 2, 3]
+        assert engine.senders[1].stats()["sent"] == 4
+        engine.unregister(1)
+
+    asyncio.run(scenario())
+
+
+def test_unbatched_connection_sends_one_frame_per_message(fake_websocket):
+    async def scenario():
+        engine = FanoutEngine(batch_interval=0.01)
+        websocket = fake_websocket()
+        engine.register(1, websocket)
+        engine.broadcast({"n": 0})
+        engine.broadcast({"n": 1})
+        assert await engine.flush(1, timeout=1)
+        assert [m["n"] for m in websocket.messages()] == [0, 1]
+        assert len(websocket.frames) == 2
+        engine.unregister(1)
+
+    asyncio.run(scenario())
+
+
+def test_failed_write_abandons_queue_and_reports(fake_websocket):
+    async def scenario():
+        failures = []
+        engine = FanoutEngine(on_failure=lambda user_id, ws: failures.append(user_id))
+        websocket = fake_websocket(fail=True)
+        engine.register(1, websocket)
+        sender = engine.senders[1]
+        sent = []
+        for n in range(3):
+            engine.send(1, {"n": n}, on_sent=lambda: sent.append(True))
+        # 写失败后剩余消息被放弃，flush 立即返回而不是挂起
+        assert not await sender.flush(timeout=1)
+        await asyncio.sleep(0)
+        assert failures == [1]
+        assert 1 not in engine.senders
+        assert sent == []
+        assert not engine.send(1, {"n": 4})
+
+    asyncio.run(scenario())
+
+
+def test_reconnect_replaces_sender_and_closes_old_one(fake_websocket):
+    async def scenario():
+        engine = FanoutEngine()
+        old, new = fake_websocket(), fake_websocket()
+        old_sender = engine.register(1, old)
+        new_sender = engine.register(1, new)
+        await asyncio.sleep(0)
+        assert old_sender.closed and old_sender.task.cancelled()
+
+        # 旧连接的清理不能移除新连接
+        engine.unregister(1, old)
+        assert engine.senders[1] is new_sender
+        engine.send(1, {"n": 1})
+        assert await engine.flush(1, timeout=1)
+        assert new.messages() == [{"n": 1}]
+        engine.unregister(1, new)
+
+    asyncio.run(scenario())
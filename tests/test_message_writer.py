@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from message_writer import MessageWriter
+from models.user import Message
+
+
+def new_message(content: str, sender_id: int = 1) -> Message:
+    return Message(content=content, message_type="private", sender_id=sender_id, receiver_id=2)
+
+
+def stored_contents(session_factory) -> list:
+    db = session_factory()
+    try:
+        return [m.content for m in db.query(Message).order_by(Message.id)]
+    finally:
+        db.close()
+
+
+def test_concurrent_submits_share_one_commit(db_executor, session_factory):
+    async def scenario():
+        writer = MessageWriter(db_executor, window_ms=20)
+        saved = await asyncio.gather(*(writer.submit(new_message(f"m{n}")) for n in range(5)))
+        await writer.stop()
+        return writer, saved
+
+    writer, saved = asyncio.run(scenario())
+    assert writer.batch_count == 1
+    assert writer.message_count == 5
+    # future 完成时消息已经提交，ID 可用且各不相同
+    assert len({m.id for m in saved}) == 5
+    assert [m.content for m in saved] == [f"m{n}" for n in range(5)]
+    assert stored_contents(session_factory) == [f"m{n}" for n in range(5)]
+
+
+def test_failed_commit_fails_every_submitter(db_executor, session_factory):
+    async def scenario():
+        writer = MessageWriter(db_executor, window_ms=20)
+        # sender_id 为空违反 NOT NULL，整批回滚
+        results = await asyncio.gather(
+            writer.submit(new_message("ok")),
+            writer.submit(new_message("bad", sender_id=None)),
+            return_exceptions=True
+        )
+        await writer.stop()
+        return writer, results
+
+    writer, results = asyncio.run(scenario())
+    assert all(isinstance(result, Exception) for result in results)
+    assert writer.failed_count == 2
+    assert stored_contents(session_factory) == []
+
+
+def test_stop_writes_pending_messages(db_executor, session_factory):
+    async def scenario():
+        writer = MessageWriter(db_executor, window_ms=50, max_batch_size=2)
+        submits = [asyncio.create_task(writer.submit(new_message(f"m{n}"))) for n in range(5)]
+        await asyncio.sleep(0)
+        await writer.stop()
+        return await asyncio.gather(*submits)
+
+    saved = asyncio.run(scenario())
+    assert all(m.id is not None for m in saved)
+    assert stored_contents(session_factory) == [f"m{n}" for n in range(5)]
+
+
+@pytest.mark.parametrize("window_ms", [0, 5])
+def test_sequential_submits_each_commit(db_executor, session_factory, window_ms):
+    async def scenario():
+        writer = MessageWriter(db_executor, window_ms=window_ms)
+        first = await writer.submit(new_message("first"))
+        second = await writer.submit(new_message("second"))
+        await writer.stop()
+        return writer, first, second
+
+    writer, first, second = asyncio.run(scenario())
+    assert writer.batch_count == 2
+    assert second.id > first.id
+
+
+def test_misaligned_ids_fall_back_to_row_inserts(db_executor, session_factory, monkeypatch):
+    """MySQL 路径：SQLite 的 executemany 不更新 lastrowid，推算的ID对不上，写入器应当发现并逐行重插"""
+    engine = session_factory.kw["bind"]
+    monkeypatch.setattr(engine.dialect, "insert_executemany_returning", False)
+
+    async def scenario():
+        writer = MessageWriter(db_executor, window_ms=20)
+        saved = await asyncio.gather(*(writer.submit(new_message(f"m{n}")) for n in range(3)))
+        await writer.stop()
+        return saved
+
+    saved = asyncio.run(scenario())
+    db = session_factory()
+    try:
+        assert [db.get(Message, m.id).content for m in saved] == ["m0", "m1", "m2"]
+        assert db.query(Message).count() == 3
+    finally:
+        db.close()
@@ -0,0 +1,84 @@
+# 一页历史消息的 SQL 次数必须是常数，不随行数增长（防止 N+1 回归）
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from models.user import Base, User, Message, Group
+from services.message_service import MessageService
+
+USERS = 60
+PAGE_SIZES = (5, 50)
+
+CASES = {
+    "recent": lambda s, ids, n: s.get_recent_messages(ids["user"], n),
+    "private_page": lambda s, ids, n: s.get_conversation_page(ids["user"], ids["peer"], limit=n),
+    "group_page": lambda s, ids, n: s.get_conversation_page(group_id=ids["group"], limit=n),
+    "undelivered": lambda s, ids, n: s.get_undelivered_messages(ids["user"], limit=n),
+}
+
+
+@pytest.fixture(scope="module")
+def history():
+    """每条消息的发送者各不相同，懒加载时每行都会触发一次新查询"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine, autoflush=False)
+    db = factory()
+    users = [User(username=f"user{i}", email=f"user{i}@test.com", hashed_password="x") for i in range(USERS)]
+    db.add_all(users)
+    db.flush()
+    group = Group(name="group", created_by=users[0].id)
+    db.add(group)
+    db.flush()
+    base = datetime(2024, 1, 1)
+    for i, user in enumerate(users):
+        db.add(Message(content=f"private {i}", sender_id=user.id, receiver_id=users[0].id,
+                       timestamp=base + timedelta(seconds=i), delivered=False))
+        db.add(Message(content=f"group {i}", sender_id=user.id, group_id=group.id,
+                       timestamp=base + timedelta(seconds=i)))
+    db.commit()
+    ids = {"user": users[0].id, "peer": users[1].id, "group": group.id}
+    db.close()
+    yield engine, factory, ids
+    engine.dispose()
+
+
+def count_queries(engine, factory, run) -> int:
+    statements = []
+
+    def on_execute(*args):
+        statements.append(args[2])
+
+    # 每次使用新会话，避免身份映射中的缓存掩盖懒加载
+    db = factory()
+    event.listen(engine, "before_cursor_execute", on_execute)
+    try:
+        run(db)
+    finally:
+        event.remove(engine, "before_cursor_execute", on_execute)
+        db.close()
+    return len(statements)
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_query_count_independent_of_page_size(history, case):
+    engine, factory, ids = history
+    counts = [
+        count_queries(engine, factory, lambda db: CASES[case](MessageService(db), ids, size))
+        for size in PAGE_SIZES
+    ]
+    assert counts[0] == counts[1], f"{case}: {dict(zip(PAGE_SIZES, counts))}"
+
+
+def test_lazy_loading_baseline_grows(history):
+    """对照：不预加载关联对象时序列化同样一页会逐行查询，确认计数方法能发现 N+1"""
+    engine, factory, _ = history
+
+    def serialize_lazily(db):
+        messages = db.query(Message).order_by(Message.timestamp.desc()).limit(max(PAGE_SIZES)).all()
+        [MessageService.to_response(m) for m in messages]
+
+    assert count_queries(engine, factory, serialize_lazily) > max(PAGE_SIZES) // 2
@@ -0,0 +1,63 @@
+import time
+
+
+def wait_for(condition, timeout: float = 2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def receive_until(websocket, message_type: str, limit: int = 20) -> dict:
+    for _ in range(limit):
+        message = websocket.receive_json()
+        if message["type"] == message_type:
+            return message
+    raise AssertionError(f"no {message_type} message received")
+
+
+def test_reconnect_overlapping_old_close_keeps_receiving(app_client, monkeypatch):
+    """客户端重连时旧连接还在关闭：旧连接的清理不能让新连接收不到消息"""
+    client, main, users, tokens = app_client
+    bob = users["bob"]
+    manager = main.connection_manager
+
+    # 记录断开处理的结果，等旧连接的清理执行完再检查
+    disconnects = []
+    original_disconnect = manager.disconnect
+
+    def record_disconnect(user, websocket=None):
+        went_offline = original_disconnect(user, websocket)
+        disconnects.append(went_offline)
+        return went_offline
+
+    monkeypatch.setattr(manager, "disconnect", record_disconnect)
+
+    old = client.websocket_connect(f"/ws/{bob}?token={tokens['bob']}")
+    old.__enter__()
+    with client.websocket_connect(f"/ws/{bob}?token={tokens['bob']}") as new:
+        receive_until(new, "user_status_update")
+        current = manager.active_connections[bob]
+        old.__exit__(None, None, None)
+        assert wait_for(lambda: disconnects)
+        assert disconnects == [False]
+        assert manager.active_connections.get(bob) is current
+        assert manager.fanout.senders[bob].websocket is current
+
+        response = client.post("/send-message", json={
+            "sender_id": users["alice"], "receiver_id": bob, "message_type": "private", "content": "still there?"
+        })
+        assert response.status_code == 200
+        message = receive_until(new, "private_message")
+        assert message["data"]["content"] == "still there?"
+
+        def delivered() -> bool:
+            db = main.SessionLocal()
+            try:
+                return db.get(main.Message, message["data"]["id"]).delivered
+            finally:
+                db.close()
+
+        assert wait_for(delivered)
@@ -0,0 +1,101 @@
+import hashlib
+
+CONTENT = b"the same meme, forwarded again\n" * 1000
+
+
+def start_upload(client, sender_id: int, content: bytes = CONTENT) -> dict:
+    response = client.post("/uploads", json={
+        "sender_id": sender_id, "file_name": "meme.txt", "file_size": len(content), "mime_type": "text/plain"
+    })
+    assert response.status_code == 200
+    return response.json()
+
+
+def upload_chunks(client, upload: dict, content: bytes = CONTENT):
+    size = upload["chunk_size"]
+    for index in range(upload["total_chunks"]):
+        response = client.put(f"/uploads/{upload['upload_id']}/chunks/{index}",
+                              content=content[index * size:(index + 1) * size])
+        assert response.status_code == 200
+
+
+def proof_for(upload: dict, content: bytes = CONTENT) -> str:
+    return hashlib.sha256(upload["challenge"].encode() + content).hexdigest()
+
+
+def send_file(client, sender_id: int, upload: dict) -> dict:
+    response = client.post("/send-file", json={"sender_id": sender_id, "upload_id": upload["upload_id"]})
+    assert response.status_code == 200
+    return response.json()["data"]
+
+
+def test_create_response_does_not_reveal_existing_content(app_client):
+    client, main, users, _ = app_client
+    sha256 = hashlib.sha256(CONTENT).hexdigest()
+    before = start_upload(client, users["alice"])
+    upload_chunks(client, before)
+    client.post(f"/uploads/{before['upload_id']}/complete", json={"sender_id": users["alice"]})
+
+    # 内容已在服务端，别人带着哈希来开始上传，看到的仍是普通的待上传会话
+    response = client.post("/uploads", json={
+        "sender_id": users["bob"], "file_name": "x", "file_size": len(CONTENT), "sha256": sha256
+    })
+    after = response.json()
+    assert after["status"] == "uploading" and after["next_chunk"] == 0
+    assert set(after) == set(before)
+
+    # 只知道哈希、没有内容时无法完成，与服务端没有该内容时的结果相同
+    for upload_sha in (sha256, "0" * 64):
+        response = client.post(f"/uploads/{after['upload_id']}/complete", json={
+            "sender_id": users["bob"], "sha256": upload_sha, "proof": sha256
+        })
+        assert response.status_code == 409
+    assert client.get(f"/download/{sha256}").status_code == 404
+
+
+def test_proof_of_possession_skips_upload(app_client):
+    client, main, users, _ = app_client
+    first = start_upload(client, users["alice"])
+    upload_chunks(client, first)
+    client.post(f"/uploads/{first['upload_id']}/complete", json={"sender_id": users["alice"]})
+    skipped_before = main.blob_store.uploads_skipped
+
+    upload = start_upload(client, users["bob"])
+    response = client.post(f"/uploads/{upload['upload_id']}/complete", json={
+        "sender_id": users["bob"], "sha256": hashlib.sha256(CONTENT).hexdigest(), "proof": proof_for(upload)
+    })
+    assert response.status_code == 200
+    assert response.json()["status"] == "complete"
+    assert main.blob_store.uploads_skipped == skipped_before + 1
+    sent = send_file(client, users["bob"], upload)
+    assert client.get(sent["content"]).content == CONTENT
+
+
+def test_each_message_gets_its_own_download_id(app_client):
+    client, main, users, _ = app_client
+    urls = []
+    for sender in ("alice", "bob"):
+        upload = start_upload(client, users[sender])
+        upload_chunks(client, upload)
+        client.post(f"/uploads/{upload['upload_id']}/complete", json={"sender_id": users[sender]})
+        urls.append(send_file(client, users[sender], upload)["content"])
+
+    assert urls[0] != urls[1]
+    assert hashlib.sha256(CONTENT).hexdigest() not in urls[0] + urls[1]
+    for url in urls:
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.content == CONTENT
+        assert 'filename="meme.txt"' in response.headers["content-disposition"]
+
+
+def test_form_upload_download_url_is_random(app_client):
+    client, main, users, _ = app_client
+    response = client.post("/upload-file", data={"sender_id": str(users["alice"])},
+                           files={"file": ("note.txt", CONTENT, "text/plain")})
+    assert response.status_code == 200
+    url = response.json()["data"]["content"]
+    assert hashlib.sha256(CONTENT).hexdigest() not in url
+    download = client.get(url)
+    assert download.content == CONTENT
+    assert 'filename="note.txt"' in download.headers["content-disposition"]
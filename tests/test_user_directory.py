@@ -0,0 +1,46 @@
+import pytest
+from sqlalchemy import event
+
+from services.auth_service import AuthService, user_directory
+
+
+def count_queries(engine) -> list:
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    return statements
+
+
+@pytest.fixture(autouse=True)
+def fresh_directory(monkeypatch):
+    """各测试的数据库 ID 会重复，先清掉前面测试留下的条目和失效通知回调"""
+    monkeypatch.setattr(user_directory, "on_invalidate", None)
+    user_directory.invalidate_local(1, "alice")
+    user_directory.invalidate_local(2, "bob")
+
+
+def test_getters_served_from_directory(session_factory):
+    db = session_factory()
+    statements = count_queries(db.get_bind())
+    try:
+        service = AuthService(db)
+        assert service.get_user_by_username("alice").id == 1
+        assert len(statements) == 1
+
+        # 按用户名加载后，按 ID 和用户名都命中缓存，不再查询
+        assert service.get_user_by_id(1).username == "alice"
+        assert service.get_user_by_username("alice").id == 1
+        assert len(statements) == 1
+    finally:
+        db.close()
+
+
+def test_password_change_invalidates_directory(session_factory):
+    db = session_factory()
+    try:
+        service = AuthService(db)
+        assert service.get_user_by_id(2).username == "bob"
+        assert service.update_user_password(2, "new-password")
+        assert user_directory.get(2) is None
+        assert service.get_user_by_id(3) is None
+    finally:
+        db.close()